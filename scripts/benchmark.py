@@ -0,0 +1,247 @@
+#!/usr/bin/env python3
+"""
+Benchmarks for the record pipeline: `generate_records`, JSON encoding of the
+translated records, and `put_records` against a stub EventBridge client.
+
+Each scenario is a batch of synthetic records (see synthetic.py). The best of
+several runs is reported as microseconds per record. Results can be saved as
+a baseline, and later runs compared to it; the run fails if any benchmark is
+slower than the baseline by more than the threshold.
+
+Baselines are only comparable on the same machine and python version, so
+save and compare them on the same host.
+"""
+from argparse import ArgumentParser
+import json
+import logging
+import os
+from os import path
+import sys
+import time
+
+BASE = path.dirname(path.dirname(path.abspath(__file__)))
+sys.path.insert(0, os.environ.get('BUILDDIR', path.join(BASE, 'build')))
+
+#pylint: disable=wrong-import-position
+import dynamodb_stream_events as init
+from dynamodb_stream_events import json as ddb_json
+from dynamodb_stream_events.streams import generate_records
+from synthetic import RecordShape, StubEventsClient, SyntheticRecords, TYPES_ALL, VIEW_TYPES
+
+DEFAULT_BASELINE = os.environ.get(
+    'BENCHMARK_BASELINE',
+    path.join(BASE, 'benchmarks', 'baseline.json')
+)
+DEFAULT_THRESHOLD = float(os.environ.get('BENCHMARK_THRESHOLD', '0.25'))
+DEFAULT_REPEAT = int(os.environ.get('BENCHMARK_REPEAT', '5'))
+
+SCENARIOS = {
+    'narrow':      (1000,  RecordShape(width=5)),
+    'wide':        (1000,  RecordShape(width=100)),
+    'nested':      (1000,  RecordShape(width=10, depth=4)),
+    'strings':     (1000,  RecordShape(width=20, types=('S',), string_size=256)),
+    'new-image':   (1000,  RecordShape(view_type='NEW_IMAGE')),
+    'keys-only':   (1000,  RecordShape(view_type='KEYS_ONLY')),
+    'single':      (1,     RecordShape()),
+    'batch-100':   (100,   RecordShape()),
+    'batch-10000': (10000, RecordShape()),
+}
+
+logger = logging.getLogger(__name__)
+
+def get_args():
+    """ Get the command line arguments. """
+    parser = ArgumentParser(description='Benchmark the DynamoDB Streams record pipeline.')
+    parser.add_argument(
+        '--debug', '-d',
+        action='store_true',
+        help='Enable debug logging.'
+    )
+    parser.add_argument(
+        '--scenario', '-s',
+        dest='scenarios',
+        choices=sorted(SCENARIOS.keys()) + ['custom'],
+        action='append',
+        help='Scenarios to run. Default: all the named scenarios.'
+    )
+    parser.add_argument(
+        '--batch-size',
+        type=int,
+        default=1000,
+        help='Records per batch for the custom scenario. Default: %(default)r'
+    )
+    parser.add_argument(
+        '--width',
+        type=int,
+        default=10,
+        help='Attributes per item for the custom scenario. Default: %(default)r'
+    )
+    parser.add_argument(
+        '--depth',
+        type=int,
+        default=0,
+        help='Nesting depth of L and M attributes for the custom scenario. Default: %(default)r'
+    )
+    parser.add_argument(
+        '--types',
+        nargs='+',
+        choices=TYPES_ALL,
+        default=list(TYPES_ALL),
+        help='Attribute types for the custom scenario. Default: all'
+    )
+    parser.add_argument(
+        '--view-type',
+        choices=VIEW_TYPES,
+        default='NEW_AND_OLD_IMAGES',
+        help='Stream view type for the custom scenario. Default: %(default)r'
+    )
+    parser.add_argument(
+        '--repeat', '-r',
+        type=int,
+        default=DEFAULT_REPEAT,
+        help='Runs of each benchmark; the best is reported. Default: %(default)r'
+    )
+    parser.add_argument(
+        '--baseline', '-b',
+        default=DEFAULT_BASELINE,
+        help='Baseline results file. Default: %(default)r'
+    )
+    parser.add_argument(
+        '--save',
+        action='store_true',
+        help='Save the results as the new baseline.'
+    )
+    parser.add_argument(
+        '--threshold', '-t',
+        type=float,
+        default=DEFAULT_THRESHOLD,
+        help='Allowed slowdown compared to the baseline (0.25 = 25%%). Default: %(default)r'
+    )
+    parser.add_argument(
+        '--output', '-o',
+        help='Also write the results to this JSON file.'
+    )
+
+    return parser.parse_args()
+
+def _best_of(repeat, func):
+    """ Run func `repeat` times and return the fastest time in seconds. """
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+def run_scenario(batch_size, shape, repeat):
+    """
+    Run the benchmarks for one scenario.
+
+    Args:
+        batch_size (int): records in the batch.
+        shape (RecordShape): shape of the records.
+        repeat (int): runs of each benchmark.
+
+    Returns:
+        dict: benchmark name to microseconds per record.
+    """
+    records = SyntheticRecords(shape).batch(batch_size)
+    translated = list(generate_records(records))
+    details = [r['dynamodb'] for r in translated]
+    events_clnt = StubEventsClient()
+
+    timings = {
+        'generate_records': _best_of(repeat, lambda: list(generate_records(records))),
+        'json.dumps': _best_of(repeat, lambda: [ddb_json.dumps(d) for d in details]),
+        'put_records': _best_of(
+            repeat,
+            lambda: init.put_records(records, _events_clnt=events_clnt)
+        ),
+    }
+    return {name: elapsed / batch_size * 1e6 for name, elapsed in timings.items()}
+
+def compare(results, baseline, threshold):
+    """
+    Compare results to a baseline.
+
+    Returns:
+        List[str]: descriptions of the regressions.
+    """
+    regressions = []
+    for scenario, benchmarks in results.items():
+        for name, value in benchmarks.items():
+            base_value = baseline.get(scenario, {}).get(name)
+            if not base_value:
+                continue
+            ratio = value / base_value
+            if ratio > 1 + threshold:
+                regressions.append(
+                    f"{scenario}/{name}: {value:.2f}us vs {base_value:.2f}us ({ratio - 1:+.0%})"
+                )
+    return regressions
+
+def main(args):
+    """ Run the benchmarks, and save or compare the baseline. """
+    if args.debug:
+        logger.setLevel(logging.DEBUG)
+    # The per-record debug logs would dominate the timings.
+    logging.getLogger('dynamodb_stream_events').setLevel(logging.WARNING)
+
+    scenarios = {}
+    for name in args.scenarios or sorted(SCENARIOS.keys()):
+        if name == 'custom':
+            scenarios[name] = (args.batch_size, RecordShape(
+                width=args.width,
+                depth=args.depth,
+                types=tuple(args.types),
+                view_type=args.view_type,
+            ))
+        else:
+            scenarios[name] = SCENARIOS[name]
+
+    results = {}
+    for name, (batch_size, shape) in scenarios.items():
+        logger.debug('Running %(name)s: %(shape)r', {'name': name, 'shape': shape})
+        results[name] = run_scenario(batch_size, shape, args.repeat)
+        for bench_name, value in results[name].items():
+            print(
+                f"{name:<14} {bench_name:<18} {value:10.2f} us/record "
+                f"{1e6 / value:12.0f} records/s"
+            )
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as output_p:
+            json.dump(results, output_p, indent=2, sort_keys=True)
+
+    if args.save:
+        os.makedirs(path.dirname(args.baseline), exist_ok=True)
+        baseline = {}
+        if path.exists(args.baseline):
+            with open(args.baseline, 'r', encoding='utf-8') as baseline_p:
+                baseline = json.load(baseline_p)
+        baseline.update(results)
+        with open(args.baseline, 'w', encoding='utf-8') as baseline_p:
+            json.dump(baseline, baseline_p, indent=2, sort_keys=True)
+        logger.info('Saved the baseline to %(path)s', {'path': args.baseline})
+        return 0
+
+    if not path.exists(args.baseline):
+        logger.info('No baseline to compare to: %(path)s', {'path': args.baseline})
+        return 0
+
+    with open(args.baseline, 'r', encoding='utf-8') as baseline_p:
+        baseline = json.load(baseline_p)
+    regressions = compare(results, baseline, args.threshold)
+    for regression in regressions:
+        logger.error('Regression: %(regression)s', {'regression': regression})
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    logging.basicConfig(
+        level=logging.INFO,
+        stream=sys.stderr,
+    )
+    sys.exit(main(get_args()))
@@ -0,0 +1,152 @@
+"""
+In-process stand-in for the DynamoDB Streams client, for testing the poller
+without AWS.
+
+Shards are added, filled and closed by the test, so shard splits and the
+parent to child lineage can be set up in any shape. `DescribeStream` pages
+through the shards, and iterators can be expired to check the poller
+recovers from its checkpoints.
+"""
+from threading import Lock
+
+
+class StreamsStandinError(Exception):
+    """ An API error, shaped like the botocore ClientError. """
+    def __init__(self, code, message):
+        super().__init__(f"An error occurred ({code}): {message}")
+        self.response = {'Error': {'Code': code, 'Message': message}}
+
+
+class DynamoDBStreamsStandin:
+    #pylint: disable=invalid-name,too-many-instance-attributes
+    """
+    The stand-in client. It only knows one stream.
+
+    Args:
+        stream_arn (str): ARN of the stream.
+        page_size (int): shards per `DescribeStream` page.
+    """
+
+    def __init__(self, stream_arn='arn:aws:dynamodb:us-east-2:123456789012:table/Test/stream/1',
+                 page_size=100):
+        self.stream_arn = stream_arn
+        self.page_size = page_size
+        self.status = 'ENABLED'
+        self.lock = Lock()
+        self.shards = {}
+        self.records = {}
+        self.closed = set()
+        self.sequence_number = 100000000000000000000
+        self.generation = 0
+        self.calls = dict(describe_stream=0, get_shard_iterator=0, get_records=0)
+
+    def add_shard(self, shard_id, parent_shard_id=None):
+        """ Add an open shard. """
+        with self.lock:
+            shard = dict(
+                ShardId=shard_id,
+                SequenceNumberRange=dict(StartingSequenceNumber=str(self.sequence_number)),
+            )
+            if parent_shard_id:
+                shard['ParentShardId'] = parent_shard_id
+            self.shards[shard_id] = shard
+            self.records[shard_id] = []
+
+    def add_records(self, shard_id, records):
+        """
+        Add records to an open shard. Each gets the next sequence number.
+
+        Returns:
+            List[str]: the sequence numbers.
+        """
+        sequence_numbers = []
+        with self.lock:
+            assert shard_id not in self.closed, f"{shard_id} is closed"
+            for record in records:
+                self.sequence_number += 1
+                record = dict(record)
+                record['dynamodb'] = dict(
+                    record.get('dynamodb', {}),
+                    SequenceNumber=str(self.sequence_number),
+                )
+                self.records[shard_id].append(record)
+                sequence_numbers.append(str(self.sequence_number))
+        return sequence_numbers
+
+    def close_shard(self, shard_id):
+        """ Close a shard; it returns no more iterators once read. """
+        with self.lock:
+            self.closed.add(shard_id)
+            self.shards[shard_id]['SequenceNumberRange']['EndingSequenceNumber'] = \
+                str(self.sequence_number)
+
+    def expire_iterators(self):
+        """ Make all the current iterators expired. """
+        with self.lock:
+            self.generation += 1
+
+    def _check_stream(self, stream_arn):
+        if stream_arn != self.stream_arn:
+            raise StreamsStandinError('ResourceNotFoundException', f"Unknown stream: {stream_arn}")
+
+    def describe_stream(self, StreamArn, ExclusiveStartShardId=None, Limit=None):
+        """ Describe the stream, a page of shards at a time. """
+        self._check_stream(StreamArn)
+        with self.lock:
+            self.calls['describe_stream'] += 1
+            shard_ids = list(self.shards)
+            if ExclusiveStartShardId:
+                shard_ids = shard_ids[shard_ids.index(ExclusiveStartShardId) + 1:]
+            page = shard_ids[:Limit or self.page_size]
+            desc = dict(
+                StreamArn=self.stream_arn,
+                StreamStatus=self.status,
+                StreamViewType='NEW_AND_OLD_IMAGES',
+                Shards=[dict(self.shards[shard_id]) for shard_id in page],
+            )
+            if len(page) < len(shard_ids):
+                desc['LastEvaluatedShardId'] = page[-1]
+        return dict(StreamDescription=desc)
+
+    def get_shard_iterator(self, StreamArn, ShardId, ShardIteratorType, SequenceNumber=None):
+        """ Get an iterator for a shard. """
+        self._check_stream(StreamArn)
+        with self.lock:
+            self.calls['get_shard_iterator'] += 1
+            records = self.records[ShardId]
+            if ShardIteratorType == 'TRIM_HORIZON':
+                position = 0
+            elif ShardIteratorType == 'LATEST':
+                position = len(records)
+            elif ShardIteratorType in ('AT_SEQUENCE_NUMBER', 'AFTER_SEQUENCE_NUMBER'):
+                # The first record at (or after) the sequence number.
+                start = int(SequenceNumber) + (ShardIteratorType == 'AFTER_SEQUENCE_NUMBER')
+                position = next(
+                    (
+                        idx for idx, r in enumerate(records)
+                        if int(r['dynamodb']['SequenceNumber']) >= start
+                    ),
+                    len(records)
+                )
+            else:
+                raise StreamsStandinError(
+                    'ValidationException',
+                    f"Invalid ShardIteratorType: {ShardIteratorType}"
+                )
+            return dict(ShardIterator=f"{self.generation}|{ShardId}|{position}")
+
+    def get_records(self, ShardIterator, Limit=1000):
+        """ Get the records from an iterator. """
+        generation, shard_id, position = ShardIterator.split('|')
+        with self.lock:
+            self.calls['get_records'] += 1
+            if int(generation) != self.generation:
+                raise StreamsStandinError('ExpiredIteratorException', 'Iterator expired')
+
+            position = int(position)
+            records = self.records[shard_id][position:position + Limit]
+            position += len(records)
+            result = dict(Records=[dict(r) for r in records])
+            if shard_id not in self.closed or position < len(self.records[shard_id]):
+                result['NextShardIterator'] = f"{self.generation}|{shard_id}|{position}"
+        return result
@@ -0,0 +1,191 @@
+"""
+Local HTTP stand-in for the EventBridge PutEvents API, for replaying batches
+and tests without AWS.
+
+It speaks the JSON 1.1 protocol botocore uses, so a normal boto3 client works
+against it with `endpoint_url`. It enforces the real request limits (1 to 10
+entries, 256 KiB total entry size) and can inject throttling, per-entry
+failures and added latency.
+"""
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import logging
+from random import Random
+from threading import Lock, Thread
+import time
+import uuid
+
+PUT_EVENTS_MAX_ENTRIES = 10
+PUT_EVENTS_MAX_BYTES = 256 * 1024
+PUT_EVENTS_TIME_BYTES = 14
+
+logger = logging.getLogger(__name__)
+
+
+def entry_size(entry):
+    """
+    Size of an entry, the way EventBridge calculates it. This deliberately
+    doesn't use the package's own version, since it's what is being checked.
+    """
+    size = PUT_EVENTS_TIME_BYTES if entry.get('Time') else 0
+    for k in ('Source', 'DetailType', 'Detail'):
+        if value := entry.get(k):
+            size += len(value.encode('utf-8'))
+    for resource in entry.get('Resources', []):
+        size += len(resource.encode('utf-8'))
+    return size
+
+
+class StandinError(Exception):
+    """ An error response for the API, with its HTTP status and type. """
+    def __init__(self, status, error_type, message):
+        super().__init__(message)
+        self.status = status
+        self.error_type = error_type
+        self.message = message
+
+
+class EventBridgeStandin:
+    #pylint: disable=too-many-instance-attributes
+    """
+    The stand-in server. Use it as a context manager to run it in a thread.
+
+    Args:
+        port (int): port to listen on; 0 picks a free one.
+        throttle_rate (float): fraction of requests rejected with a
+            ThrottlingException.
+        failure_rate (float): fraction of entries that fail with an
+            InternalFailure error code.
+        latency (float): seconds added to every request.
+        seed (int): random seed for the injected faults.
+    """
+
+    def __init__(self, port=0, throttle_rate=0.0, failure_rate=0.0, latency=0.0, seed=None):
+        self.throttle_rate = throttle_rate
+        self.failure_rate = failure_rate
+        self.latency = latency
+        self.random = Random(seed)
+        self.lock = Lock()
+        self.stats = dict(requests=0, throttled=0, invalid=0, entries=0, failed_entries=0)
+        self.events = []
+        self.keep_events = False
+
+        standin = self
+
+        class _Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                #pylint: disable=invalid-name,missing-function-docstring
+                standin.handle(self)
+
+            def log_message(self, format, *args):
+                #pylint: disable=redefined-builtin
+                logger.debug(format, *args)
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', port), _Handler)
+        self.server.daemon_threads = True
+        self.thread = None
+
+    @property
+    def endpoint_url(self):
+        """ URL to use as the client endpoint_url. """
+        host, port = self.server.server_address[0:2]
+        return f"http://{host}:{port}"
+
+    def __enter__(self):
+        self.thread = Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
+
+    def _count(self, name, value=1):
+        with self.lock:
+            self.stats[name] += value
+
+    def handle(self, request):
+        """ Handle an API request. """
+        body = request.rfile.read(int(request.headers.get('Content-Length', 0)))
+        target = request.headers.get('X-Amz-Target', '')
+        operation = target.rsplit('.', 1)[-1]
+
+        if self.latency:
+            time.sleep(self.latency)
+
+        try:
+            params = json.loads(body or b'{}')
+            if operation == 'PutEvents':
+                result = self.put_events(params)
+            elif operation == 'DescribeEventBus':
+                name = params.get('Name', 'default')
+                result = dict(
+                    Name=name,
+                    Arn=f"arn:aws:events:us-east-2:000000000000:event-bus/{name}",
+                )
+            else:
+                raise StandinError(400, 'UnknownOperationException', f"Unknown operation: {target}")
+        except StandinError as err:
+            self._respond(request, err.status, {'__type': err.error_type, 'message': err.message})
+        else:
+            self._respond(request, 200, result)
+
+    @staticmethod
+    def _respond(request, status, result):
+        data = json.dumps(result).encode('utf-8')
+        request.send_response(status)
+        request.send_header('Content-Type', 'application/x-amz-json-1.1')
+        request.send_header('Content-Length', str(len(data)))
+        request.send_header('x-amzn-RequestId', str(uuid.uuid4()))
+        request.end_headers()
+        request.wfile.write(data)
+
+    def put_events(self, params):
+        """
+        Validate and accept the entries of a PutEvents request.
+
+        Returns:
+            dict: the PutEvents response.
+        """
+        self._count('requests')
+        entries = params.get('Entries', [])
+        if not 1 <= len(entries) <= PUT_EVENTS_MAX_ENTRIES:
+            self._count('invalid')
+            raise StandinError(
+                400, 'ValidationException',
+                "1 validation error detected: Value at 'entries' failed to satisfy "
+                "constraint: Member must have length less than or equal to "
+                f"{PUT_EVENTS_MAX_ENTRIES}"
+            )
+        if sum(entry_size(e) for e in entries) > PUT_EVENTS_MAX_BYTES:
+            self._count('invalid')
+            raise StandinError(
+                400, 'ValidationException',
+                'Total size of the entries in the request is over the limit.'
+            )
+
+        with self.lock:
+            throttled = self.random.random() < self.throttle_rate
+            failures = [self.random.random() < self.failure_rate for _ in entries]
+        if throttled:
+            self._count('throttled')
+            raise StandinError(400, 'ThrottlingException', 'Rate exceeded')
+
+        result_entries = []
+        for entry, failed in zip(entries, failures):
+            if failed:
+                result_entries.append(dict(
+                    ErrorCode='InternalFailure',
+                    ErrorMessage='Injected failure',
+                ))
+            else:
+                result_entries.append(dict(EventId=str(uuid.uuid4())))
+                if self.keep_events:
+                    with self.lock:
+                        self.events.append(entry)
+
+        failed_count = sum(failures)
+        self._count('entries', len(entries))
+        self._count('failed_entries', failed_count)
+        return dict(FailedEntryCount=failed_count, Entries=result_entries)
@@ -13,6 +13,16 @@ than the version in S3, and should be uploaded:
 - symlinks have their target hashed.
 - All other files are hashed as is.
 
+The zip can optionally be optimized for cold starts, without changing the hash:
+
+- --compile adds precompiled bytecode for every module. The *.pyc files use
+  unchecked hashes, so they are deterministic and the runtime never checks
+  them against the source mtime. Run this with the same python version as the
+  Lambda runtime.
+- --prune skips files and directories matching the prune patterns (tests,
+  *.dist-info, etc). Patterns are matched against the path relative to the
+  build directory; see DEFAULT_PRUNE_PATTERNS.
+
 The command line options let you upload to a single destination, but you can
 upload to multiple at once with the PACKAGE_X_BUCKET env variables. It will
 upload a zip named with the hash and one with the environment (if specified)
@@ -21,19 +31,22 @@ for each destination. The objects contain this metadata:
 - package-hash
 - commit-hash
 """
-from argparse import ArgumentParser, FileType
+from argparse import ArgumentParser, BooleanOptionalAction, FileType
 from collections import namedtuple
 from concurrent.futures import ThreadPoolExecutor, as_completed
+from fnmatch import fnmatch
 from hashlib import sha256
+from importlib.util import cache_from_source
 import logging
 import os
 from os import path
+import py_compile
 import re
 from shutil import copyfileobj
 import stat
 import subprocess
 import sys
-from tempfile import NamedTemporaryFile
+from tempfile import NamedTemporaryFile, TemporaryDirectory
 import time
 from zipfile import ZIP_DEFLATED, ZipFile, ZipInfo
 
@@ -51,6 +64,24 @@ DEFAULT_PACKAGE_PREFIX = os.environ.get('PACKAGE_PREFIX', '')
 DEFAULT_PACKAGE_NAMES = os.environ.get('PACKAGE_NAMES', 'hash').split(',')
 DEFAULT_PACKAGE_KMS_KEY_ID = os.environ.get('PACKAGE_KMS_KEY_ID', 'alias/aws/s3')
 DEFAULT_PACKAGE_REGION = os.environ.get('PACKAGE_REGION', DEFAULT_REGION)
+DEFAULT_PACKAGE_COMPILE = os.environ.get('PACKAGE_COMPILE', '').lower() in ('1', 'true', 'yes')
+DEFAULT_PACKAGE_PRUNE = os.environ.get('PACKAGE_PRUNE', '').lower() in ('1', 'true', 'yes')
+# Careful: boto3/docs and botocore/docs are imported at runtime, so "docs"
+# directories can't be pruned in general.
+DEFAULT_PRUNE_PATTERNS = os.environ['PACKAGE_PRUNE_PATTERNS'].split(',') \
+    if os.environ.get('PACKAGE_PRUNE_PATTERNS') \
+    else [
+        '*.dist-info',
+        '*.egg-info',
+        '__pycache__',
+        '*/__pycache__',
+        'tests',
+        '*/tests',
+        '*.pyi',
+        '*.md',
+        '*.rst',
+        'Makefile',
+    ]
 
 ENV_PACKAGE_BUCKET_RE = re.compile(r'^PACKAGE_(?P<idx>\d+)_BUCKET$')
 LIBRARY_MIMETYPES = [
@@ -145,6 +176,26 @@ def get_args():
         help='The region the bucket is in. Default: %(default)r'
     )
 
+    parser.add_argument(
+        '--compile',
+        action=BooleanOptionalAction,
+        default=DEFAULT_PACKAGE_COMPILE,
+        help='Add unchecked-hash *.pyc files for all modules. Default: %(default)r'
+    )
+    parser.add_argument(
+        '--prune',
+        action=BooleanOptionalAction,
+        default=DEFAULT_PACKAGE_PRUNE,
+        help='Skip files matching the prune patterns. Default: %(default)r'
+    )
+    parser.add_argument(
+        '--prune-pattern',
+        metavar='PATTERN',
+        dest='prune_patterns',
+        action='append',
+        help=f"Pattern of paths to prune. Default: {DEFAULT_PRUNE_PATTERNS!r}"
+    )
+
     parser.add_argument(
         '--output', '-o',
         type=FileType('wb'),
@@ -155,7 +206,10 @@ def get_args():
         help='The location to get the artifacts from.'
     )
 
-    return parser.parse_args()
+    args = parser.parse_args()
+    if args.prune_patterns is None:
+        args.prune_patterns = DEFAULT_PRUNE_PATTERNS
+    return args
 
 def main(args):
     """
@@ -217,7 +271,12 @@ def main(args):
     has_errors = False
     package_hash = get_package_hash(args.path)
     with NamedTemporaryFile(prefix=f"{args.app}-", suffix='.zip', dir=TMPDIR, mode='w+b') as package_zip:
-        make_package_zip(args.path, package_zip)
+        make_package_zip(
+            args.path,
+            package_zip,
+            compile_pyc=args.compile,
+            prune_patterns=args.prune_patterns if args.prune else None,
+        )
 
         with ThreadPoolExecutor() as executor:
             future2upload = {}
@@ -263,7 +322,47 @@ def main(args):
 
     return 1 if has_errors else 0
 
-def make_package_zip(package_path, package_zip):
+def _is_pruned(file_rel, prune_patterns):
+    """ Check if a relative path matches any of the prune patterns. """
+    return any(fnmatch(file_rel, pattern) for pattern in prune_patterns)
+
+def _write_pyc(archive, file_path, file_rel, file_st):
+    """
+    Compile a python source file and add the unchecked-hash pyc to the
+    archive, where the import system will look for it.
+
+    Returns:
+        int: size of the pyc, or 0 if the file doesn't compile.
+    """
+    # py_compile replaces cfile rather than writing to it, so it needs a path
+    # and not an open file.
+    with TemporaryDirectory(dir=TMPDIR) as pyc_dir:
+        pyc_path = path.join(pyc_dir, 'module.pyc')
+        try:
+            py_compile.compile(
+                file_path,
+                cfile=pyc_path,
+                dfile=file_rel,
+                doraise=True,
+                invalidation_mode=py_compile.PycInvalidationMode.UNCHECKED_HASH,
+            )
+        except py_compile.PyCompileError as err:
+            logger.debug('%(file)s: unable to compile: %(err)s', {'file': file_rel, 'err': err})
+            return 0
+
+        with open(pyc_path, 'rb') as pyc_p:
+            pyc_data = pyc_p.read()
+
+        pyc_info = ZipInfo(
+            cache_from_source(file_rel),
+            time.localtime(file_st.st_mtime)[0:6]
+        )
+        pyc_info.compress_type = ZIP_DEFLATED
+        pyc_info.external_attr = 0o644 << 16
+        archive.writestr(pyc_info, pyc_data)
+        return len(pyc_data)
+
+def make_package_zip(package_path, package_zip, compile_pyc=False, prune_patterns=None):
     """
     Make the package zip file. This adds all the links and regular files to the
     package_zip from package_path.
@@ -271,15 +370,45 @@ def make_package_zip(package_path, package_zip):
     Args:
         package_path (str): the build directory of the package.
         package_zip (File-line): the open file to write the zip to.
+        compile_pyc (bool): add unchecked-hash pyc files for python modules.
+        prune_patterns (List[str]): skip paths matching these patterns.
+
+    Returns:
+        dict: sizes of the files added, pruned, and compiled.
     """
+    #pylint: disable=too-many-locals
     _logger = logger.getChild(f"make_package_zip({package_path})")
+    prune_patterns = prune_patterns or []
+    stats = dict(files=0, bytes=0, pruned_files=0, pruned_bytes=0, pyc_files=0, pyc_bytes=0)
     with ZipFile(package_zip, 'w', ZIP_DEFLATED) as archive:
-        for root, _, files in os.walk(package_path):
+        for root, dirs, files in os.walk(package_path):
+            if prune_patterns or compile_pyc:
+                _dirs = []
+                for _dir in sorted(dirs):
+                    _dir_rel = path.relpath(path.join(root, _dir), package_path)
+                    # Existing bytecode is timestamp based; it's replaced.
+                    if _is_pruned(_dir_rel, prune_patterns) \
+                            or (compile_pyc and _dir == '__pycache__'):
+                        _logger.debug('%(dir)s: pruned', {'dir': _dir_rel})
+                        for _root, _, _files in os.walk(path.join(root, _dir)):
+                            for _file in _files:
+                                stats['pruned_files'] += 1
+                                stats['pruned_bytes'] += os.lstat(path.join(_root, _file)).st_size
+                        continue
+                    _dirs.append(_dir)
+                dirs[:] = _dirs
+
             for file_name in files:
                 file_path = path.join(root, file_name)
                 file_rel = path.relpath(file_path, package_path)
 
                 file_st = os.stat(file_path, follow_symlinks=False)
+                if _is_pruned(file_rel, prune_patterns):
+                    _logger.debug('%(file)s: pruned', {'file': file_rel})
+                    stats['pruned_files'] += 1
+                    stats['pruned_bytes'] += file_st.st_size
+                    continue
+
                 if stat.S_ISLNK(file_st.st_mode):
                     # Need to create a ZipInfo object manually, and populate
                     # it with the correct file st_mode options. The content
@@ -296,14 +425,32 @@ def make_package_zip(package_path, package_zip):
                     # Regular file, just write it out
                     archive.write(file_path, file_rel)
 
+                    if compile_pyc and file_name.endswith('.py'):
+                        if pyc_size := _write_pyc(archive, file_path, file_rel, file_st):
+                            stats['pyc_files'] += 1
+                            stats['pyc_bytes'] += pyc_size
+
                 else:
                     _logger.warning(
                         '%(file)s: unknown type 0x%(mode)08x',
                         {'file': file_rel, 'mode': file_st.st_mode}
                     )
+                    continue
+
+                stats['files'] += 1
+                stats['bytes'] += file_st.st_size
 
     package_zip.flush()
 
+    stats['zip_bytes'] = package_zip.tell()
+    _logger.info(
+        'Added %(files)d files (%(bytes)d bytes); pruned %(pruned_files)d files '
+        '(-%(pruned_bytes)d bytes); compiled %(pyc_files)d modules (+%(pyc_bytes)d bytes); '
+        'zip is %(zip_bytes)d bytes',
+        stats
+    )
+    return stats
+
 def _get_package_hash_file(file_path):
     """ Get the contents of a file, in chunks. """
     with open(file_path, 'rb') as file_p:
@@ -0,0 +1,249 @@
+#!/usr/bin/env python3
+"""
+Replays captured DynamoDB Streams batches through the Lambda handler, to
+reproduce production behaviour offline.
+
+Each line of the input files is one batch: either a Lambda event
+(`{"Records": [...]}`) or a list of records. Batches are run through
+`dynamodb_stream_events.handler` at a configurable rate and concurrency,
+against a local EventBridge stand-in (see eventbridge_standin.py) unless an
+endpoint is given. The stand-in can inject throttling, failed entries and
+latency.
+
+At the end it reports records/s, invocation latency percentiles, and failure
+counts: the invocations that raised, and the records the handler returned as
+`batchItemFailures`.
+"""
+from argparse import ArgumentParser
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
+import json
+import logging
+import os
+from os import path
+import sys
+from threading import Lock
+import time
+
+BASE = path.dirname(path.dirname(path.abspath(__file__)))
+sys.path.insert(0, os.environ.get('BUILDDIR', path.join(BASE, 'build')))
+
+logger = logging.getLogger(__name__)
+
+
+class LambdaContext:
+    """ Minimal stand-in for the Lambda context object. """
+    #pylint: disable=too-few-public-methods
+    function_name = 'replay-batches'
+    aws_request_id = '00000000-0000-0000-0000-000000000000'
+
+    def __init__(self, timeout):
+        self.deadline = time.monotonic() + timeout
+
+    def get_remaining_time_in_millis(self):
+        """ Milliseconds until the invocation timeout. """
+        return max(0, int((self.deadline - time.monotonic()) * 1000))
+
+
+def get_args():
+    """ Get the command line arguments. """
+    parser = ArgumentParser(description='Replay captured stream batches through the handler.')
+    parser.add_argument(
+        '--debug', '-d',
+        action='store_true',
+        help='Enable debug logging.'
+    )
+    parser.add_argument(
+        '--rate',
+        type=float,
+        default=0,
+        help='Batches started per second; 0 is unlimited. Default: %(default)r'
+    )
+    parser.add_argument(
+        '--concurrency', '-c',
+        type=int,
+        default=1,
+        help='Concurrent invocations. Default: %(default)r'
+    )
+    parser.add_argument(
+        '--timeout',
+        type=float,
+        default=10,
+        help='Invocation timeout, for the context. Default: %(default)r'
+    )
+    parser.add_argument(
+        '--endpoint-url',
+        help='EventBridge endpoint to use instead of the local stand-in.'
+    )
+    parser.add_argument(
+        '--throttle-rate',
+        type=float,
+        default=0.0,
+        help='Stand-in: fraction of requests throttled. Default: %(default)r'
+    )
+    parser.add_argument(
+        '--failure-rate',
+        type=float,
+        default=0.0,
+        help='Stand-in: fraction of entries that fail. Default: %(default)r'
+    )
+    parser.add_argument(
+        '--latency-ms',
+        type=float,
+        default=0.0,
+        help='Stand-in: milliseconds added to each request. Default: %(default)r'
+    )
+    parser.add_argument(
+        '--seed',
+        type=int,
+        help='Stand-in: random seed for the injected faults.'
+    )
+    parser.add_argument(
+        'files',
+        nargs='+',
+        help='JSONL files of captured batches.'
+    )
+
+    return parser.parse_args()
+
+
+def read_batches(file_paths):
+    """
+    Read the batches from JSONL files.
+
+    Yields:
+        dict: Lambda event for each batch.
+    """
+    for file_path in file_paths:
+        with open(file_path, 'r', encoding='utf-8') as file_p:
+            for line in file_p:
+                line = line.strip()
+                if not line:
+                    continue
+                batch = json.loads(line)
+                yield {'Records': batch} if isinstance(batch, list) else batch
+
+
+def replay(batches, handler, rate=0, concurrency=1, timeout=10):
+    """
+    Run the batches through the handler.
+
+    Args:
+        batches (Iterable[dict]): Lambda events.
+        handler (Callable): the Lambda handler.
+        rate (float): batches started per second; 0 is unlimited.
+        concurrency (int): concurrent invocations.
+        timeout (float): invocation timeout in seconds.
+
+    Returns:
+        dict: batches, records, errors (invocations that raised), failures
+        (records in `batchItemFailures`), elapsed seconds and latencies.
+    """
+    stats = dict(batches=0, records=0, errors=0, failures=0, latencies=[])
+    stats_lock = Lock()
+
+    def _invoke(event):
+        start = time.perf_counter()
+        error = False
+        failures = 0
+        try:
+            result = handler(event, LambdaContext(timeout))
+            failures = len((result or {}).get('batchItemFailures', []))
+        except Exception: #pylint: disable=broad-exception-caught
+            logger.exception('Invocation failed')
+            error = True
+        latency = (time.perf_counter() - start) * 1000
+        with stats_lock:
+            stats['batches'] += 1
+            stats['records'] += len(event.get('Records', []))
+            stats['errors'] += int(error)
+            stats['failures'] += failures
+            stats['latencies'].append(latency)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for batch_idx, event in enumerate(batches):
+            if rate:
+                delay = start + batch_idx / rate - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+            executor.submit(_invoke, event)
+    stats['elapsed'] = time.perf_counter() - start
+    return stats
+
+
+def report(stats, standin_stats=None):
+    """ Log the replay results. """
+    #pylint: disable=import-outside-toplevel
+    from dynamodb_stream_events.metrics import percentile
+
+    latencies = sorted(stats['latencies'])
+    logger.info(
+        'Replayed %(batches)d batches (%(records)d records) in %(elapsed).2fs: '
+        '%(rate).1f records/s; %(errors)d failed invocations, %(failures)d records in '
+        'batchItemFailures',
+        dict(stats, rate=stats['records'] / stats['elapsed'] if stats['elapsed'] else 0)
+    )
+    if latencies:
+        logger.info(
+            'Invocation latency (ms): p50=%(p50).1f p90=%(p90).1f p99=%(p99).1f max=%(max).1f',
+            {
+                'p50': percentile(latencies, 50),
+                'p90': percentile(latencies, 90),
+                'p99': percentile(latencies, 99),
+                'max': latencies[-1],
+            }
+        )
+    if standin_stats:
+        logger.info(
+            'PutEvents: %(requests)d requests, %(throttled)d throttled, %(invalid)d invalid; '
+            '%(entries)d entries, %(failed_entries)d failed',
+            standin_stats
+        )
+
+
+def main(args):
+    """ Start the stand-in if needed, and replay the batches. """
+    #pylint: disable=import-outside-toplevel
+    if args.debug:
+        logging.getLogger().setLevel(logging.DEBUG)
+
+    from eventbridge_standin import EventBridgeStandin
+
+    os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-2')
+    with ExitStack() as stack:
+        standin = None
+        if args.endpoint_url:
+            os.environ['AWS_ENDPOINT_URL_EVENTBRIDGE'] = args.endpoint_url
+        else:
+            standin = stack.enter_context(EventBridgeStandin(
+                throttle_rate=args.throttle_rate,
+                failure_rate=args.failure_rate,
+                latency=args.latency_ms / 1000,
+                seed=args.seed,
+            ))
+            os.environ['AWS_ENDPOINT_URL_EVENTBRIDGE'] = standin.endpoint_url
+            os.environ.setdefault('AWS_ACCESS_KEY_ID', 'testing')
+            os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'testing')
+
+        # Import after the environment is set, so the handler config and
+        # client pick it up.
+        import dynamodb_stream_events
+
+        stats = replay(
+            read_batches(args.files),
+            dynamodb_stream_events.handler,
+            rate=args.rate,
+            concurrency=args.concurrency,
+            timeout=args.timeout,
+        )
+
+    report(stats, standin.stats if standin else None)
+    return 1 if stats['errors'] else 0
+
+if __name__ == '__main__':
+    logging.basicConfig(
+        level=logging.INFO,
+        stream=sys.stderr,
+    )
+    sys.exit(main(get_args()))
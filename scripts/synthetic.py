@@ -0,0 +1,204 @@
+"""
+Synthetic DynamoDB Streams records, for benchmarks and tests.
+
+The records are deterministic for a seed, and can vary the item width,
+nesting depth, attribute types, stream view type and value sizes.
+"""
+from base64 import b64encode
+from collections import namedtuple
+from random import Random
+import time
+
+TYPES_SCALAR = ('S', 'N', 'B', 'BOOL', 'NULL')
+TYPES_SET = ('SS', 'NS', 'BS')
+TYPES_NESTED = ('L', 'M')
+TYPES_ALL = TYPES_SCALAR + TYPES_SET + TYPES_NESTED
+
+VIEW_TYPES = ('KEYS_ONLY', 'NEW_IMAGE', 'OLD_IMAGE', 'NEW_AND_OLD_IMAGES')
+
+TABLE_ARN = 'arn:aws:dynamodb:us-east-2:123456789012:table/SyntheticTable'
+STREAM_ARN = f"{TABLE_ARN}/stream/2020-07-15T00:00:00.000"
+
+RecordShape = namedtuple(
+    'RecordShape',
+    field_names=['width', 'depth', 'types', 'view_type', 'string_size'],
+    defaults=[10, 0, TYPES_ALL, 'NEW_AND_OLD_IMAGES', 16]
+)
+
+
+class SyntheticRecords:
+    """
+    Generator of synthetic stream records.
+
+    Args:
+        shape (RecordShape): shape of the items.
+        seed (int): random seed, so batches are reproducible.
+    """
+
+    def __init__(self, shape=RecordShape(), seed=0):
+        self.shape = shape
+        self.random = Random(seed)
+        self.sequence = 13021600000000001596893679
+
+    def _string(self, size=None):
+        size = self.shape.string_size if size is None else size
+        # Hex digits of random bytes: much faster than choosing each character,
+        # which matters for items of hundreds of KB.
+        return self.random.randbytes(size // 2 + 1).hex()[:size]
+
+    def _number(self):
+        return str(self.random.choice([
+            self.random.randint(-1000000, 1000000),
+            round(self.random.uniform(-1000, 1000), 4),
+        ]))
+
+    def _binary(self):
+        return b64encode(self.random.randbytes(max(1, self.shape.string_size))).decode('ascii')
+
+    def value(self, type_tag, depth=0):
+        """
+        Make a DynamoDB typed value.
+
+        Args:
+            type_tag (str): DynamoDB type; nested types fall back to scalars
+                once `depth` reaches the shape depth.
+            depth (int): current nesting depth.
+
+        Returns:
+            dict: typed value.
+        """
+        #pylint: disable=too-many-return-statements
+        if type_tag in TYPES_NESTED and depth >= self.shape.depth:
+            type_tag = 'S'
+
+        if type_tag == 'S':
+            return {'S': self._string()}
+        if type_tag == 'N':
+            return {'N': self._number()}
+        if type_tag == 'B':
+            return {'B': self._binary()}
+        if type_tag == 'BOOL':
+            return {'BOOL': self.random.random() < 0.5}
+        if type_tag == 'NULL':
+            return {'NULL': True}
+        if type_tag == 'SS':
+            return {'SS': sorted({self._string() for _ in range(3)})}
+        if type_tag == 'NS':
+            return {'NS': sorted({self._number() for _ in range(3)})}
+        if type_tag == 'BS':
+            return {'BS': sorted({self._binary() for _ in range(3)})}
+        if type_tag == 'L':
+            return {'L': [
+                self.value(self.random.choice(self.shape.types), depth + 1)
+                for _ in range(3)
+            ]}
+        if type_tag == 'M':
+            return {'M': {
+                f"m{idx}": self.value(self.random.choice(self.shape.types), depth + 1)
+                for idx in range(3)
+            }}
+        raise ValueError(f"Unknown type: {type_tag}")
+
+    def item(self, keys):
+        """
+        Make an item image with the keys and `width` other attributes.
+
+        Args:
+            keys (dict): typed key attributes.
+
+        Returns:
+            dict: typed item.
+        """
+        item = dict(keys)
+        types = self.shape.types
+        for idx in range(self.shape.width):
+            item[f"attr{idx}"] = self.value(types[idx % len(types)])
+        return item
+
+    def record(self, event_name=None, timestamp=None):
+        """
+        Make a single stream record.
+
+        Args:
+            event_name (str): INSERT, MODIFY, or REMOVE. Default: chosen
+                randomly.
+            timestamp (float): ApproximateCreationDateTime. Default: now.
+
+        Returns:
+            dict: stream record.
+        """
+        if event_name is None:
+            event_name = self.random.choice(['INSERT', 'MODIFY', 'REMOVE'])
+        if timestamp is None:
+            timestamp = time.time()
+
+        self.sequence += self.random.randint(1, 1000)
+        keys = {
+            'pk': {'S': f"pk-{self.random.randint(0, 1000)}"},
+            'sk': {'N': str(self.random.randint(0, 1000000))},
+        }
+        dynamodb = dict(
+            ApproximateCreationDateTime=int(timestamp),
+            Keys=keys,
+            SequenceNumber=str(self.sequence),
+            StreamViewType=self.shape.view_type,
+        )
+
+        view_type = self.shape.view_type
+        if event_name != 'REMOVE' and view_type in ('NEW_IMAGE', 'NEW_AND_OLD_IMAGES'):
+            dynamodb['NewImage'] = self.item(keys)
+        if event_name != 'INSERT' and view_type in ('OLD_IMAGE', 'NEW_AND_OLD_IMAGES'):
+            if event_name == 'MODIFY' and 'NewImage' in dynamodb:
+                # Change about half the attributes, so the diff has work.
+                old_image = dict(dynamodb['NewImage'])
+                for name in list(old_image)[2::2]:
+                    old_image[name] = self.value('S')
+                dynamodb['OldImage'] = old_image
+            else:
+                dynamodb['OldImage'] = self.item(keys)
+        dynamodb['SizeBytes'] = len(repr(dynamodb))
+
+        return dict(
+            eventID=f"{self.random.getrandbits(128):032x}",
+            eventName=event_name,
+            eventVersion='1.1',
+            eventSource='aws:dynamodb',
+            awsRegion='us-east-2',
+            dynamodb=dynamodb,
+            eventSourceARN=STREAM_ARN,
+        )
+
+    def batch(self, count, event_name=None, timestamp=None):
+        """
+        Make a list of stream records.
+
+        Args:
+            count (int): number of records.
+            event_name (str): see `record`.
+            timestamp (float): see `record`.
+
+        Returns:
+            List[dict]: stream records.
+        """
+        return [self.record(event_name, timestamp) for _ in range(count)]
+
+
+class StubEventsClient:
+    """
+    Stand-in for the EventBridge client that accepts every entry without any
+    network calls. It records the number of calls and entries.
+    """
+
+    def __init__(self):
+        self.calls = 0
+        self.entries = 0
+
+    def put_events(self, Entries):
+        #pylint: disable=invalid-name
+        """ Accept all the entries. """
+        self.calls += 1
+        self.entries += len(Entries)
+        return {
+            'FailedEntryCount': 0,
+            'Entries': [{'EventId': f"{self.calls}-{idx}"} for idx in range(len(Entries))],
+        }
@@ -1,21 +1,74 @@
 """
 Take DynamoDB Streams event records and republish them as EventBridge events.
 """
+from concurrent.futures import wait
 from datetime import datetime, timezone
 import logging
 import os
-
-import boto3
+import random
+import time
 
 from . import json
-from .streams import generate_records
+from .aggregate import AGGREGATE_RECORDS, EventAggregator
+from .clients import error_code, get_events_clnt
+from .idempotency import get_idempotency_cache
+from .kinesis import from_kinesis, is_kinesis_event
+from .logs import debug_records
+from .lanes import PARALLEL_LANES, get_lane_executor, partition_lanes
+from .metrics import (
+    NULL_METRICS, STAGE_ENCODE, UNIT_BYTES,
+    new_metrics
+)
+from .publish import (
+    DEADLINE_ERROR_CODE, POISON_ERROR_CODES, FailedEntry, chunk_entries, entry_size, put_chunk,
+    put_chunk_isolated,
+)
+from .ratelimit import get_rate_limiter
+from .routing import (
+    filter_records, get_route, is_ttl_removal, project, split_ttl_removals
+)
+from .spool import quarantine_failed, spool_failed
+from .streams import generate_records, sequence_number_gap
 
 EVENT_BUS_NAME = os.environ['EVENT_BUS_NAME'] \
     if os.environ.get('EVENT_BUS_NAME') \
     else 'default'
+EVENT_SOURCE = 'dynamodb-streams.aws.illinois.edu'
 EVENT_DETAILTYPE_FMT = os.environ['EVENT_DETAILTYPE_FMT'] \
     if os.environ.get('EVENT_DETAILTYPE_FMT') \
     else 'DynamoDB Streams Record {eventName}'
+INIT_PRIME = os.environ['INIT_PRIME'].lower() \
+    if os.environ.get('INIT_PRIME') \
+    else 'off'
+MEMORY_PROFILE = os.environ['MEMORY_PROFILE'].lower() in ('1', 'true', 'yes') \
+    if os.environ.get('MEMORY_PROFILE') \
+    else False
+ENCODE_WORKERS = int(os.environ['ENCODE_WORKERS']) \
+    if os.environ.get('ENCODE_WORKERS') \
+    else 0
+ENCODE_WORKERS_MIN_RECORDS = int(os.environ['ENCODE_WORKERS_MIN_RECORDS']) \
+    if os.environ.get('ENCODE_WORKERS_MIN_RECORDS') \
+    else 1000
+PUT_EVENTS_THROTTLE_RETRIES = int(os.environ['PUT_EVENTS_THROTTLE_RETRIES']) \
+    if os.environ.get('PUT_EVENTS_THROTTLE_RETRIES') \
+    else 2
+PROFILE_SAMPLE_RATE = float(os.environ['PROFILE_SAMPLE_RATE']) \
+    if os.environ.get('PROFILE_SAMPLE_RATE') \
+    else 0.0
+PROFILE_MARKER = os.environ['PROFILE_MARKER'] \
+    if os.environ.get('PROFILE_MARKER') \
+    else None
+# The records deferred at the deadline are only retried if the event source
+# mapping has ReportBatchItemFailures; without it Lambda takes the batch as done.
+DEADLINE_MARGIN_MS = int(os.environ['DEADLINE_MARGIN_MS']) \
+    if os.environ.get('DEADLINE_MARGIN_MS') \
+    else 1000
+# Error code of the records that weren't put because a PutEvents call of their
+# lane raised.
+PUT_ERROR_CODE = 'PutEventsFailed'
+TTL_SUMMARY_DETAILTYPE = os.environ['TTL_SUMMARY_DETAILTYPE'] \
+    if os.environ.get('TTL_SUMMARY_DETAILTYPE') \
+    else 'DynamoDB Streams TTL Summary'
 LOGGING_LEVEL = getattr(
     logging,
     os.environ['LOGGING_LEVEL'] if os.environ.get('LOGGING_LEVEL') else 'INFO',
@@ -23,68 +76,886 @@ LOGGING_LEVEL = getattr(
 )
 
 logger = logging.getLogger(__name__)
-events_clnt = boto3.client('events')
+
+def __getattr__(name):
+    # The events client is created on first access, so that importing the
+    # package doesn't load boto3.
+    if name == 'events_clnt':
+        return get_events_clnt()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 def handler(event, context):
-    #pylint: disable=unused-argument
     """
-    AWS Lambda handler for DynamoDB Streams.
+    AWS Lambda handler for DynamoDB Streams, and for Kinesis Data Streams
+    for DynamoDB (see `kinesis`).
+
+    Publishing stops DEADLINE_MARGIN_MS before the invocation times out, and
+    the records that weren't put yet are returned as failures, so Lambda
+    retries from them instead of the whole batch. This needs
+    `ReportBatchItemFailures` on the event source mapping: without it, the
+    records deferred are lost.
+
+    Returns:
+        dict: the partial batch response, with the sequence numbers of the
+        records that failed and weren't spooled or quarantined. Lambda only
+        uses it when the event source mapping has `ReportBatchItemFailures`.
     """
     logger.setLevel(LOGGING_LEVEL)
-    put_records(event.get('Records', []))
+    records = event.get('Records', [])
+    publish = put_kinesis_records if is_kinesis_event(records) else put_records
+    deadline = get_deadline(context)
+    metrics = new_metrics()
+    if MEMORY_PROFILE:
+        from .profiling import MemoryProfiler #pylint: disable=import-outside-toplevel
+        metrics = MemoryProfiler(metrics, len(records))
+    try:
+        if _should_profile(records):
+            from .profiling import profile_call #pylint: disable=import-outside-toplevel
+            failed = profile_call(publish, records, metrics=metrics, deadline=deadline)
+        else:
+            failed = publish(records, metrics=metrics, deadline=deadline)
+    finally:
+        metrics.emit()
+    return {'batchItemFailures': [{'itemIdentifier': seq} for seq in failed]}
 
-def put_records(records, event_bus_name=EVENT_BUS_NAME, _events_clnt=events_clnt):
+def get_deadline(context, margin_ms=DEADLINE_MARGIN_MS):
     """
-    Takes a list of event records from DynamoDB Streams, adjusts the types, and
-    put them to EventBridge.
+    Get the time to stop publishing by, so the invocation ends cleanly before
+    it times out.
+
+    Args:
+        context (obj): the Lambda context.
+        margin_ms (int): time kept for the last PutEvents call, spooling and
+            logging; 0 is no deadline.
+
+    Returns:
+        float: the `time.monotonic()` deadline, or None if there isn't one.
+    """
+    if not margin_ms or not hasattr(context, 'get_remaining_time_in_millis'):
+        return None
+    return time.monotonic() + (context.get_remaining_time_in_millis() - margin_ms) / 1000
+
+def _should_profile(records):
+    """
+    Decide if the invocation is run under cProfile: a PROFILE_SAMPLE_RATE
+    fraction of invocations are, and so are batches where a new image has the
+    PROFILE_MARKER attribute.
+    """
+    if PROFILE_SAMPLE_RATE and random.random() < PROFILE_SAMPLE_RATE:
+        return True
+    if PROFILE_MARKER:
+        return any(
+            PROFILE_MARKER in r.get('dynamodb', {}).get('NewImage', {})
+            for r in records
+        )
+    return False
+
+def make_event(record, event_bus_name=EVENT_BUS_NAME, record_idx=0, debug=True):
     """
-    def _make_event(record_idx, record):
+    Make the EventBridge event entry for a record from `generate_records`.
+    The route for the record's table can set the bus, DetailType and the
+    projected attributes, and another bus and DetailType for TTL removals.
+
+    Args:
+        record (dict): the translated stream record.
+        event_bus_name (str): name of the bus to put the event to, if the
+            route doesn't set one.
+        record_idx (int): index of the record in the batch, for logging.
+        debug (bool): write the debug logs for the record.
+
+    Returns:
+        dict: PutEvents entry.
+    """
+    if debug:
         logger.debug('[Record #%(idx)d] Record = %(record)r', {
             'idx': record_idx,
             'record': record,
         })
 
-        if 'ApproximateCreationDateTime' in record['dynamodb']:
-            tstamp = record['dynamodb']['ApproximateCreationDateTime']
-        else:
-            tstamp = datetime.now(timezone.utc)
-        record['dynamodb']['ApproximateCreationDateTime'] = tstamp.timestamp()
-
-        event = dict(
-            Time=tstamp,
-            Source='dynamodb-streams.aws.illinois.edu',
-            Resources=[],
-            DetailType=EVENT_DETAILTYPE_FMT.format(**record),
-            Detail=json.dumps(record['dynamodb']),
-            EventBusName=event_bus_name,
-        )
-        if 'tableARN' in record:
-            event['Resources'].append(record['tableARN'])
+    if 'ApproximateCreationDateTime' in record['dynamodb']:
+        tstamp = record['dynamodb']['ApproximateCreationDateTime']
+    else:
+        tstamp = datetime.now(timezone.utc)
+    record['dynamodb']['ApproximateCreationDateTime'] = tstamp.timestamp()
+
+    route = get_route(record['dynamodb'].get('TableName'))
+    if route.projection is not None:
+        project(record['dynamodb'], route.projection)
+    event_bus_name = route.event_bus_name or event_bus_name
+    detail_type_fmt = route.detail_type_fmt or EVENT_DETAILTYPE_FMT
+    if route.ttl is not None and is_ttl_removal(record):
+        event_bus_name = route.ttl_event_bus_name or event_bus_name
+        detail_type_fmt = route.ttl_detail_type_fmt or detail_type_fmt
 
+    event = dict(
+        Time=tstamp,
+        Source=EVENT_SOURCE,
+        Resources=[],
+        DetailType=detail_type_fmt.format(**record),
+        Detail=json.dumps(record['dynamodb']),
+        EventBusName=event_bus_name,
+    )
+    if 'tableARN' in record:
+        event['Resources'].append(record['tableARN'])
+
+    if debug:
         logger.debug('[Record #%(idx)d] Event = %(event)r', {
             'idx': record_idx,
             'event': event,
         })
-        return event
+    return event
+
+def make_events(records, event_bus_name=EVENT_BUS_NAME, metrics=NULL_METRICS, log_records=None,
+                indexes=None, batch_metrics=True):
+    #pylint: disable=too-many-arguments,too-many-positional-arguments
+    """
+    Generator that makes the EventBridge event entries for stream records.
+    Events are made as they are needed, so when the caller puts them a chunk
+    at a time only one chunk of events is in memory.
+
+    Args:
+        records (List[dict]): stream event records.
+        event_bus_name (str): name of the bus to put the events to.
+        metrics (Metrics): collector for the stage timings.
+        log_records (Container[int]): batch indexes of the records to debug
+            log. Default: sampled with `logs.debug_records`.
+        indexes (List[int]): index of each record in the batch, when
+            `records` is part of one.
+        batch_metrics (bool): put the batch level metrics (see
+            `generate_records`).
+
+    Yields:
+        dict: PutEvents entry.
+    """
+    if log_records is None:
+        log_records = debug_records(logger, len(records))
+    records_iter = generate_records(
+        records,
+        metrics=metrics,
+        log_records=log_records,
+        indexes=indexes,
+        batch_metrics=batch_metrics,
+    )
+    for r_idx, r in enumerate(records_iter):
+        if metrics:
+            start = time.perf_counter()
+        if indexes is not None:
+            r_idx = indexes[r_idx]
+        event = make_event(r, event_bus_name, r_idx, debug=r_idx in log_records)
+        if metrics:
+            metrics.add_time(STAGE_ENCODE, start)
+        yield event
+
+def put_records(records, event_bus_name=EVENT_BUS_NAME, _events_clnt=None, metrics=NULL_METRICS,
+                lanes=None, deadline=None):
+    #pylint: disable=too-many-arguments,too-many-positional-arguments,too-many-locals
+    """
+    Takes a list of event records from DynamoDB Streams, adjusts the types, and
+    put them to EventBridge. Debug logs are only written for a sample of the
+    records (`DEBUG_SAMPLE_RATE`), and a summary of the batch is logged.
+
+    With more than one lane the records are split by item key, and the lanes
+    are published in parallel. The events for an item are still put in order.
+
+    Batches of at least ENCODE_WORKERS_MIN_RECORDS records have their events
+    made by a pool of ENCODE_WORKERS processes, when it is more than one.
+
+    PutEvents calls go through the rate limiter when PUT_EVENTS_RATE_LIMIT is
+    set (see `ratelimit`).
+
+    With AGGREGATE_RECORDS, runs of records for the same table and eventName
+    are put as one envelope event (see `aggregate`).
+
+    Records whose table route doesn't publish their eventName are dropped
+    first (see `routing`), and so are the records that were already published
+    when IDEMPOTENCY is on (see `idempotency`). TTL removals are handled as
+    their table route's `ttl` mode says; their summary events are put after
+    the records.
+
+    A record that can't be made into an event, or whose event EventBridge
+    rejects as invalid, doesn't fail the batch: it is isolated, and
+    quarantined to the QUARANTINE_SPOOL. Other failed events are written to
+    the FAILED_SPOOL (see `spool`).
+
+    Once the `deadline` is too close for a PutEvents call to end before it
+    (see `publish.PUT_EVENTS_CALL_TIME`), each lane stops before its next
+    call; its records that weren't put are returned as failed, and aren't
+    spooled. Every lane puts at least one call, so the batch makes progress.
+    The TTL summaries stop the same way; the TTL removals of a summary that
+    isn't put (or spooled) are returned as failed. A lane whose PutEvents
+    call raises (throttled past the retries, or a network error) stops the
+    same way too, so the calls the lanes already put aren't put again.
+
+    Args:
+        records (List[dict]): stream event records.
+        event_bus_name (str): name of the bus to put the events to.
+        _events_clnt (obj): EventBridge client. Default: the shared client.
+        metrics (Metrics): collector for the stage timings and counts.
+        lanes (int): number of lanes. Default: PARALLEL_LANES.
+        deadline (float): `time.monotonic()` to stop putting events by.
+            Default: no deadline.
+
+    Returns:
+        List[str]: sequence numbers of the records that failed, and weren't
+        spooled or quarantined, in batch order.
+    """
+    if _events_clnt is None:
+        _events_clnt = get_events_clnt()
+    if lanes is None:
+        lanes = PARALLEL_LANES
+    records_in = len(records)
+    if metrics:
+        metrics.add('RecordsIn', records_in)
+    idempotency_cache = get_idempotency_cache()
+    batch = records
+    records, dropped, ttl_summaries = _drop_records(records, idempotency_cache, metrics)
+    log_records = debug_records(logger, len(records))
+    batch_start = time.perf_counter()
+
+    events = None
+    if ENCODE_WORKERS > 1 and len(records) >= ENCODE_WORKERS_MIN_RECORDS:
+        from .workers import get_worker_pool #pylint: disable=import-outside-toplevel
+        pool = get_worker_pool(ENCODE_WORKERS, make_events)
+        try:
+            events = pool.make_events(records, event_bus_name, metrics)
+        except Exception as err: #pylint: disable=broad-exception-caught
+            # Made again one at a time as they are put, to find the record.
+            logger.warning('Unable to make the events in the workers: %(err)s', {'err': err})
+
+    lane_indexes = partition_lanes(records, lanes) if lanes > 1 else []
+    if len(lane_indexes) > 1:
+        summary, failed = _put_lanes(
+            records, lane_indexes, lanes, event_bus_name, _events_clnt, metrics, log_records,
+            events, deadline, idempotency_cache
+        )
+    else:
+        summary, failed = _put_lane(
+            records, None, event_bus_name, _events_clnt, metrics, log_records, events, deadline,
+            idempotency_cache
+        )
+    unhandled = _handle_failed(records, failed, summary, metrics) if failed else []
+    ttl_failed = _put_ttl_summaries(
+        ttl_summaries, event_bus_name, _events_clnt, summary, metrics, deadline
+    )
+    if metrics and (limiter := get_rate_limiter()):
+        metrics.put('PutEventsRateLimit', limiter.rate)
+    if events is not None:
+        summary['workers'] = ENCODE_WORKERS
+    summary.update(dropped)
+
+    if logger.isEnabledFor(logging.INFO):
+        summary['records'] = records_in
+        if records:
+            summary['firstSequenceNumber'] = records[0]['dynamodb'].get('SequenceNumber')
+            summary['lastSequenceNumber'] = records[-1]['dynamodb'].get('SequenceNumber')
+        summary['ms'] = round((time.perf_counter() - batch_start) * 1000, 3)
+        logger.info('Batch: %(summary)s', {'summary': json.dumps(summary)})
+
+    failed_seqs = [
+        seq
+        for idx in unhandled
+        if (seq := records[idx]['dynamodb'].get('SequenceNumber')) is not None
+    ]
+    if ttl_failed:
+        failed_seqs = set(failed_seqs).union(ttl_failed)
+        failed_seqs = [
+            seq
+            for r in batch
+            if (seq := r['dynamodb'].get('SequenceNumber')) in failed_seqs
+        ]
+    return failed_seqs
+
+def put_kinesis_records(records, event_bus_name=EVENT_BUS_NAME, _events_clnt=None,
+                        metrics=NULL_METRICS, deadline=None):
+    """
+    Decode the records of a Kinesis event, and put them with `put_records`.
+    Kinesis records that can't be decoded are quarantined.
+
+    Args:
+        records (List[dict]): Kinesis records.
+        event_bus_name (str): name of the bus to put the events to.
+        _events_clnt (obj): EventBridge client. Default: the shared client.
+        metrics (Metrics): collector for the stage timings and counts.
+        deadline (float): `time.monotonic()` to stop putting events by.
+
+    Returns:
+        List[str]: Kinesis sequence numbers of the records that failed, and
+        weren't spooled or quarantined, in batch order.
+    """
+    stream_records, poison = from_kinesis(records)
+    failed = []
+    if poison:
+        if metrics:
+            metrics.add('PoisonRecords', len(poison))
+        for entry in poison:
+            logger.error('[Kinesis record #%(idx)d] Unable to decode (%(code)s): %(msg)s', {
+                'idx': entry.index,
+                'code': entry.error_code,
+                'msg': entry.error_message,
+            })
+        if not quarantine_failed(records, poison, metrics):
+            failed.extend(records[f.index]['kinesis'].get('sequenceNumber') for f in poison)
+
+    failed.extend(put_records(
+        stream_records,
+        event_bus_name,
+        _events_clnt=_events_clnt,
+        metrics=metrics,
+        deadline=deadline,
+    ))
+    # The user records of an aggregated record share its sequence number.
+    order = {r['kinesis'].get('sequenceNumber'): idx for idx, r in enumerate(records)}
+    return sorted({seq for seq in failed if seq is not None}, key=order.__getitem__)
+
+def _drop_records(records, idempotency_cache, metrics):
+    """
+    Drop the records that their route doesn't publish, handle the TTL
+    removals, and drop the records that were already published.
+
+    Args:
+        records (List[dict]): stream event records.
+        idempotency_cache (IdempotencyCache): the published records, or None.
+        metrics (Metrics): collector for the counts.
+
+    Returns:
+        Tuple[List[dict], dict, Dict[str, dict]]: the records to publish, the
+        counts of the records dropped for the summary, and the TTL removal
+        summaries from `split_ttl_removals`.
+    """
+    dropped = {}
+    count = len(records)
+    records = filter_records(records)
+    if len(records) < count:
+        dropped['filtered'] = count - len(records)
+        if metrics:
+            metrics.add('RecordsFiltered', dropped['filtered'])
+
+    records, ttl_summaries, ttl_count = split_ttl_removals(records)
+    if ttl_count:
+        dropped['ttlRemovals'] = ttl_count
+        if metrics:
+            metrics.add('TTLRemovals', ttl_count)
+
+    if idempotency_cache is not None:
+        count = len(records)
+        records = idempotency_cache.unpublished(records)
+        if len(records) < count:
+            dropped['skipped'] = count - len(records)
+            if metrics:
+                metrics.add('RecordsSkipped', dropped['skipped'])
+    return records, dropped, ttl_summaries
+
+def _put_ttl_summaries(ttl_summaries, event_bus_name, events_clnt, summary, metrics,
+                       deadline=None):
+    """
+    Put an event with the summary of each table's TTL removals, with
+    `_put_chunk` like the records. The ones that fail are spooled. Once the
+    `deadline` is too close for a PutEvents call, the summaries after the
+    first call aren't put.
+
+    Args:
+        ttl_summaries (Dict[str, dict]): summaries from `split_ttl_removals`.
+        event_bus_name (str): name of the bus to put the events to, if the
+            route doesn't set one.
+        events_clnt (obj): EventBridge client.
+        summary (dict): the batch summary, for the count.
+        metrics (Metrics): collector for the timings and count.
+        deadline (float): `time.monotonic()` to stop putting events by.
+
+    Returns:
+        List[str]: sequence numbers of the TTL removals whose summary wasn't
+        put or spooled.
+    """
+    #pylint: disable=too-many-arguments,too-many-positional-arguments,too-many-locals
+    if not ttl_summaries:
+        return []
+
+    events = []
+    sequence_numbers = []
+    for ttl_summary in ttl_summaries.values():
+        route = get_route(ttl_summary['TableName'])
+        table_arn = ttl_summary.pop('tableARN')
+        sequence_numbers.append(ttl_summary.pop('sequenceNumbers'))
+        events.append(dict(
+            Time=datetime.now(timezone.utc),
+            Source=EVENT_SOURCE,
+            Resources=[table_arn] if table_arn else [],
+            DetailType=TTL_SUMMARY_DETAILTYPE,
+            Detail=json.dumps(ttl_summary),
+            EventBusName=route.ttl_event_bus_name or route.event_bus_name or event_bus_name,
+        ))
+
+    put_count = 0
+    failed = []
+    unhandled = []
+    entry_offset = 0
+    for chunk, _ in chunk_entries(events, metrics=metrics):
+        if deadline is not None and entry_offset and time.monotonic() >= deadline:
+            logger.warning('Stopping at the deadline; %(count)d TTL summaries not put', {
+                'count': len(events) - entry_offset,
+            })
+            unhandled.extend(range(entry_offset, len(events)))
+            break
+        try:
+            res = _put_chunk(chunk, events_clnt, metrics, deadline if entry_offset else None)
+        except Exception as err: #pylint: disable=broad-exception-caught
+            code = error_code(err) or type(err).__name__
+            res = {'Entries': [{'ErrorCode': code, 'ErrorMessage': str(err)}] * len(chunk)}
+        if res is None:
+            logger.warning('Stopping before the deadline; %(count)d TTL summaries not put', {
+                'count': len(events) - entry_offset,
+            })
+            unhandled.extend(range(entry_offset, len(events)))
+            break
+        res_entries = res.get('Entries', [])
+        for entry_idx, entry in enumerate(res_entries, start=entry_offset):
+            if entry.get('ErrorCode') or entry.get('ErrorMessage'):
+                failed.append(FailedEntry(
+                    events[entry_idx],
+                    entry.get('ErrorCode', ''),
+                    entry.get('ErrorMessage', ''),
+                    entry_idx,
+                ))
+            else:
+                put_count += 1
+        entry_offset += len(chunk)
+
+    for failed_entry in failed:
+        logger.error('TTL summary %(msg)s (%(code)s): %(event)r', {
+            'msg': failed_entry.error_message,
+            'code': failed_entry.error_code,
+            'event': failed_entry.entry,
+        })
+    if failed and not spool_failed(failed, metrics):
+        unhandled.extend(f.index for f in failed)
+
+    summary['ttlSummaries'] = put_count
+    if metrics:
+        metrics.add('TTLSummaryEvents', put_count)
+    return [seq for idx in sorted(unhandled) for seq in sequence_numbers[idx]]
+
+def _put_lanes(records, lane_indexes, lanes, event_bus_name, events_clnt, metrics, log_records,
+               events=None, deadline=None, idempotency_cache=None):
+    """
+    Put the events for each lane of records in parallel.
+
+    Args:
+        records (List[dict]): stream event records.
+        lane_indexes (List[List[int]]): batch indexes of the records in each
+            lane, from `partition_lanes`.
+        lanes (int): number of lanes, for the size of the thread pool.
+        event_bus_name (str): name of the bus to put the events to.
+        events_clnt (obj): EventBridge client.
+        metrics (Metrics): collector for the stage timings and counts.
+        log_records (Container[int]): batch indexes of the records to debug
+            log.
+        events (List[dict]): the events for the records, if they have
+            already been made.
+        deadline (float): `time.monotonic()` to stop putting events by.
+        idempotency_cache (IdempotencyCache): the published records, or None.
+
+    Returns:
+        Tuple[dict, List[FailedEntry]]: the combined summary of the lanes,
+        and the entries that failed, in batch order.
+    """
+    #pylint: disable=too-many-arguments,too-many-positional-arguments,too-many-locals
+    # Metrics aren't thread safe, so each lane has its own.
+    lane_metrics = [metrics.lane() for _ in lane_indexes]
+    executor = get_lane_executor(lanes)
+    futures = [
+        executor.submit(
+            _put_lane,
+            [records[idx] for idx in indexes],
+            indexes,
+            event_bus_name,
+            events_clnt,
+            lane_metrics[lane_idx],
+            log_records,
+            [events[idx] for idx in indexes] if events is not None else None,
+            deadline,
+            idempotency_cache,
+        )
+        for lane_idx, indexes in enumerate(lane_indexes)
+    ]
+    # Every lane has stopped before a lane's error is raised, so none is
+    # still putting when Lambda retries the batch.
+    wait(futures)
+    results = [future.result() for future in futures]
+
+    summary = results[0][0]
+    failed = []
+    for _, lane_failed in results:
+        failed.extend(lane_failed)
+    for lane_summary, _ in results[1:]:
+        for name in ('events', 'failed', 'calls', 'bytes'):
+            summary[name] += lane_summary[name]
+        if lane_summary.get('deferred'):
+            summary['deferred'] = summary.get('deferred', 0) + lane_summary['deferred']
+        for name, count in lane_summary['eventNames'].items():
+            summary['eventNames'][name] = summary['eventNames'].get(name, 0) + count
+    summary['lanes'] = len(lane_indexes)
+
+    if metrics:
+        for lane_metric in lane_metrics:
+            metrics.merge(lane_metric)
+        # The lanes only know the gap of their own records.
+        gap = sequence_number_gap(records)
+        if gap is not None:
+            metrics.put('SequenceNumberGap', gap)
+    return summary, sorted(failed, key=lambda f: f.index)
+
+def _put_lane(records, indexes, event_bus_name, events_clnt, metrics, log_records, events=None,
+              deadline=None, idempotency_cache=None):
+    """
+    Put the events for a lane of records, in order.
+
+    Args:
+        records (List[dict]): stream event records of the lane.
+        indexes (List[int]): index of each record in the batch. Default: the
+            lane is the whole batch.
+        event_bus_name (str): name of the bus to put the events to.
+        events_clnt (obj): EventBridge client.
+        metrics (Metrics): collector for the stage timings and counts.
+        log_records (Container[int]): batch indexes of the records to debug
+            log.
+        events (List[dict]): the events for the records, if they have
+            already been made. Default: made as they are put.
+        deadline (float): `time.monotonic()` to stop putting events by. It
+            is checked before each PutEvents call, after the first.
+        idempotency_cache (IdempotencyCache): the published records, or None.
+            The records of each PutEvents call are added as soon as they are
+            put, so they aren't put again if a later call raises.
+
+    Returns:
+        Tuple[dict, List[FailedEntry]]: counts of events, failed entries,
+        calls and bytes published, and the event names; and the entries that
+        failed, in batch order with the batch indexes of their records. The
+        records that couldn't be made into events have no entry, and failed
+        envelopes have the indexes of all their records. The records that
+        weren't put before the deadline have the DEADLINE_ERROR_CODE, and
+        the ones that weren't put because a call raised (other than for
+        invalid events) have the PUT_ERROR_CODE.
+    """
+    #pylint: disable=too-many-arguments,too-many-positional-arguments,too-many-locals
+    #pylint: disable=too-many-statements
+    summary = dict(events=0, failed=0, calls=0, bytes=0, eventNames={})
+    failed = []
+    poison = []
+    event_names = summary['eventNames']
+    for record in records:
+        event_name = record.get('eventName')
+        event_names[event_name] = event_names.get(event_name, 0) + 1
+
+    if events is None:
+        event_indexes = []
+        events = _make_events_isolated(
+            records, indexes, event_bus_name, metrics, log_records, poison, event_indexes
+        )
+    else:
+        event_indexes = indexes if indexes is not None else range(len(records))
+
+    aggregator = None
+    if AGGREGATE_RECORDS > 1:
+        aggregator = EventAggregator(AGGREGATE_RECORDS)
+        events = aggregator.aggregate(events, event_indexes, {
+            idx: record.get('eventName')
+            for idx, record in zip(indexes if indexes is not None else range(len(records)), records)
+        })
+        event_indexes = aggregator.event_indexes
+
+    # The lane's records by batch index, for the idempotency cache.
+    batch_records = dict(zip(indexes, records)) \
+        if idempotency_cache is not None and indexes is not None \
+        else records
+
+    entry_offset = 0
+    for chunk, chunk_size in chunk_entries(events, metrics=metrics):
+        res = None
+        if deadline is None or not entry_offset or time.monotonic() < deadline:
+            logger.debug('Puting %(count)d events', {'count': len(chunk)})
+            try:
+                # The first call is always put, even if it (or the rate
+                # limiter's wait) overruns the deadline.
+                res = put_chunk_isolated(chunk, events_clnt, metrics, get_rate_limiter(),
+                                         PUT_EVENTS_THROTTLE_RETRIES,
+                                         deadline if entry_offset else None)
+            except Exception as err: #pylint: disable=broad-exception-caught
+                # Like at the deadline, the rest of the lane is left for Lambda
+                # to retry, and the calls already put are kept.
+                logger.exception('PutEvents failed')
+                poison = _defer_records(
+                    indexes if indexes is not None else range(len(records)),
+                    event_indexes[entry_offset],
+                    poison,
+                    summary,
+                    metrics,
+                    PUT_ERROR_CODE,
+                    f"{error_code(err) or type(err).__name__}: {err}",
+                )
+                break
+        if res is None:
+            # The deadline has passed, or would before the call (or the rate
+            # limiter's wait) ended.
+            poison = _defer_records(
+                indexes if indexes is not None else range(len(records)),
+                event_indexes[entry_offset],
+                poison,
+                summary,
+                metrics,
+            )
+            break
+
+        chunk_failed = _failed_entries(chunk, res, entry_offset, event_indexes, aggregator,
+                                       log_records)
+        failed.extend(chunk_failed)
+        failed_count = len(chunk_failed)
+        failed_bytes = sum(entry_size(f.entry) for f in chunk_failed)
+        if idempotency_cache is not None:
+            _put_published(idempotency_cache, batch_records, res, entry_offset, event_indexes,
+                           aggregator)
+        entry_offset += len(chunk)
+
+        summary['calls'] += 1
+        summary['events'] += len(chunk) - failed_count
+        summary['failed'] += failed_count
+        summary['bytes'] += chunk_size - failed_bytes
+        if metrics:
+            metrics.add('PutEventsCalls', 1)
+            metrics.add('EventsOut', len(chunk) - failed_count)
+            metrics.add('FailedEntries', failed_count)
+            metrics.add('BytesPublished', chunk_size - failed_bytes, UNIT_BYTES)
+
+    if poison:
+        summary['failed'] += len(poison) - summary.get('deferred', 0)
+        failed = sorted(failed + poison, key=lambda f: f.index)
+    return summary, failed
+
+def _failed_entries(chunk, res, entry_offset, event_indexes, aggregator, log_records):
+    """
+    Log the events that a PutEvents call put, and the ones that failed.
 
-    events = [_make_event(r_idx, r) for r_idx, r in enumerate(generate_records(records))]
+    Args:
+        chunk (List[dict]): the call's PutEvents entries.
+        res (dict): the PutEvents response.
+        entry_offset (int): index in the lane's events of the call's first.
+        event_indexes (List[int]): batch index of each event's record.
+        aggregator (EventAggregator): the lane's aggregator, or None.
+        log_records (Container[int]): batch indexes of the records to debug
+            log.
 
-    logger.debug('Puting %(count)d events', {'count': len(events)})
-    res = _events_clnt.put_events(Entries=events)
-    for entry_idx, entry in enumerate(res.get('Entries', [])):
+    Returns:
+        List[FailedEntry]: the entries that failed, in order.
+    """
+    #pylint: disable=too-many-arguments,too-many-positional-arguments
+    failed = []
+    for entry_idx, entry in enumerate(res.get('Entries', []), start=entry_offset):
         entry_id      = entry.get('EventId', '')
         entry_errcode = entry.get('ErrorCode', '')
         entry_errmsg  = entry.get('ErrorMessage', '')
+        record_idx = event_indexes[entry_idx]
 
-        if entry_id:
+        if entry_id and record_idx in log_records:
             logger.debug('[Record #%(idx)d] EventId = %(id)s', {
-                'idx': entry_idx,
+                'idx': record_idx,
                 'id': entry_id,
             })
         if entry_errcode or entry_errmsg:
-            logger.error('[Record #%(idx)d] %(msg)s (%(code)s): %(record)r', {
-                'idx': entry_idx,
+            event = chunk[entry_idx - entry_offset]
+            failed.append(FailedEntry(
+                event,
+                entry_errcode,
+                entry_errmsg,
+                record_idx,
+                aggregator.record_indexes[entry_idx] if aggregator is not None else None,
+            ))
+            logger.error('[Record #%(idx)d] %(msg)s (%(code)s): %(event)r', {
+                'idx': record_idx,
                 'msg': entry_errmsg,
                 'code': entry_errcode,
-                'record': records[entry_idx],
+                'event': event,
+            })
+    return failed
+
+def _put_published(idempotency_cache, batch_records, res, entry_offset, event_indexes,
+                   aggregator):
+    """
+    Add the records of the events that a PutEvents call put to the
+    idempotency cache.
+
+    Args:
+        idempotency_cache (IdempotencyCache): the published records.
+        batch_records (Mapping[int, dict]): the lane's records by batch index.
+        res (dict): the PutEvents response.
+        entry_offset (int): index in the lane's events of the call's first.
+        event_indexes (List[int]): batch index of each event's record.
+        aggregator (EventAggregator): the lane's aggregator, or None.
+    """
+    #pylint: disable=too-many-arguments,too-many-positional-arguments
+    published = []
+    for entry_idx, entry in enumerate(res.get('Entries', []), start=entry_offset):
+        if entry.get('ErrorCode') or entry.get('ErrorMessage'):
+            continue
+        if aggregator is not None:
+            published.extend(aggregator.record_indexes[entry_idx])
+        else:
+            published.append(event_indexes[entry_idx])
+    if published:
+        idempotency_cache.put([batch_records[idx] for idx in published])
+
+def _defer_records(indexes, first_idx, poison, summary, metrics, code=DEADLINE_ERROR_CODE,
+                   message='Not put before the deadline'):
+    #pylint: disable=too-many-arguments,too-many-positional-arguments
+    """
+    Stop a lane at the deadline (or after a PutEvents error): the records
+    from `first_idx` on weren't put, so they fail with the `code`, to be
+    retried by Lambda. The poison records among them are left for the retry
+    too.
+
+    Args:
+        indexes (Iterable[int]): batch indexes of the lane's records, in
+            order.
+        first_idx (int): batch index of the first record not put.
+        poison (List[FailedEntry]): the lane's poison records so far.
+        summary (dict): the lane summary, for the count deferred.
+        metrics (Metrics): collector for the count deferred.
+        code (str): DEADLINE_ERROR_CODE or PUT_ERROR_CODE.
+        message (str): why the records weren't put.
+
+    Returns:
+        List[FailedEntry]: the poison records before `first_idx`, and an
+        entry for each record deferred.
+    """
+    deferred = [
+        FailedEntry(None, code, message, idx)
+        for idx in indexes
+        if idx >= first_idx
+    ]
+    logger.warning('Stopping the lane (%(msg)s); %(count)d records not put, to be retried '
+                   'if the event source mapping has ReportBatchItemFailures', {
+        'msg': message,
+        'count': len(deferred),
+    })
+    summary['deferred'] = len(deferred)
+    if metrics:
+        metrics.add('DeferredRecords', len(deferred))
+    return [f for f in poison if f.index < first_idx] + deferred
+
+def _make_events_isolated(records, indexes, event_bus_name, metrics, log_records, poison,
+                          event_indexes):
+    """
+    Generator like `make_events`, that isolates the records that can't be
+    made into events. The records are made in order, so the one that raised
+    is the one after the last event; it is added to `poison`, and making
+    events starts again from the record after it.
+
+    Args:
+        records (List[dict]): stream event records of the lane.
+        indexes (List[int]): index of each record in the batch. Default: the
+            lane is the whole batch.
+        event_bus_name (str): name of the bus to put the events to.
+        metrics (Metrics): collector for the stage timings and counts.
+        log_records (Container[int]): batch indexes of the records to debug
+            log.
+        poison (List[FailedEntry]): the records that raised are added to it,
+            without an entry.
+        event_indexes (List[int]): the batch index of each event's record is
+            added to it.
+
+    Yields:
+        dict: PutEvents entry.
+    """
+    #pylint: disable=too-many-arguments,too-many-positional-arguments
+    if indexes is None:
+        indexes = range(len(records))
+    pos = 0
+    while pos < len(records):
+        try:
+            for event in make_events(
+                records[pos:] if pos else records,
+                event_bus_name,
+                metrics,
+                log_records,
+                indexes[pos:] if pos else indexes,
+                # The gap of the rest would replace the lane's.
+                batch_metrics=not pos,
+            ):
+                event_indexes.append(indexes[pos])
+                pos += 1
+                yield event
+        except Exception as err: #pylint: disable=broad-exception-caught
+            record_idx = indexes[pos]
+            logger.exception('[Record #%(idx)d] Unable to make the event (%(seq)s)', {
+                'idx': record_idx,
+                'seq': records[pos].get('dynamodb', {}).get('SequenceNumber'),
             })
+            poison.append(FailedEntry(None, type(err).__name__, str(err), record_idx))
+            if metrics:
+                metrics.add('PoisonRecords', 1)
+            pos += 1
+
+def _put_chunk(chunk, events_clnt, metrics, deadline=None):
+    """
+    Put a chunk of events with `publish.put_chunk`, through the rate limiter
+    (if PUT_EVENTS_RATE_LIMIT is set) with PUT_EVENTS_THROTTLE_RETRIES.
+
+    Args:
+        chunk (List[dict]): PutEvents entries.
+        events_clnt (obj): EventBridge client.
+        metrics (Metrics): collector for the timings and throttle counts.
+        deadline (float): `time.monotonic()` the call must end by.
+
+    Returns:
+        dict: the PutEvents response, or None if the call (or waiting for the
+        rate limiter) might overrun the `deadline`.
+    """
+    return put_chunk(chunk, events_clnt, metrics, get_rate_limiter(), PUT_EVENTS_THROTTLE_RETRIES,
+                     deadline)
+
+def _handle_failed(records, failed, summary, metrics):
+    """
+    Quarantine the poison records (ones without an event, or with an invalid
+    event), and spool the other failed events. The records deferred at the
+    deadline, or after a PutEvents error, are left to be retried.
+
+    Args:
+        records (List[dict]): stream event records.
+        failed (List[FailedEntry]): the entries that failed, in batch order.
+        summary (dict): the batch summary, for the counts.
+        metrics (Metrics): collector for the counts.
+
+    Returns:
+        List[int]: batch indexes of the failed records that weren't
+        quarantined or spooled, in order.
+    """
+    poison = []
+    rejected = []
+    unhandled = []
+    for entry in failed:
+        if entry.error_code in (DEADLINE_ERROR_CODE, PUT_ERROR_CODE):
+            unhandled.append(entry.index)
+        elif entry.entry is None or entry.error_code in POISON_ERROR_CODES:
+            poison.append(entry)
+        else:
+            rejected.append(entry)
+
+    if poison:
+        if quarantined := quarantine_failed(records, poison, metrics):
+            summary['quarantined'] = quarantined
+        else:
+            unhandled.extend(idx for f in poison for idx in (f.record_indexes or (f.index,)))
+    if rejected:
+        if spooled := spool_failed(rejected, metrics):
+            summary['spooled'] = spooled
+        else:
+            unhandled.extend(idx for f in rejected for idx in (f.record_indexes or (f.index,)))
+    return sorted(unhandled)
+
+if INIT_PRIME != 'off':
+    #pylint: disable=wrong-import-position
+    from multiprocessing import parent_process
+    from .priming import prime, register_snapshot_hooks
+    # The encode worker processes (see workers.py) import the package too,
+    # but only make events.
+    if parent_process() is None:
+        register_snapshot_hooks(network=INIT_PRIME == 'network')
+        prime(network=INIT_PRIME == 'network')
@@ -0,0 +1,112 @@
+"""
+Packing several records into one EventBridge event, for tables (like audit
+logs) where one event per record means a lot of billed PutEvents entries.
+
+A run of consecutive records for the same table and eventName (and the same
+bus and DetailType) is put as one envelope event, up to AGGREGATE_RECORDS
+records and AGGREGATE_MAX_BYTES. The envelope's `Detail` is
+`{"Records": [...]}`, with the detail of each record as `make_event` made it,
+and its DetailType has AGGREGATE_DETAILTYPE_SUFFIX added. Only consecutive
+records are packed, so the events for an item stay in order.
+"""
+import os
+
+from .publish import entry_size
+
+AGGREGATE_RECORDS = int(os.environ['AGGREGATE_RECORDS']) \
+    if os.environ.get('AGGREGATE_RECORDS') \
+    else 0
+AGGREGATE_MAX_BYTES = int(os.environ['AGGREGATE_MAX_BYTES']) \
+    if os.environ.get('AGGREGATE_MAX_BYTES') \
+    else 64 * 1024
+AGGREGATE_DETAILTYPE_SUFFIX = os.environ['AGGREGATE_DETAILTYPE_SUFFIX'] \
+    if os.environ.get('AGGREGATE_DETAILTYPE_SUFFIX') \
+    else ' (Aggregated)'
+
+ENVELOPE_PREFIX = '{"Records": ['
+ENVELOPE_SEPARATOR = ', '
+ENVELOPE_SUFFIX = ']}'
+
+
+class EventAggregator:
+    #pylint: disable=too-few-public-methods
+    """
+    Packs the events for runs of records into envelope events. As the
+    envelopes are made, the batch indexes of their records are kept, so a
+    failed envelope can be traced back to its records.
+
+    Args:
+        max_records (int): most records in an envelope.
+        max_bytes (int): size budget of an envelope, as `entry_size`
+            counts it. A record bigger than it is put by itself.
+        detail_type_suffix (str): added to the DetailType of the envelopes.
+    """
+
+    def __init__(self, max_records=AGGREGATE_RECORDS, max_bytes=AGGREGATE_MAX_BYTES,
+                 detail_type_suffix=AGGREGATE_DETAILTYPE_SUFFIX):
+        self.max_records = max_records
+        self.max_bytes = max_bytes
+        self.detail_type_suffix = detail_type_suffix
+        self.event_indexes = []
+        self.record_indexes = []
+
+    def aggregate(self, events, event_indexes, event_names):
+        """
+        Generator of the envelope events. `event_indexes` and `record_indexes`
+        have the batch index of the first record, and of all the records,
+        of each envelope made so far.
+
+        Args:
+            events (Iterable[dict]): PutEvents entries of the records.
+            event_indexes (Sequence[int]): batch index of each event's
+                record. It may be filled as `events` is consumed.
+            event_names (Mapping[int, str]): eventName of the records, by
+                batch index.
+
+        Yields:
+            dict: PutEvents entry of an envelope.
+        """
+        run = []
+        run_key = None
+        run_indexes = []
+        run_size = 0
+        for event_idx, event in enumerate(events):
+            record_idx = event_indexes[event_idx]
+            key = (
+                event_names.get(record_idx),
+                event.get('EventBusName'),
+                event.get('DetailType'),
+                tuple(event.get('Resources', ())),
+            )
+            detail_size = len(event['Detail'].encode('utf-8'))
+            if run and (
+                key != run_key
+                or len(run) >= self.max_records
+                or run_size + len(ENVELOPE_SEPARATOR) + detail_size > self.max_bytes
+            ):
+                yield self._envelope(run, run_indexes)
+                run = []
+
+            if not run:
+                run_key = key
+                run_indexes = []
+                run_size = entry_size(event) + len(ENVELOPE_PREFIX) + len(ENVELOPE_SUFFIX) \
+                    + len(self.detail_type_suffix.encode('utf-8'))
+            else:
+                run_size += len(ENVELOPE_SEPARATOR) + detail_size
+            run.append(event)
+            run_indexes.append(record_idx)
+
+        if run:
+            yield self._envelope(run, run_indexes)
+
+    def _envelope(self, run, run_indexes):
+        """ Make the envelope event for a run of events. """
+        self.event_indexes.append(run_indexes[0])
+        self.record_indexes.append(run_indexes)
+        return dict(
+            run[0],
+            DetailType=run[0]['DetailType'] + self.detail_type_suffix,
+            Detail=ENVELOPE_PREFIX + ENVELOPE_SEPARATOR.join(e['Detail'] for e in run) \
+                + ENVELOPE_SUFFIX,
+        )
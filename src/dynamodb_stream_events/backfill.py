@@ -0,0 +1,478 @@
+"""
+Backfill a table's current items from a DynamoDB export to S3, so a new
+EventBridge consumer can start from the table's state instead of only the
+changes after it subscribed.
+
+The export's `DYNAMODB_JSON` data files (`*.json.gz`, a `{"Item": ...}` line
+per item) are read from a local directory or S3 (or an S3 compatible store,
+with `AWS_ENDPOINT_URL_S3`), decompressed as they are read, and each item is
+published as an `INSERT` record through the same `put_records` as the Lambda
+handler. The files are read by parallel workers, each holding one batch of
+records at a time, so memory doesn't grow with the export.
+
+The number of lines done in each file is checkpointed (see checkpoints.py,
+with the export as the stream and the file as the shard) after each batch, so
+an interrupted backfill resumes where it stopped.
+
+Run it with `python -m dynamodb_stream_events.backfill`.
+"""
+from argparse import ArgumentParser
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing
+from datetime import datetime
+import gzip
+import logging
+import os
+from os import path
+import signal
+import sys
+from threading import Event, Lock
+import time
+
+from . import LOGGING_LEVEL, json
+from .checkpoints import SHARD_END, open_checkpoint_store
+from .clients import error_code, get_dynamodb_clnt
+from .poller import process_records
+from .spool import LocalSpool, S3Spool, open_spool
+from .streams import parse_table_arn
+
+BACKFILL_BATCH_SIZE = int(os.environ['BACKFILL_BATCH_SIZE']) \
+    if os.environ.get('BACKFILL_BATCH_SIZE') \
+    else 500
+BACKFILL_WORKERS = int(os.environ['BACKFILL_WORKERS']) \
+    if os.environ.get('BACKFILL_WORKERS') \
+    else 4
+
+EXPORT_DATA_SUFFIX = '.json.gz'
+EXPORT_SUMMARY_NAME = 'manifest-summary.json'
+
+logger = logging.getLogger(__name__)
+
+
+class LocalExport(LocalSpool):
+    """
+    Export files in a local directory.
+
+    Args:
+        directory (str): the export directory, or its `data` directory.
+    """
+    suffix = EXPORT_DATA_SUFFIX
+
+    def open(self, name):
+        """ Open a file, for reading bytes. """
+        return open(path.join(self.directory, name), 'rb')
+
+    def read_summary(self):
+        """ Read the export's manifest summary; None if there isn't one. """
+        try:
+            return json.loads(self.read_data(EXPORT_SUMMARY_NAME))
+        except FileNotFoundError:
+            return None
+
+
+class S3Export(S3Spool):
+    """
+    Export files in an S3 bucket.
+
+    Args:
+        bucket (str): name of the bucket.
+        prefix (str): prefix of the export (or its `data/`) keys.
+        s3_clnt (obj): S3 client. Default: the shared client.
+    """
+    suffix = EXPORT_DATA_SUFFIX
+
+    def open(self, name):
+        """ Open an object, for reading bytes as they are downloaded. """
+        res = self._clnt().get_object(Bucket=self.bucket, Key=f"{self.prefix}{name}")
+        return res['Body']
+
+    def read_summary(self):
+        """ Read the export's manifest summary; None if there isn't one. """
+        try:
+            return json.loads(self.read_data(EXPORT_SUMMARY_NAME))
+        except Exception as err: #pylint: disable=broad-exception-caught
+            if error_code(err) in ('NoSuchKey', '404'):
+                return None
+            raise
+
+
+def open_export(url):
+    """
+    Open an export.
+
+    Args:
+        url (str): `s3://BUCKET/PREFIX`, `file:DIR`, or a directory, like a
+            spool.
+
+    Returns:
+        obj: the export.
+    """
+    location = open_spool(url)
+    if isinstance(location, S3Spool):
+        return S3Export(location.bucket, location.prefix)
+    return LocalExport(location.directory)
+
+
+def get_key_names(table_name, dynamodb_clnt=None):
+    """
+    Get the names of a table's key attributes.
+
+    Args:
+        table_name (str): name of the table.
+        dynamodb_clnt (obj): DynamoDB client. Default: the shared client.
+
+    Returns:
+        List[str]: the hash key name, and the range key name if it has one.
+    """
+    if dynamodb_clnt is None:
+        dynamodb_clnt = get_dynamodb_clnt()
+    res = dynamodb_clnt.describe_table(TableName=table_name)
+    return [k['AttributeName'] for k in res['Table']['KeySchema']]
+
+
+class Progress:
+    """
+    Counts the items backfilled, and logs the progress and throughput.
+
+    Args:
+        total_files (int): data files to backfill.
+        interval (float): seconds between progress logs.
+    """
+
+    def __init__(self, total_files, interval=10.0):
+        self.total_files = total_files
+        self.interval = interval
+        self.lock = Lock()
+        self.started = time.monotonic()
+        self.logged = self.started
+        self.stats = dict(files=0, skipped=0, failed=0, items=0, invalid=0)
+
+    def add(self, **counts):
+        """ Add to the counts, and log the progress if it is time to. """
+        with self.lock:
+            for name, count in counts.items():
+                self.stats[name] += count
+            now = time.monotonic()
+            if now - self.logged < self.interval:
+                return
+            self.logged = now
+            self.log()
+
+    def log(self):
+        """ Log the progress. """
+        elapsed = max(time.monotonic() - self.started, 0.001)
+        logger.info(
+            'Backfilled %(items)d items (%(rate).0f/s) from %(done)d of %(total)d files',
+            {
+                'items': self.stats['items'],
+                'rate': self.stats['items'] / elapsed,
+                'done': self.stats['files'] + self.stats['skipped'] + self.stats['failed'],
+                'total': self.total_files,
+            }
+        )
+
+
+class Backfill:
+    #pylint: disable=too-many-instance-attributes
+    """
+    Publishes the items of an export's data files as INSERT records.
+
+    Args:
+        export (obj): the export, from `open_export`.
+        export_url (str): the export's URL, that the checkpoints are kept for.
+        table_arn (str): ARN of the exported table.
+        key_names (List[str]): names of the table's key attributes.
+        checkpoints (obj): checkpoint store.
+        process (Callable): called with each batch of records; returns the
+            sequence numbers of the ones that failed. Default:
+            `process_records`.
+        batch_size (int): records read and published at a time, per worker.
+        workers (int): files read at once.
+        attempts (int): times to try a batch's failed records.
+        created (float): `ApproximateCreationDateTime` of the records.
+            Default: the export time, or now.
+        progress_interval (float): seconds between progress logs.
+    """
+
+    def __init__(self, export, export_url, table_arn, key_names, checkpoints, process=None,
+                 batch_size=BACKFILL_BATCH_SIZE, workers=BACKFILL_WORKERS, attempts=5,
+                 created=None, progress_interval=10.0):
+        #pylint: disable=too-many-arguments,too-many-positional-arguments
+        self.export = export
+        self.export_url = export_url
+        self.table_arn = table_arn
+        self.key_names = key_names
+        self.checkpoints = checkpoints
+        self.process = process if process is not None else process_records
+        self.batch_size = batch_size
+        self.workers = workers
+        self.attempts = attempts
+        self.created = created if created is not None else time.time()
+        self.progress_interval = progress_interval
+        self.region = table_arn.split(':')[3]
+        self.progress = None
+        self.stop_event = Event()
+
+    def stop(self):
+        """ Ask the backfill to stop; files stop after their current batch. """
+        self.stop_event.set()
+
+    def run(self):
+        """
+        Backfill the data files that aren't done yet.
+
+        Returns:
+            dict: counts of the files done, skipped (done by an earlier run),
+            and failed, and of the items published and the invalid lines.
+        """
+        names = self.export.names()
+        self.progress = Progress(len(names), self.progress_interval)
+        logger.info('Backfilling %(count)d files from %(url)s', {
+            'count': len(names),
+            'url': self.export_url,
+        })
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            futures = {executor.submit(self.backfill_file, name): name for name in names}
+            for future, name in futures.items():
+                try:
+                    future.result()
+                except Exception: #pylint: disable=broad-exception-caught
+                    # Left at its checkpoint, like a file with a batch that
+                    # still fails; the other files carry on.
+                    logger.exception('[%(name)s] Backfill failed', {'name': name})
+                    self.progress.add(failed=1)
+        self.progress.log()
+        return self.progress.stats
+
+    def make_record(self, name, line_number, item, size):
+        """
+        Make an INSERT stream record for an exported item. Its `eventID` is
+        the same every time the file is backfilled, for IDEMPOTENCY.
+
+        Args:
+            name (str): name of the data file.
+            line_number (int): line of the item in the file.
+            item (dict): the item's typed attributes.
+            size (int): size of the item's line.
+
+        Returns:
+            dict: the stream record.
+        """
+        return {
+            'eventID': f"backfill:{name}:{line_number}",
+            'eventName': 'INSERT',
+            'eventVersion': '1.1',
+            'eventSource': 'aws:dynamodb',
+            'awsRegion': self.region,
+            'eventSourceARN': self.table_arn,
+            'dynamodb': {
+                'ApproximateCreationDateTime': self.created,
+                'Keys': {k: item[k] for k in self.key_names if k in item},
+                'NewImage': item,
+                'SequenceNumber': str(line_number),
+                'SizeBytes': size,
+                'StreamViewType': 'NEW_IMAGE',
+            },
+        }
+
+    def _decode_lines(self, name, line_numbers, lines):
+        """
+        Make the records for a batch of lines. They are parsed with a single
+        JSON call; if that fails, one by one to skip the ones that can't be.
+
+        Returns:
+            Tuple[List[dict], int]: the records, and the number of invalid
+            lines.
+        """
+        try:
+            items = json.loads(b'[' + b','.join(lines) + b']')
+            if len(items) != len(lines):
+                raise ValueError('A line has more than one value')
+        except ValueError:
+            items = []
+            for line in lines:
+                try:
+                    items.append(json.loads(line))
+                except ValueError:
+                    items.append(None)
+
+        records = []
+        invalid = 0
+        for line_number, item, line in zip(line_numbers, items, lines):
+            if not isinstance(item, dict) or not isinstance(item.get('Item'), dict):
+                logger.warning('[%(name)s:%(line)d] Not an exported item', {
+                    'name': name,
+                    'line': line_number,
+                })
+                invalid += 1
+                continue
+            records.append(self.make_record(name, line_number, item['Item'], len(line)))
+        return records, invalid
+
+    def _put_batch(self, name, records):
+        """
+        Publish a batch, retrying its failed records. An attempt that raises
+        fails all of them. Returns if it worked.
+        """
+        delay = 1.0
+        for attempt in range(self.attempts):
+            if attempt:
+                self.stop_event.wait(delay)
+                delay = min(delay * 2, 30.0)
+            try:
+                failed = set(self.process(records))
+            except Exception: #pylint: disable=broad-exception-caught
+                logger.exception('[%(name)s] Publishing %(count)d records failed', {
+                    'name': name,
+                    'count': len(records),
+                })
+                continue
+            if not failed:
+                return True
+            records = [r for r in records if r['dynamodb']['SequenceNumber'] in failed]
+            logger.warning('[%(name)s] %(count)d records failed (attempt %(attempt)d)', {
+                'name': name,
+                'count': len(records),
+                'attempt': attempt + 1,
+            })
+        return False
+
+    def backfill_file(self, name):
+        """
+        Backfill a data file, from its checkpoint to the end or until the
+        backfill stops. The file is left at its last checkpoint if a batch
+        still fails after all the attempts.
+        """
+        done = self.checkpoints.get(self.export_url, name)
+        if done == SHARD_END:
+            self.progress.add(skipped=1)
+            return
+        skip = int(done) if done else 0
+        if skip:
+            logger.info('[%(name)s] Resuming after line %(line)d', {'name': name, 'line': skip})
+
+        line_number = 0
+        with closing(self.export.open(name)) as raw, \
+                gzip.GzipFile(fileobj=raw, mode='rb') as file_p:
+            while not self.stop_event.is_set():
+                line_numbers = []
+                lines = []
+                for line in file_p:
+                    line_number += 1
+                    if line_number > skip and line.strip():
+                        line_numbers.append(line_number)
+                        lines.append(line)
+                        if len(lines) >= self.batch_size:
+                            break
+                if not lines:
+                    break
+
+                records, invalid = self._decode_lines(name, line_numbers, lines)
+                if records and not self._put_batch(name, records):
+                    logger.error('[%(name)s] Stopping at line %(line)d', {
+                        'name': name,
+                        'line': line_numbers[0],
+                    })
+                    self.progress.add(failed=1)
+                    return
+                self.checkpoints.put(self.export_url, name, str(line_number))
+                self.progress.add(items=len(records), invalid=invalid)
+            else:
+                return
+
+        self.checkpoints.put(self.export_url, name, SHARD_END)
+        self.progress.add(files=1)
+
+
+def get_args():
+    """ Get the command line arguments. """
+    parser = ArgumentParser(description='Publish the items of a DynamoDB export as INSERT events.')
+    parser.add_argument(
+        'export',
+        help='Export data: s3://BUCKET/PREFIX, file:DIR, or a directory.'
+    )
+    parser.add_argument(
+        '--table-arn',
+        help='ARN of the exported table. Default: from the manifest-summary.json'
+    )
+    parser.add_argument(
+        '--keys',
+        help='Comma separated key attribute names. Default: from DescribeTable'
+    )
+    parser.add_argument(
+        '--checkpoint-store',
+        default='file:backfill-checkpoints.json',
+        help='Checkpoint store: file:PATH or sqlite:PATH. Default: %(default)r'
+    )
+    parser.add_argument(
+        '--batch-size',
+        type=int,
+        default=BACKFILL_BATCH_SIZE,
+        help='Records published at a time, per worker. Default: %(default)r'
+    )
+    parser.add_argument(
+        '--workers',
+        type=int,
+        default=BACKFILL_WORKERS,
+        help='Files read at once. Default: %(default)r'
+    )
+    parser.add_argument(
+        '--attempts',
+        type=int,
+        default=5,
+        help='Times to try the failed records of a batch. Default: %(default)r'
+    )
+    parser.add_argument(
+        '--progress-interval',
+        type=float,
+        default=10.0,
+        help='Seconds between progress logs. Default: %(default)r'
+    )
+    return parser.parse_args()
+
+
+def main(args):
+    """ Backfill the export, until done or stopped with SIGTERM or SIGINT. """
+    export = open_export(args.export)
+    summary = export.read_summary() or {}
+    table_arn = args.table_arn or summary.get('tableArn')
+    if not table_arn or parse_table_arn(table_arn) is None:
+        logger.error('A table ARN is needed: --table-arn, or a manifest-summary.json')
+        return 2
+    key_names = args.keys.split(',') if args.keys \
+        else get_key_names(parse_table_arn(table_arn)[1])
+
+    created = None
+    if summary.get('exportTime'):
+        created = datetime.fromisoformat(summary['exportTime'].replace('Z', '+00:00')).timestamp()
+
+    checkpoints = open_checkpoint_store(args.checkpoint_store)
+    backfill = Backfill(
+        export,
+        args.export,
+        table_arn,
+        key_names,
+        checkpoints,
+        batch_size=args.batch_size,
+        workers=args.workers,
+        attempts=args.attempts,
+        created=created,
+        progress_interval=args.progress_interval,
+    )
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(signum, lambda signum, frame: backfill.stop())
+
+    try:
+        stats = backfill.run()
+    finally:
+        checkpoints.close()
+    logger.info(
+        'Backfilled %(items)d items from %(files)d files (%(skipped)d already done); '
+        '%(failed)d files failed, %(invalid)d invalid lines',
+        stats
+    )
+    return 1 if stats['failed'] else 0
+
+if __name__ == '__main__':
+    logging.basicConfig(level=LOGGING_LEVEL, stream=sys.stderr)
+    sys.exit(main(get_args()))
@@ -0,0 +1,133 @@
+"""
+Checkpoint storage for the stream poller: the last processed sequence number
+of each shard, or `SHARD_END` once a closed shard has been read to the end.
+
+Stores are opened from a URL with `open_checkpoint_store`:
+
+- `file:PATH` (or just `PATH`): a JSON file, rewritten on every update.
+- `sqlite:PATH`: an SQLite database.
+"""
+import json
+import logging
+import os
+from os import path
+import sqlite3
+from threading import Lock
+
+SHARD_END = 'SHARD_END'
+
+logger = logging.getLogger(__name__)
+
+
+class FileCheckpointStore:
+    """
+    Checkpoints in a JSON file. The file is replaced atomically on every
+    update, so it is never left half written.
+
+    Args:
+        file_path (str): path of the JSON file; created if it doesn't exist.
+    """
+
+    def __init__(self, file_path):
+        self.file_path = file_path
+        self.lock = Lock()
+        self.checkpoints = {}
+        if path.exists(file_path):
+            with open(file_path, 'r', encoding='utf-8') as file_p:
+                self.checkpoints = json.load(file_p)
+
+    def get(self, stream_arn, shard_id):
+        """
+        Get the checkpoint of a shard.
+
+        Returns:
+            str: sequence number, `SHARD_END`, or None if the shard hasn't
+            been checkpointed.
+        """
+        with self.lock:
+            return self.checkpoints.get(stream_arn, {}).get(shard_id)
+
+    def put(self, stream_arn, shard_id, sequence_number):
+        """ Set the checkpoint of a shard. """
+        with self.lock:
+            self.checkpoints.setdefault(stream_arn, {})[shard_id] = sequence_number
+
+            tmp_path = f"{self.file_path}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as file_p:
+                json.dump(self.checkpoints, file_p, indent=2, sort_keys=True)
+            os.replace(tmp_path, self.file_path)
+
+    def close(self):
+        """ Nothing to close; every update is already written. """
+
+
+class SQLiteCheckpointStore:
+    """
+    Checkpoints in an SQLite database.
+
+    Args:
+        db_path (str): path of the database; created if it doesn't exist.
+    """
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self.lock = Lock()
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        with self.lock, self.conn:
+            self.conn.execute('''
+                CREATE TABLE IF NOT EXISTS checkpoints (
+                    stream_arn TEXT NOT NULL,
+                    shard_id TEXT NOT NULL,
+                    sequence_number TEXT NOT NULL,
+                    PRIMARY KEY (stream_arn, shard_id)
+                )
+            ''')
+
+    def get(self, stream_arn, shard_id):
+        """
+        Get the checkpoint of a shard.
+
+        Returns:
+            str: sequence number, `SHARD_END`, or None if the shard hasn't
+            been checkpointed.
+        """
+        with self.lock:
+            row = self.conn.execute(
+                'SELECT sequence_number FROM checkpoints WHERE stream_arn = ? AND shard_id = ?',
+                (stream_arn, shard_id)
+            ).fetchone()
+        return row[0] if row else None
+
+    def put(self, stream_arn, shard_id, sequence_number):
+        """ Set the checkpoint of a shard. """
+        with self.lock, self.conn:
+            self.conn.execute(
+                'INSERT OR REPLACE INTO checkpoints (stream_arn, shard_id, sequence_number) '
+                'VALUES (?, ?, ?)',
+                (stream_arn, shard_id, sequence_number)
+            )
+
+    def close(self):
+        """ Close the database. """
+        with self.lock:
+            self.conn.close()
+
+
+def open_checkpoint_store(url):
+    """
+    Open a checkpoint store.
+
+    Args:
+        url (str): `file:PATH`, `sqlite:PATH`, or a path for a JSON file.
+
+    Returns:
+        obj: the checkpoint store.
+    """
+    scheme, sep, store_path = url.partition(':')
+    if sep and scheme == 'sqlite':
+        logger.debug('Using SQLite checkpoints: %(path)s', {'path': store_path})
+        return SQLiteCheckpointStore(store_path)
+    if sep and scheme == 'file':
+        url = store_path
+    logger.debug('Using file checkpoints: %(path)s', {'path': url})
+    return FileCheckpointStore(url)
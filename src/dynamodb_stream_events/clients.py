@@ -0,0 +1,224 @@
+"""
+Deferred creation of the AWS clients. Importing boto3 loads botocore and its
+service models, so this is only done the first time a client is needed.
+
+The clients are created with a tuned botocore config (see `client_config`):
+a connection pool big enough for the lanes, timeouts that fit in the function
+timeout, the standard retry mode, and TCP keep-alive. Latency hooks (see
+`add_latency_hook`) are called with the time on the wire of each attempt.
+
+The EventBridge client makes fewer attempts (CLIENT_EVENTS_MAX_ATTEMPTS):
+PutEvents throttling is retried by `_put_chunk` through the rate limiter,
+failed entries are spooled, and a retry stacked under those would only spend
+the time before the deadline.
+"""
+import logging
+import os
+from threading import Lock
+import time
+
+from .lanes import PARALLEL_LANES
+
+CLIENT_MAX_POOL_CONNECTIONS = int(os.environ['CLIENT_MAX_POOL_CONNECTIONS']) \
+    if os.environ.get('CLIENT_MAX_POOL_CONNECTIONS') \
+    else max(10, PARALLEL_LANES)
+CLIENT_CONNECT_TIMEOUT = float(os.environ['CLIENT_CONNECT_TIMEOUT']) \
+    if os.environ.get('CLIENT_CONNECT_TIMEOUT') \
+    else 2.0
+CLIENT_READ_TIMEOUT = float(os.environ['CLIENT_READ_TIMEOUT']) \
+    if os.environ.get('CLIENT_READ_TIMEOUT') \
+    else 3.0
+CLIENT_RETRY_MODE = os.environ['CLIENT_RETRY_MODE'].lower() \
+    if os.environ.get('CLIENT_RETRY_MODE') \
+    else 'standard'
+CLIENT_MAX_ATTEMPTS = int(os.environ['CLIENT_MAX_ATTEMPTS']) \
+    if os.environ.get('CLIENT_MAX_ATTEMPTS') \
+    else 3
+CLIENT_EVENTS_MAX_ATTEMPTS = int(os.environ['CLIENT_EVENTS_MAX_ATTEMPTS']) \
+    if os.environ.get('CLIENT_EVENTS_MAX_ATTEMPTS') \
+    else 2
+CLIENT_TCP_KEEPALIVE = os.environ['CLIENT_TCP_KEEPALIVE'].lower() in ('1', 'true', 'yes') \
+    if os.environ.get('CLIENT_TCP_KEEPALIVE') \
+    else True
+CLIENT_LATENCY_LOG = os.environ['CLIENT_LATENCY_LOG'].lower() in ('1', 'true', 'yes') \
+    if os.environ.get('CLIENT_LATENCY_LOG') \
+    else False
+
+# Key in the botocore request context for the time an attempt was sent.
+_WIRE_START = 'dynamodbStreamEventsWireStart'
+
+logger = logging.getLogger(__name__)
+
+_clients = {}
+_clients_lock = Lock()
+_latency_hooks = []
+
+
+def client_config(service=None):
+    """
+    Get the botocore config for the clients, from the CLIENT_* settings.
+
+    Args:
+        service (str): the service name of the client. `events` makes
+            CLIENT_EVENTS_MAX_ATTEMPTS attempts.
+
+    Returns:
+        botocore.config.Config: the config.
+    """
+    from botocore.config import Config #pylint: disable=import-outside-toplevel
+
+    max_attempts = CLIENT_EVENTS_MAX_ATTEMPTS if service == 'events' else CLIENT_MAX_ATTEMPTS
+    return Config(
+        max_pool_connections=CLIENT_MAX_POOL_CONNECTIONS,
+        connect_timeout=CLIENT_CONNECT_TIMEOUT,
+        read_timeout=CLIENT_READ_TIMEOUT,
+        retries={'mode': CLIENT_RETRY_MODE, 'max_attempts': max_attempts},
+        tcp_keepalive=CLIENT_TCP_KEEPALIVE,
+    )
+
+
+def add_latency_hook(hook):
+    """
+    Call a function with the wire latency of each attempt of each call the
+    clients make: from when the signed request is sent to when the response
+    (or error) is received.
+
+    Args:
+        hook (Callable): called with the botocore service id (like
+            `eventbridge`), the operation name, the latency in milliseconds,
+            and the exception if the attempt failed. It must be thread safe.
+    """
+    if hook not in _latency_hooks:
+        _latency_hooks.append(hook)
+
+
+def remove_latency_hook(hook):
+    """ Stop calling a function added with `add_latency_hook`. """
+    if hook in _latency_hooks:
+        _latency_hooks.remove(hook)
+
+
+def log_latency(service, operation, latency_ms, exception=None):
+    """ Latency hook that writes a debug log for each attempt. """
+    logger.debug('%(service)s.%(operation)s: %(ms).3f ms%(error)s', {
+        'service': service,
+        'operation': operation,
+        'ms': latency_ms,
+        'error': f" ({type(exception).__name__})" if exception is not None else '',
+    })
+
+
+def _wire_start(request, **kwargs):
+    #pylint: disable=unused-argument
+    request.context[_WIRE_START] = time.perf_counter()
+
+
+def _wire_end(context, event_name, exception=None, **kwargs):
+    #pylint: disable=unused-argument
+    start = context.pop(_WIRE_START, None)
+    if start is None or not _latency_hooks:
+        return
+    latency_ms = (time.perf_counter() - start) * 1000
+    _, service, operation = event_name.split('.', 2)
+    for hook in list(_latency_hooks):
+        try:
+            hook(service, operation, latency_ms, exception)
+        except Exception: #pylint: disable=broad-exception-caught
+            logger.exception('Latency hook failed')
+
+
+def create_clnt(service):
+    """
+    Create a client with the tuned config, and the latency hooks.
+
+    Args:
+        service (str): the service name, like `events`.
+
+    Returns:
+        obj: boto3 client.
+    """
+    import boto3 #pylint: disable=import-outside-toplevel
+
+    clnt = boto3.client(service, config=client_config(service))
+    # Registered after the signer, so the time is only on the wire.
+    clnt.meta.events.register('request-created', _wire_start)
+    clnt.meta.events.register('response-received', _wire_end)
+    return clnt
+
+
+def _get_clnt(service):
+    clnt = _clients.get(service)
+    if clnt is None:
+        with _clients_lock:
+            clnt = _clients.get(service)
+            if clnt is None:
+                logger.debug('Creating the %(service)s client', {'service': service})
+                clnt = _clients[service] = create_clnt(service)
+    return clnt
+
+
+def error_code(err):
+    """
+    Get the AWS error code of a client exception.
+
+    Args:
+        err (Exception): the exception.
+
+    Returns:
+        str: the code, or None if it isn't an AWS error.
+    """
+    return getattr(err, 'response', {}).get('Error', {}).get('Code')
+
+
+def get_events_clnt():
+    """
+    Get the shared EventBridge client, creating it on first use.
+
+    Returns:
+        obj: boto3 client for EventBridge.
+    """
+    return _get_clnt('events')
+
+
+def get_streams_clnt():
+    """
+    Get the shared DynamoDB Streams client, creating it on first use.
+
+    Returns:
+        obj: boto3 client for DynamoDB Streams.
+    """
+    return _get_clnt('dynamodbstreams')
+
+
+def get_dynamodb_clnt():
+    """
+    Get the shared DynamoDB client, creating it on first use.
+
+    Returns:
+        obj: boto3 client for DynamoDB.
+    """
+    return _get_clnt('dynamodb')
+
+
+def get_s3_clnt():
+    """
+    Get the shared S3 client, creating it on first use.
+
+    Returns:
+        obj: boto3 client for S3.
+    """
+    return _get_clnt('s3')
+
+
+def reset_clients():
+    """
+    Forget the created clients, so the next call creates new ones. Useful when
+    the network connections are no longer valid (for example, after a
+    snapshot restore).
+    """
+    with _clients_lock:
+        _clients.clear()
+
+
+if CLIENT_LATENCY_LOG:
+    add_latency_hook(log_latency)
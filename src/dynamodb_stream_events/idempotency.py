@@ -0,0 +1,364 @@
+"""
+Remembering the records that were published, so a batch that Lambda retries
+(after a partial failure or a timeout) doesn't publish them again.
+
+Records are keyed by their `eventID`. An in-process LRU of the recent keys is
+kept between warm invocations, and can be backed by a store that outlives the
+process, opened from IDEMPOTENCY with `open_idempotency_store`:
+
+- `memory`: only the LRU.
+- `sqlite:PATH`: an SQLite database, for running locally.
+- `dynamodb:TABLE`: a DynamoDB table with a string `pk` hash key, and TTL
+  enabled on `expires`.
+
+Stream records are kept for 24 hours, so a record can't be retried after
+IDEMPOTENCY_TTL (default: a day).
+"""
+from collections import OrderedDict
+import logging
+import os
+import random
+from threading import Lock
+import time
+
+from .clients import get_dynamodb_clnt
+
+IDEMPOTENCY = os.environ['IDEMPOTENCY'] \
+    if os.environ.get('IDEMPOTENCY') \
+    else 'off'
+IDEMPOTENCY_CACHE_SIZE = int(os.environ['IDEMPOTENCY_CACHE_SIZE']) \
+    if os.environ.get('IDEMPOTENCY_CACHE_SIZE') \
+    else 10000
+IDEMPOTENCY_TTL = int(os.environ['IDEMPOTENCY_TTL']) \
+    if os.environ.get('IDEMPOTENCY_TTL') \
+    else 86400
+
+# https://docs.aws.amazon.com/amazondynamodb/latest/APIReference/API_BatchGetItem.html
+DYNAMODB_MAX_GET_KEYS = 100
+DYNAMODB_MAX_WRITE_ITEMS = 25
+# Attempts of a batch call whose keys (or items) DynamoDB leaves unprocessed,
+# with an exponential backoff from DYNAMODB_BATCH_BACKOFF seconds.
+DYNAMODB_BATCH_ATTEMPTS = 5
+DYNAMODB_BATCH_BACKOFF = 0.05
+DYNAMODB_BATCH_MAX_BACKOFF = 1.0
+SQLITE_MAX_PARAMS = 500
+# Seconds between the deletes of the expired keys, after the one on open.
+SQLITE_CLEANUP_INTERVAL = 3600
+
+logger = logging.getLogger(__name__)
+
+_caches = {}
+_caches_lock = Lock()
+
+
+def idempotency_key(record):
+    """
+    Get the idempotency key of a stream record.
+
+    Args:
+        record (dict): stream event record.
+
+    Returns:
+        str: the `eventID`, the `eventSourceARN` and `SequenceNumber` if it
+        has no `eventID`, or None if the record can't be identified.
+    """
+    if event_id := record.get('eventID'):
+        return event_id
+    if seq := record.get('dynamodb', {}).get('SequenceNumber'):
+        return f"{record.get('eventSourceARN', '')}#{seq}"
+    return None
+
+
+class SQLiteIdempotencyStore:
+    """
+    Published keys in an SQLite database. The expired keys are deleted on
+    open, and then at most once per SQLITE_CLEANUP_INTERVAL.
+
+    Args:
+        db_path (str): path of the database; created if it doesn't exist.
+        ttl (int): seconds to remember a key.
+    """
+
+    def __init__(self, db_path, ttl=IDEMPOTENCY_TTL):
+        import sqlite3 #pylint: disable=import-outside-toplevel
+
+        self.db_path = db_path
+        self.ttl = ttl
+        self.lock = Lock()
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        with self.lock, self.conn:
+            self.conn.execute('''
+                CREATE TABLE IF NOT EXISTS published (
+                    key TEXT NOT NULL PRIMARY KEY,
+                    expires INTEGER NOT NULL
+                )
+            ''')
+        self.cleaned = 0.0
+        self._cleanup()
+
+    def _cleanup(self):
+        """
+        Delete the expired keys, at most once per SQLITE_CLEANUP_INTERVAL.
+        Expired keys aren't found anyway; this only keeps the database small.
+        """
+        now = time.time()
+        if now - self.cleaned < SQLITE_CLEANUP_INTERVAL:
+            return
+        self.cleaned = now
+        with self.lock, self.conn:
+            self.conn.execute('DELETE FROM published WHERE expires <= ?', (int(now),))
+
+    def published(self, keys):
+        """
+        Find the keys that were published.
+
+        Args:
+            keys (List[str]): keys to look for.
+
+        Returns:
+            Set[str]: the keys that were published.
+        """
+        found = set()
+        now = int(time.time())
+        with self.lock:
+            for idx in range(0, len(keys), SQLITE_MAX_PARAMS):
+                page = keys[idx:idx + SQLITE_MAX_PARAMS]
+                rows = self.conn.execute(
+                    f"SELECT key FROM published WHERE expires > ? "
+                    f"AND key IN ({', '.join('?' * len(page))})",
+                    [now, *page]
+                )
+                found.update(row[0] for row in rows)
+        return found
+
+    def put(self, keys):
+        """ Remember that the keys were published. """
+        self._cleanup()
+        expires = int(time.time()) + self.ttl
+        with self.lock, self.conn:
+            self.conn.executemany(
+                'INSERT OR REPLACE INTO published (key, expires) VALUES (?, ?)',
+                [(key, expires) for key in keys]
+            )
+
+    def close(self):
+        """ Close the database. """
+        with self.lock:
+            self.conn.close()
+
+
+class DynamoDBIdempotencyStore:
+    """
+    Published keys in a DynamoDB table. DynamoDB TTL removes them, but that
+    can lag, so `expires` is also checked when they are read. The keys left
+    unprocessed by a batch call are sent again with a backoff; if some still
+    are after DYNAMODB_BATCH_ATTEMPTS, it raises (and the cache publishes).
+
+    Args:
+        table_name (str): name of the table.
+        ttl (int): seconds to remember a key.
+        ddb_clnt (obj): DynamoDB client. Default: the shared client.
+    """
+
+    def __init__(self, table_name, ttl=IDEMPOTENCY_TTL, ddb_clnt=None):
+        self.table_name = table_name
+        self.ttl = ttl
+        self.ddb_clnt = ddb_clnt
+
+    def _clnt(self):
+        if self.ddb_clnt is None:
+            self.ddb_clnt = get_dynamodb_clnt()
+        return self.ddb_clnt
+
+    def _batch(self, operation, request, unprocessed):
+        """
+        Make a batch call, and send again what DynamoDB leaves unprocessed,
+        with an exponential (jittered) backoff, up to DYNAMODB_BATCH_ATTEMPTS
+        times.
+
+        Args:
+            operation (str): `batch_get_item` or `batch_write_item`.
+            request (dict): the `RequestItems`.
+            unprocessed (str): the response key of the unprocessed part.
+
+        Yields:
+            dict: the response of each attempt.
+
+        Raises:
+            RuntimeError: some were still unprocessed after the last attempt.
+        """
+        for attempt in range(DYNAMODB_BATCH_ATTEMPTS):
+            if attempt:
+                delay = min(DYNAMODB_BATCH_MAX_BACKOFF, DYNAMODB_BATCH_BACKOFF * 2 ** (attempt - 1))
+                time.sleep(random.uniform(delay / 2, delay))
+            res = getattr(self._clnt(), operation)(RequestItems=request)
+            yield res
+            request = res.get(unprocessed)
+            if not request:
+                return
+        raise RuntimeError(
+            f"{operation} left {unprocessed} after {DYNAMODB_BATCH_ATTEMPTS} attempts"
+        )
+
+    def published(self, keys):
+        """
+        Find the keys that were published.
+
+        Args:
+            keys (List[str]): keys to look for.
+
+        Returns:
+            Set[str]: the keys that were published.
+        """
+        found = set()
+        now = int(time.time())
+        for idx in range(0, len(keys), DYNAMODB_MAX_GET_KEYS):
+            request = {
+                self.table_name: {
+                    'Keys': [{'pk': {'S': key}} for key in keys[idx:idx + DYNAMODB_MAX_GET_KEYS]],
+                    'ProjectionExpression': 'pk, expires',
+                }
+            }
+            for res in self._batch('batch_get_item', request, 'UnprocessedKeys'):
+                for item in res.get('Responses', {}).get(self.table_name, []):
+                    if int(item['expires']['N']) > now:
+                        found.add(item['pk']['S'])
+        return found
+
+    def put(self, keys):
+        """ Remember that the keys were published. """
+        expires = str(int(time.time()) + self.ttl)
+        for idx in range(0, len(keys), DYNAMODB_MAX_WRITE_ITEMS):
+            request = {
+                self.table_name: [
+                    {'PutRequest': {'Item': {'pk': {'S': key}, 'expires': {'N': expires}}}}
+                    for key in keys[idx:idx + DYNAMODB_MAX_WRITE_ITEMS]
+                ]
+            }
+            for _ in self._batch('batch_write_item', request, 'UnprocessedItems'):
+                pass
+
+    def close(self):
+        """ Nothing to close; the client is shared. """
+
+
+def open_idempotency_store(url):
+    """
+    Open the store for the published keys.
+
+    Args:
+        url (str): `memory`, `sqlite:PATH`, or `dynamodb:TABLE`.
+
+    Returns:
+        obj: the store, or None for `memory`.
+    """
+    scheme, sep, store_path = url.partition(':')
+    if sep and scheme == 'sqlite':
+        logger.debug('Using the SQLite idempotency store: %(path)s', {'path': store_path})
+        return SQLiteIdempotencyStore(store_path)
+    if sep and scheme == 'dynamodb':
+        logger.debug('Using the DynamoDB idempotency store: %(table)s', {'table': store_path})
+        return DynamoDBIdempotencyStore(store_path)
+    if url == 'memory':
+        return None
+    raise ValueError(f"Unknown idempotency store: {url}")
+
+
+class IdempotencyCache:
+    """
+    The recently published keys, in an LRU in front of the (optional) store.
+    Errors from the store are logged, and the records are published; a
+    duplicate is better than a lost event.
+
+    Args:
+        size (int): number of keys to keep in memory.
+        store (obj): store for the keys. Default: only the LRU.
+    """
+
+    def __init__(self, size=IDEMPOTENCY_CACHE_SIZE, store=None):
+        self.size = size
+        self.store = store
+        self.lock = Lock()
+        self.keys = OrderedDict()
+
+    def unpublished(self, records):
+        """
+        Drop the records that were already published.
+
+        Args:
+            records (List[dict]): stream event records.
+
+        Returns:
+            List[dict]: the records to publish. `records` itself, if none
+            were published.
+        """
+        keys = [idempotency_key(r) for r in records]
+        with self.lock:
+            found = set()
+            for key in keys:
+                if key in self.keys:
+                    self.keys.move_to_end(key)
+                    found.add(key)
+
+        missing = [key for key in keys if key is not None and key not in found]
+        if self.store is not None and missing:
+            try:
+                found.update(self.store.published(missing))
+            except Exception: #pylint: disable=broad-exception-caught
+                logger.warning('Unable to check the idempotency store', exc_info=True)
+
+        if not found:
+            return records
+        return [r for r, key in zip(records, keys) if key not in found]
+
+    def put(self, records):
+        """
+        Remember that the records were published.
+
+        Args:
+            records (List[dict]): stream event records.
+        """
+        keys = [key for key in map(idempotency_key, records) if key is not None]
+        if not keys:
+            return
+        with self.lock:
+            for key in keys:
+                self.keys[key] = True
+                self.keys.move_to_end(key)
+            while len(self.keys) > self.size:
+                self.keys.popitem(last=False)
+
+        if self.store is not None:
+            try:
+                self.store.put(keys)
+            except Exception: #pylint: disable=broad-exception-caught
+                logger.warning('Unable to update the idempotency store', exc_info=True)
+
+
+def get_idempotency_cache():
+    """
+    Get the idempotency cache, creating it on first use.
+
+    Returns:
+        IdempotencyCache: the cache, or None if IDEMPOTENCY is `off`.
+    """
+    if IDEMPOTENCY == 'off':
+        return None
+    cache = _caches.get(IDEMPOTENCY)
+    if cache is None:
+        with _caches_lock:
+            cache = _caches.get(IDEMPOTENCY)
+            if cache is None:
+                cache = _caches[IDEMPOTENCY] = IdempotencyCache(
+                    store=open_idempotency_store(IDEMPOTENCY)
+                )
+    return cache
+
+
+def reset_idempotency_cache():
+    """ Forget the caches, so the next call creates a new one. """
+    with _caches_lock:
+        for cache in _caches.values():
+            if cache.store is not None:
+                cache.store.close()
+        _caches.clear()
@@ -7,8 +7,9 @@ import datetime
 import decimal
 from functools import partial
 import json as _json
+import sys
 
-from boto3.dynamodb.types import Binary
+from .types import Binary
 
 JSONDecoder = _json.JSONDecoder
 JSONDecodeError = _json.JSONDecodeError
@@ -28,7 +29,7 @@ class JSONEncoder(_json.JSONEncoder):
         if isinstance(o, (bytes, bytearray, array.array)):
             return b64encode(o).decode('ascii')
 
-        if isinstance(o, Binary):
+        if isinstance(o, Binary) or _is_boto3_binary(o):
             return b64encode(bytes(o)).decode('ascii')
 
         if isinstance(o, (datetime.datetime, datetime.date, datetime.time)):
@@ -44,6 +45,14 @@ class JSONEncoder(_json.JSONEncoder):
 
         return super().default(o)
 
+def _is_boto3_binary(o):
+    """
+    Check for `boto3.dynamodb.types.Binary` without importing boto3. If the
+    module isn't loaded then there can't be any instances of it.
+    """
+    boto3_types = sys.modules.get('boto3.dynamodb.types')
+    return boto3_types is not None and isinstance(o, boto3_types.Binary)
+
 dump = partial(_json.dump, cls=JSONEncoder)
 dumps = partial(_json.dumps, cls=JSONEncoder)
 
@@ -0,0 +1,207 @@
+"""
+Kinesis Data Streams for DynamoDB as an input, so the function can also be
+triggered by a Kinesis stream that a table's changes are sent to.
+
+The `data` of each Kinesis record is the base64 JSON of a change record. The
+records that the Kinesis Producer Library aggregated are split into their
+user records first. Each change record is made to look like a DynamoDB
+Streams record of a Lambda event:
+
+- `eventSourceARN` is the table's ARN, built from the `tableName` and the
+  Kinesis stream's partition and account, so routing works the same.
+- `dynamodb.ApproximateCreationDateTime` is in seconds, not milliseconds
+  (or microseconds).
+- `dynamodb.SequenceNumber` is the Kinesis sequence number, so failed
+  records are reported with it. The user records of an aggregated record
+  share it.
+"""
+from base64 import b64decode
+from hashlib import md5
+import logging
+
+from . import json
+from .publish import FailedEntry
+
+KINESIS_EVENT_SOURCE = 'aws:kinesis'
+
+# https://github.com/awslabs/amazon-kinesis-producer/blob/master/aggregation-format.md
+KPL_MAGIC = b'\xf3\x89\x9a\xc2'
+KPL_DIGEST_SIZE = 16
+
+_TIME_DIVISORS = {
+    'MILLISECOND': 1_000,
+    'MICROSECOND': 1_000_000,
+}
+
+# Placeholder for the payloads that couldn't be parsed.
+_UNDECODED = object()
+
+logger = logging.getLogger(__name__)
+
+
+def is_kinesis_event(records):
+    """
+    Check if the records of a Lambda event are from Kinesis.
+
+    Args:
+        records (List[dict]): records of the event.
+
+    Returns:
+        bool: they are Kinesis records.
+    """
+    return bool(records) and records[0].get('eventSource') == KINESIS_EVENT_SOURCE
+
+
+def _read_varint(data, pos):
+    """ Read a protobuf varint; returns the value and the position after it. """
+    result = 0
+    shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        result |= (byte & 0x7f) << shift
+        if not byte & 0x80:
+            return result, pos
+        shift += 7
+
+
+def _read_fields(data):
+    """
+    Generator of the fields of a protobuf message, as (field number, value).
+    Length delimited values are memoryviews.
+    """
+    pos = 0
+    while pos < len(data):
+        key, pos = _read_varint(data, pos)
+        field, wire_type = key >> 3, key & 0x7
+        if wire_type == 0:
+            value, pos = _read_varint(data, pos)
+        elif wire_type == 2:
+            size, pos = _read_varint(data, pos)
+            value = data[pos:pos + size]
+            pos += size
+        elif wire_type == 1:
+            value = data[pos:pos + 8]
+            pos += 8
+        elif wire_type == 5:
+            value = data[pos:pos + 4]
+            pos += 4
+        else:
+            raise ValueError(f"Unsupported protobuf wire type {wire_type}")
+        yield field, value
+
+
+def deaggregate(data):
+    """
+    Split a KPL aggregated record into its user records.
+
+    Args:
+        data (bytes): the decoded Kinesis record data.
+
+    Returns:
+        List[bytes]: the data of the user records; `[data]` if it isn't an
+        aggregated record (or its checksum doesn't match).
+    """
+    if not data.startswith(KPL_MAGIC) or len(data) < len(KPL_MAGIC) + KPL_DIGEST_SIZE:
+        return [data]
+    message = memoryview(data)[len(KPL_MAGIC):-KPL_DIGEST_SIZE]
+    if md5(message).digest() != data[-KPL_DIGEST_SIZE:]:
+        return [data]
+
+    user_records = []
+    for field, record in _read_fields(message):
+        # AggregatedRecord.records
+        if field != 3:
+            continue
+        for record_field, value in _read_fields(record):
+            # Record.data
+            if record_field == 3:
+                user_records.append(bytes(value))
+    return user_records
+
+
+def normalize_record(change, stream_arn, sequence_number):
+    """
+    Make a Kinesis Data Streams for DynamoDB change record look like a
+    DynamoDB Streams record. It is changed in place. Its `SequenceNumber` is
+    always the Kinesis one, which Lambda retries from.
+
+    Args:
+        change (dict): the decoded change record.
+        stream_arn (str): ARN of the Kinesis stream.
+        sequence_number (str): Kinesis sequence number of the record.
+
+    Returns:
+        dict: the record.
+    """
+    record_dynamodb = change['dynamodb']
+    precision = record_dynamodb.pop('ApproximateCreationDateTimePrecision', 'MILLISECOND')
+    if 'ApproximateCreationDateTime' in record_dynamodb:
+        record_dynamodb['ApproximateCreationDateTime'] /= _TIME_DIVISORS.get(precision, 1_000)
+    record_dynamodb['SequenceNumber'] = sequence_number
+
+    table_name = change.pop('tableName', None)
+    change.pop('recordFormat', None)
+    if change.get('userIdentity') is None:
+        change.pop('userIdentity', None)
+    if table_name:
+        arn_parts = stream_arn.split(':')
+        change['eventSourceARN'] = ':'.join([
+            'arn', arn_parts[1], 'dynamodb', change.get('awsRegion') or arn_parts[3],
+            arn_parts[4], f"table/{table_name}",
+        ])
+    return change
+
+
+def from_kinesis(records):
+    """
+    Decode the Kinesis records of a Lambda event into DynamoDB Streams
+    records. The payloads of a batch are parsed with a single JSON call; if
+    that fails, they are parsed one by one to find the ones that can't be.
+
+    Args:
+        records (List[dict]): Kinesis records of the event.
+
+    Returns:
+        Tuple[List[dict], List[FailedEntry]]: the stream records, in order;
+        and the Kinesis records that couldn't be decoded, with their index.
+    """
+    payloads = []
+    sources = []
+    poison = []
+    for idx, record in enumerate(records):
+        try:
+            user_records = deaggregate(b64decode(record['kinesis']['data']))
+        except (KeyError, ValueError, IndexError) as err:
+            poison.append(FailedEntry(None, type(err).__name__, str(err), idx))
+            continue
+        payloads.extend(user_records)
+        sources.extend([idx] * len(user_records))
+
+    try:
+        changes = json.loads(b'[' + b','.join(payloads) + b']')
+        if len(changes) != len(payloads):
+            raise ValueError('A payload has more than one value')
+    except ValueError:
+        changes = []
+        for payload, idx in zip(payloads, sources):
+            try:
+                changes.append(json.loads(payload))
+            except ValueError as err:
+                poison.append(FailedEntry(None, type(err).__name__, str(err), idx))
+                changes.append(_UNDECODED)
+
+    stream_records = []
+    for change, idx in zip(changes, sources):
+        if change is _UNDECODED:
+            continue
+        kinesis = records[idx]
+        try:
+            stream_records.append(normalize_record(
+                change,
+                kinesis.get('eventSourceARN', ''),
+                kinesis['kinesis'].get('sequenceNumber'),
+            ))
+        except (KeyError, TypeError, AttributeError, IndexError) as err:
+            poison.append(FailedEntry(None, type(err).__name__, str(err), idx))
+    return stream_records, sorted(poison, key=lambda f: f.index)
@@ -0,0 +1,77 @@
+"""
+Splitting a batch into lanes by item key, so the lanes can be published in
+parallel while the events for each item stay in order.
+"""
+from concurrent.futures import ThreadPoolExecutor
+import logging
+import os
+from threading import Lock
+
+PARALLEL_LANES = int(os.environ['PARALLEL_LANES']) \
+    if os.environ.get('PARALLEL_LANES') \
+    else 1
+
+logger = logging.getLogger(__name__)
+
+_executors = {}
+_executors_lock = Lock()
+
+
+def record_key(record):
+    """
+    Get a hashable key for the item of a stream record.
+
+    Args:
+        record (dict): stream event record.
+
+    Returns:
+        tuple: the key attribute names and values.
+    """
+    keys = record['dynamodb'].get('Keys') or {}
+    return tuple(sorted(
+        (name, tuple(value.items()))
+        for name, value in keys.items()
+    ))
+
+
+def partition_lanes(records, lanes):
+    """
+    Split the records into lanes by the hash of their item key. All the
+    records for an item are in the same lane, in their batch order.
+
+    Args:
+        records (List[dict]): stream event records.
+        lanes (int): number of lanes.
+
+    Returns:
+        List[List[int]]: the batch indexes of the records in each lane, for
+        the lanes that have records.
+    """
+    lane_indexes = [[] for _ in range(lanes)]
+    for idx, record in enumerate(records):
+        lane_indexes[hash(record_key(record)) % lanes].append(idx)
+    return [indexes for indexes in lane_indexes if indexes]
+
+
+def get_lane_executor(lanes):
+    """
+    Get the thread pool for the lanes, creating it on first use. It is kept
+    between invocations.
+
+    Args:
+        lanes (int): number of lanes.
+
+    Returns:
+        ThreadPoolExecutor: the pool, with a thread per lane.
+    """
+    executor = _executors.get(lanes)
+    if executor is None:
+        with _executors_lock:
+            executor = _executors.get(lanes)
+            if executor is None:
+                logger.debug('Creating the executor for %(lanes)d lanes', {'lanes': lanes})
+                executor = _executors[lanes] = ThreadPoolExecutor(
+                    max_workers=lanes,
+                    thread_name_prefix='lane'
+                )
+    return executor
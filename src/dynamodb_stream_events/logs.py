@@ -0,0 +1,36 @@
+"""
+Helpers to keep the per-record debug logging affordable.
+"""
+import logging
+import os
+import random
+
+DEBUG_SAMPLE_RATE = float(os.environ['DEBUG_SAMPLE_RATE']) \
+    if os.environ.get('DEBUG_SAMPLE_RATE') \
+    else 1.0
+
+NO_RECORDS = frozenset()
+
+
+def debug_records(logger, count, rate=None):
+    """
+    Choose the records of a batch to write debug logs for. Choosing them once
+    for the batch means a sampled record is logged in every stage, and the
+    rest aren't logged (or have their log arguments built) in any.
+
+    Args:
+        logger (logging.Logger): the logger the records are logged to.
+        count (int): records in the batch.
+        rate (float): fraction of records to log. Default: DEBUG_SAMPLE_RATE.
+
+    Returns:
+        Container[int]: indexes of the records to log. Empty if the logger
+        isn't enabled for debug.
+    """
+    if rate is None:
+        rate = DEBUG_SAMPLE_RATE
+    if rate <= 0 or not logger.isEnabledFor(logging.DEBUG):
+        return NO_RECORDS
+    if rate >= 1:
+        return range(count)
+    return frozenset(idx for idx in range(count) if random.random() < rate)
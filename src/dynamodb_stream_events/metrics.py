@@ -0,0 +1,243 @@
+"""
+Per-invocation metrics, emitted as a single CloudWatch Embedded Metric Format
+(EMF) log line.
+
+Code in the hot path should check the metrics object for truth before doing
+any timing work; `NULL_METRICS` is false, so a disabled collector costs a
+single test.
+"""
+from contextlib import contextmanager, nullcontext
+import math
+import os
+import sys
+import time
+
+from . import json
+
+METRICS_ENABLED = os.environ['METRICS_ENABLED'].lower() in ('1', 'true', 'yes') \
+    if os.environ.get('METRICS_ENABLED') \
+    else False
+METRICS_NAMESPACE = os.environ['METRICS_NAMESPACE'] \
+    if os.environ.get('METRICS_NAMESPACE') \
+    else 'DynamoDBStreamEvents'
+
+UNIT_MILLISECONDS = 'Milliseconds'
+UNIT_COUNT = 'Count'
+UNIT_BYTES = 'Bytes'
+
+# Names of the stages, used for the '{stage}Time' metrics.
+STAGE_DESERIALIZE = 'Deserialize'
+STAGE_DIFF = 'Diff'
+STAGE_ENCODE = 'Encode'
+STAGE_CHUNK = 'Chunk'
+STAGE_PUT_EVENTS = 'PutEvents'
+STAGE_WORKERS = 'Workers'
+STAGE_RATE_LIMIT = 'RateLimit'
+
+# Statistics reported for observed values, as metric name suffix and
+# percentile.
+SUMMARY_STATS = (('Min', 0), ('P50', 50), ('P99', 99), ('Max', 100))
+
+
+def percentile(values, pct):
+    """
+    Nearest-rank percentile of a sorted list.
+
+    Args:
+        values (List[float]): sorted values; must not be empty.
+        pct (float): percentile, 0 to 100.
+
+    Returns:
+        float: the value at the percentile.
+    """
+    if pct <= 0:
+        return values[0]
+    return values[min(len(values), math.ceil(pct / 100 * len(values))) - 1]
+
+
+class Metrics:
+    """
+    Collects the metrics for one invocation. Values with the same name are
+    summed.
+
+    Args:
+        namespace (str): CloudWatch namespace for the metrics.
+        dimensions (dict): dimension names and values for all the metrics.
+    """
+
+    def __init__(self, namespace=METRICS_NAMESPACE, dimensions=None):
+        self.namespace = namespace
+        self.dimensions = dict(dimensions or {})
+        self.values = {}
+        self.units = {}
+        self.observations = {}
+
+    def __bool__(self):
+        return True
+
+    def add(self, name, value, unit=UNIT_COUNT):
+        """ Add a value to a metric. """
+        self.values[name] = self.values.get(name, 0) + value
+        self.units[name] = unit
+
+    def put(self, name, value, unit=UNIT_COUNT):
+        """ Set a metric, replacing any previous value. """
+        self.values[name] = value
+        self.units[name] = unit
+
+    def observe(self, name, value, unit=UNIT_COUNT):
+        """
+        Record one observation of a value. Observations are reported as the
+        min, p50, p99 and max of the batch.
+        """
+        self.observations.setdefault(name, []).append(value)
+        self.units[name] = unit
+
+    def summary(self, name):
+        """
+        Summarize the observations of a value.
+
+        Returns:
+            dict: metric names and values; empty if there are no observations.
+        """
+        values = sorted(self.observations.get(name, []))
+        if not values:
+            return {}
+        return {
+            f"{name}{suffix}": percentile(values, pct)
+            for suffix, pct in SUMMARY_STATS
+        }
+
+    def add_time(self, stage, start):
+        """
+        Add the milliseconds since `start` (from `time.perf_counter`) to the
+        time for the stage.
+        """
+        self.add(f"{stage}Time", (time.perf_counter() - start) * 1000, UNIT_MILLISECONDS)
+
+    def lane(self):
+        """
+        Make a collector for a lane thread, to `merge` back once the lane is
+        done; collectors aren't thread safe.
+        """
+        return Metrics(self.namespace, self.dimensions)
+
+    def merge(self, other):
+        """
+        Add the metrics of another collector to this one: values are summed
+        and observations combined.
+        """
+        for name, value in other.values.items():
+            self.add(name, value, other.units[name])
+        for name, values in other.observations.items():
+            self.observations.setdefault(name, []).extend(values)
+            self.units[name] = other.units[name]
+
+    @contextmanager
+    def timer(self, stage):
+        """ Context manager that adds the time spent in it to the stage. """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(stage, start)
+
+    def to_emf(self, timestamp=None):
+        """
+        Make the EMF document for the collected metrics.
+
+        Args:
+            timestamp (float): seconds since the epoch. Default: now.
+
+        Returns:
+            dict: EMF document.
+        """
+        if timestamp is None:
+            timestamp = time.time()
+
+        values = dict(self.values)
+        units = dict(self.units)
+        for name in self.observations:
+            for stat_name, stat_value in self.summary(name).items():
+                values[stat_name] = stat_value
+                units[stat_name] = self.units[name]
+
+        doc = {
+            '_aws': {
+                'Timestamp': int(timestamp * 1000),
+                'CloudWatchMetrics': [{
+                    'Namespace': self.namespace,
+                    'Dimensions': [sorted(self.dimensions.keys())],
+                    'Metrics': [
+                        {'Name': name, 'Unit': units[name]}
+                        for name in sorted(values.keys())
+                    ],
+                }],
+            },
+        }
+        doc.update(self.dimensions)
+        for name, value in values.items():
+            doc[name] = round(value, 3) if isinstance(value, float) else value
+        return doc
+
+    def emit(self, stream=None):
+        """ Write the EMF document as a single line to stdout. """
+        if not self.values and not self.observations:
+            return
+        stream = stream or sys.stdout
+        stream.write(json.dumps(self.to_emf(), separators=(',', ':')) + '\n')
+        stream.flush()
+
+
+class NullMetrics:
+    """ Metrics collector that does nothing, for when metrics are disabled. """
+    _timer = nullcontext()
+
+    def __bool__(self):
+        return False
+
+    def add(self, name, value, unit=UNIT_COUNT):
+        """ Do nothing. """
+
+    def put(self, name, value, unit=UNIT_COUNT):
+        """ Do nothing. """
+
+    def observe(self, name, value, unit=UNIT_COUNT):
+        """ Do nothing. """
+
+    def add_time(self, stage, start):
+        """ Do nothing. """
+
+    def lane(self):
+        """ Nothing to collect for a lane either. """
+        return self
+
+    def merge(self, other):
+        """ Do nothing. """
+
+    def timer(self, stage):
+        #pylint: disable=unused-argument
+        """ Context manager that does nothing. """
+        return self._timer
+
+    def emit(self, stream=None):
+        """ Do nothing. """
+
+
+NULL_METRICS = NullMetrics()
+
+
+def new_metrics():
+    """
+    Make the metrics collector for an invocation.
+
+    Returns:
+        Metrics|NullMetrics: a collector, or `NULL_METRICS` if disabled.
+    """
+    if not METRICS_ENABLED:
+        return NULL_METRICS
+
+    dimensions = {}
+    if function_name := os.environ.get('AWS_LAMBDA_FUNCTION_NAME'):
+        dimensions['FunctionName'] = function_name
+    return Metrics(METRICS_NAMESPACE, dimensions)
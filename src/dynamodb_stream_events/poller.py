@@ -0,0 +1,413 @@
+"""
+Long running consumer of a DynamoDB Stream, for tables busy enough that a
+container polling the stream works better than the Lambda trigger.
+
+The shards of the stream are discovered with `DescribeStream`, and a shard is
+only polled once its parent has been read to the end, so the records of an
+item are always published in order. Each shard is polled in its own thread,
+sleeping longer while the shard is idle. The records go through the same
+`put_records` as the Lambda handler, and the last published sequence number of
+each shard is checkpointed (see checkpoints.py) so a restart carries on where
+it left off.
+
+Run it with `python -m dynamodb_stream_events.poller`.
+"""
+from argparse import ArgumentParser
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+import logging
+import os
+import signal
+import sys
+from threading import Event, Lock
+
+from . import LOGGING_LEVEL, put_records
+from .checkpoints import SHARD_END, open_checkpoint_store
+from .clients import error_code, get_streams_clnt
+from .metrics import new_metrics
+
+STREAM_ARN = os.environ['STREAM_ARN'] \
+    if os.environ.get('STREAM_ARN') \
+    else None
+CHECKPOINT_STORE = os.environ['CHECKPOINT_STORE'] \
+    if os.environ.get('CHECKPOINT_STORE') \
+    else 'file:checkpoints.json'
+POLL_INITIAL_POSITION = os.environ['POLL_INITIAL_POSITION'].upper() \
+    if os.environ.get('POLL_INITIAL_POSITION') \
+    else 'TRIM_HORIZON'
+POLL_LIMIT = int(os.environ['POLL_LIMIT']) \
+    if os.environ.get('POLL_LIMIT') \
+    else 1000
+POLL_MIN_SLEEP = float(os.environ['POLL_MIN_SLEEP']) \
+    if os.environ.get('POLL_MIN_SLEEP') \
+    else 0.25
+POLL_MAX_SLEEP = float(os.environ['POLL_MAX_SLEEP']) \
+    if os.environ.get('POLL_MAX_SLEEP') \
+    else 5.0
+POLL_REFRESH_INTERVAL = float(os.environ['POLL_REFRESH_INTERVAL']) \
+    if os.environ.get('POLL_REFRESH_INTERVAL') \
+    else 60.0
+POLL_MAX_WORKERS = int(os.environ['POLL_MAX_WORKERS']) \
+    if os.environ.get('POLL_MAX_WORKERS') \
+    else 64
+
+logger = logging.getLogger(__name__)
+
+
+def to_lambda_records(stream_arn, records):
+    """
+    Make `GetRecords` records look like the records of a Lambda event: add the
+    `eventSourceARN`, and make `ApproximateCreationDateTime` a timestamp.
+
+    Args:
+        stream_arn (str): ARN of the stream the records are from.
+        records (List[dict]): records from `GetRecords`.
+
+    Returns:
+        List[dict]: the Lambda style records.
+    """
+    result = []
+    for record in records:
+        record = dict(record, eventSourceARN=stream_arn)
+        tstamp = record['dynamodb'].get('ApproximateCreationDateTime')
+        if isinstance(tstamp, datetime):
+            if tstamp.tzinfo is None:
+                tstamp = tstamp.replace(tzinfo=timezone.utc)
+            record['dynamodb'] = dict(
+                record['dynamodb'],
+                ApproximateCreationDateTime=tstamp.timestamp(),
+            )
+        result.append(record)
+    return result
+
+
+def process_records(records):
+    """
+    Publish a batch of records, like the Lambda handler does.
+
+    Returns:
+        List[str]: the sequence numbers of the records that failed.
+    """
+    metrics = new_metrics()
+    try:
+        return put_records(records, metrics=metrics)
+    finally:
+        metrics.emit()
+
+
+class StreamPoller:
+    #pylint: disable=too-many-instance-attributes
+    """
+    Polls all the shards of a stream, following the shard lineage.
+
+    Args:
+        stream_arn (str): ARN of the stream.
+        checkpoints (obj): checkpoint store.
+        streams_clnt (obj): DynamoDB Streams client. Default: the shared
+            client.
+        process (Callable): called with each batch of Lambda style records,
+            returns the sequence numbers of the records that failed.
+            Default: `process_records`.
+        initial_position (str): `TRIM_HORIZON` or `LATEST`, for the shards
+            found at startup that have no checkpoint. `LATEST` skips the
+            closed ones. Shards found later always start at `TRIM_HORIZON`.
+        limit (int): maximum records per `GetRecords` call.
+        min_sleep (float): seconds between polls of a shard with records.
+        max_sleep (float): longest sleep between polls of an idle shard.
+        refresh_interval (float): seconds between shard discoveries, and the
+            longest backoff of a shard whose polling keeps failing.
+        max_workers (int): maximum shards polled at once.
+    """
+
+    def __init__(self, stream_arn, checkpoints, streams_clnt=None, process=None,
+                 initial_position=POLL_INITIAL_POSITION, limit=POLL_LIMIT,
+                 min_sleep=POLL_MIN_SLEEP, max_sleep=POLL_MAX_SLEEP,
+                 refresh_interval=POLL_REFRESH_INTERVAL, max_workers=POLL_MAX_WORKERS):
+        #pylint: disable=too-many-arguments,too-many-positional-arguments
+        self.stream_arn = stream_arn
+        self.checkpoints = checkpoints
+        self.streams_clnt = streams_clnt if streams_clnt is not None else get_streams_clnt()
+        self.process = process if process is not None else process_records
+        self.initial_position = initial_position
+        self.limit = limit
+        self.min_sleep = min_sleep
+        self.max_sleep = max_sleep
+        self.refresh_interval = refresh_interval
+        self.max_workers = max_workers
+
+        self.shards = {}
+        self.stream_status = None
+        self.running = set()
+        # Shard ID: (failures in a row, checkpoint at the last failure).
+        self.failures = {}
+        self.lock = Lock()
+        self.stop_event = Event()
+        self.wakeup = Event()
+        self._latest = set()
+
+    def stop(self):
+        """ Ask the poller to stop; shards stop after their current batch. """
+        self.stop_event.set()
+        self.wakeup.set()
+
+    def discover_shards(self):
+        """
+        Describe the stream and add any new shards.
+
+        Returns:
+            List[str]: IDs of the new shards.
+        """
+        first = not self.shards
+        new_shards = []
+        kwargs = dict(StreamArn=self.stream_arn)
+        while True:
+            desc = self.streams_clnt.describe_stream(**kwargs)['StreamDescription']
+            self.stream_status = desc.get('StreamStatus')
+            with self.lock:
+                for shard in desc.get('Shards', []):
+                    if shard['ShardId'] not in self.shards:
+                        self.shards[shard['ShardId']] = shard
+                        new_shards.append(shard['ShardId'])
+            if not desc.get('LastEvaluatedShardId'):
+                break
+            kwargs['ExclusiveStartShardId'] = desc['LastEvaluatedShardId']
+
+        if first and self.initial_position == 'LATEST':
+            for shard_id in new_shards:
+                if self.checkpoints.get(self.stream_arn, shard_id) is not None:
+                    continue
+                if 'EndingSequenceNumber' in self.shards[shard_id]['SequenceNumberRange']:
+                    self.checkpoints.put(self.stream_arn, shard_id, SHARD_END)
+                else:
+                    self._latest.add(shard_id)
+
+        if new_shards:
+            logger.info('Discovered %(count)d new shards', {'count': len(new_shards)})
+        return new_shards
+
+    def _is_finished(self, shard_id):
+        return self.checkpoints.get(self.stream_arn, shard_id) == SHARD_END
+
+    def ready_shards(self):
+        """
+        Get the shards that can be polled: not finished or already being
+        polled, and with their parent finished (or trimmed from the stream).
+
+        Returns:
+            List[str]: shard IDs.
+        """
+        ready = []
+        with self.lock:
+            for shard_id, shard in self.shards.items():
+                if shard_id in self.running or self._is_finished(shard_id):
+                    continue
+                parent_id = shard.get('ParentShardId')
+                if parent_id in self.shards and not self._is_finished(parent_id):
+                    continue
+                ready.append(shard_id)
+        return ready
+
+    def is_done(self):
+        """ True if the stream is disabled and every shard has been read. """
+        with self.lock:
+            return self.stream_status == 'DISABLED' \
+                and not self.running \
+                and all(self._is_finished(shard_id) for shard_id in self.shards)
+
+    def run(self):
+        """
+        Poll the stream until `stop` is called, or the stream is disabled
+        and completely read.
+        """
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            try:
+                while not self.stop_event.is_set():
+                    self.discover_shards()
+                    if self.is_done():
+                        logger.info('Stream is disabled and all shards have been read')
+                        break
+
+                    for shard_id in self.ready_shards():
+                        with self.lock:
+                            self.running.add(shard_id)
+                        executor.submit(self._run_shard, shard_id)
+
+                    # Woken early when a shard finishes, so its children
+                    # start right away.
+                    self.wakeup.wait(self.refresh_interval)
+                    self.wakeup.clear()
+            finally:
+                self.stop()
+
+    def _run_shard(self, shard_id):
+        try:
+            self.poll_shard(shard_id)
+            with self.lock:
+                self.failures.pop(shard_id, None)
+        except Exception: #pylint: disable=broad-exception-caught
+            # Retried from the checkpoint, after a backoff that grows while
+            # the shard fails without making progress.
+            checkpoint = self.checkpoints.get(self.stream_arn, shard_id)
+            with self.lock:
+                count, last = self.failures.get(shard_id, (0, None))
+                count = count + 1 if checkpoint == last else 1
+                self.failures[shard_id] = (count, checkpoint)
+            delay = min(self.min_sleep * 2 ** count, self.refresh_interval)
+            logger.warning('[%(shard)s] Polling failed %(count)d times; retrying in %(delay).2fs', {
+                'shard': shard_id,
+                'count': count,
+                'delay': delay,
+            }, exc_info=True)
+            self.stop_event.wait(delay)
+        finally:
+            with self.lock:
+                self.running.discard(shard_id)
+            self.wakeup.set()
+
+    def _get_iterator(self, shard_id):
+        kwargs = dict(StreamArn=self.stream_arn, ShardId=shard_id)
+        sequence_number = self.checkpoints.get(self.stream_arn, shard_id)
+        if sequence_number:
+            kwargs.update(ShardIteratorType='AFTER_SEQUENCE_NUMBER', SequenceNumber=sequence_number)
+        elif shard_id in self._latest:
+            kwargs.update(ShardIteratorType='LATEST')
+        else:
+            kwargs.update(ShardIteratorType='TRIM_HORIZON')
+
+        try:
+            return self.streams_clnt.get_shard_iterator(**kwargs)['ShardIterator']
+        except Exception as err:
+            if sequence_number and error_code(err) == 'TrimmedDataAccessException':
+                logger.warning(
+                    '[%(shard)s] Checkpoint %(seq)s has been trimmed; starting at the trim horizon',
+                    {'shard': shard_id, 'seq': sequence_number}
+                )
+                return self.streams_clnt.get_shard_iterator(
+                    StreamArn=self.stream_arn,
+                    ShardId=shard_id,
+                    ShardIteratorType='TRIM_HORIZON',
+                )['ShardIterator']
+            raise
+
+    def _process(self, shard_id, records):
+        """
+        Process records, retrying the ones that failed until they all work or
+        the poller stops.
+
+        Returns:
+            int: how many of the records, from the start, were processed.
+        """
+        records = to_lambda_records(self.stream_arn, records)
+        pending = records
+        delay = self.min_sleep
+        while not self.stop_event.is_set():
+            try:
+                failed = set(self.process(pending) or ())
+                count = len(pending)
+                pending = [r for r in pending if r['dynamodb']['SequenceNumber'] in failed]
+                if not pending:
+                    return len(records)
+                logger.warning('[%(shard)s] %(failed)d of %(count)d records failed', {
+                    'shard': shard_id,
+                    'failed': len(pending),
+                    'count': count,
+                })
+            except Exception: #pylint: disable=broad-exception-caught
+                logger.exception('[%(shard)s] Processing %(count)d records failed', {
+                    'shard': shard_id,
+                    'count': len(pending),
+                })
+            self.stop_event.wait(delay)
+            delay = min(delay * 2, self.max_sleep)
+        # Everything before the first record still pending was processed.
+        return records.index(pending[0])
+
+    def poll_shard(self, shard_id):
+        """
+        Poll a shard from its checkpoint until it is closed and read to the
+        end, or the poller stops.
+        """
+        logger.info('[%(shard)s] Polling', {'shard': shard_id})
+        iterator = self._get_iterator(shard_id)
+        delay = 0
+        while iterator and not self.stop_event.is_set():
+            try:
+                res = self.streams_clnt.get_records(ShardIterator=iterator, Limit=self.limit)
+            except Exception as err: #pylint: disable=broad-exception-caught
+                if error_code(err) != 'ExpiredIteratorException':
+                    raise
+                logger.debug('[%(shard)s] Iterator expired', {'shard': shard_id})
+                iterator = self._get_iterator(shard_id)
+                continue
+
+            records = res.get('Records', [])
+            if records:
+                done = self._process(shard_id, records)
+                if done:
+                    self.checkpoints.put(
+                        self.stream_arn,
+                        shard_id,
+                        records[done - 1]['dynamodb']['SequenceNumber']
+                    )
+                if done < len(records):
+                    return
+            iterator = res.get('NextShardIterator')
+
+            # Keep reading while there is a backlog, and back off while the
+            # shard is idle.
+            if len(records) >= self.limit:
+                delay = 0
+            elif records:
+                delay = self.min_sleep
+            else:
+                delay = min(max(delay * 2, self.min_sleep), self.max_sleep)
+            if iterator and delay:
+                self.stop_event.wait(delay)
+
+        if not iterator:
+            logger.info('[%(shard)s] Closed and read to the end', {'shard': shard_id})
+            self.checkpoints.put(self.stream_arn, shard_id, SHARD_END)
+
+
+def get_args():
+    """ Get the command line arguments. """
+    parser = ArgumentParser(description='Poll a DynamoDB Stream and publish its records.')
+    parser.add_argument(
+        '--stream-arn',
+        default=STREAM_ARN,
+        required=STREAM_ARN is None,
+        help='ARN of the stream to poll. Default: $STREAM_ARN'
+    )
+    parser.add_argument(
+        '--checkpoint-store',
+        default=CHECKPOINT_STORE,
+        help='Checkpoint store: file:PATH or sqlite:PATH. Default: %(default)r'
+    )
+    parser.add_argument(
+        '--initial-position',
+        choices=['TRIM_HORIZON', 'LATEST'],
+        default=POLL_INITIAL_POSITION,
+        help='Where to start shards without a checkpoint. Default: %(default)r'
+    )
+    return parser.parse_args()
+
+
+def main(args):
+    """ Poll the stream until stopped with SIGTERM or SIGINT. """
+    checkpoints = open_checkpoint_store(args.checkpoint_store)
+    poller = StreamPoller(args.stream_arn, checkpoints, initial_position=args.initial_position)
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(signum, lambda signum, frame: poller.stop())
+
+    try:
+        poller.run()
+    finally:
+        checkpoints.close()
+    return 0
+
+if __name__ == '__main__':
+    logging.basicConfig(
+        level=LOGGING_LEVEL,
+        stream=sys.stderr,
+    )
+    sys.exit(main(get_args()))
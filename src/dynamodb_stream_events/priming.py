@@ -0,0 +1,164 @@
+"""
+Init phase priming. Lambda gives the init phase extra CPU, so the work the
+first invocation would otherwise pay for is done here: the deserializer,
+regexes, JSON encoder, and event builder run on a synthetic record, and
+(optionally) the events client is created and connected.
+
+This also registers SnapStart hooks when the runtime supports them, so that
+connections aren't carried across a snapshot and are re-established after a
+restore.
+"""
+from contextlib import contextmanager
+from functools import partial
+import logging
+import time
+
+from .clients import get_events_clnt, reset_clients
+
+SYNTHETIC_RECORD = dict(
+    eventID='00000000000000000000000000000000',
+    eventName='MODIFY',
+    eventVersion='1.1',
+    eventSource='aws:dynamodb',
+    awsRegion='us-east-2',
+    dynamodb=dict(
+        ApproximateCreationDateTime=1479499740,
+        Keys={
+            'pk': {'S': 'prime'},
+            'sk': {'N': '0'},
+        },
+        OldImage={
+            'pk': {'S': 'prime'},
+            'sk': {'N': '0'},
+            'bool': {'BOOL': True},
+            'null': {'NULL': True},
+            'num': {'N': '1.5'},
+            'bin': {'B': 'AQID'},
+            'nums': {'NS': ['1', '2']},
+            'strs': {'SS': ['a', 'b']},
+            'bins': {'BS': ['AQID']},
+            'list': {'L': [{'S': 'a'}, {'N': '1'}]},
+            'map': {'M': {'a': {'S': 'a'}}},
+        },
+        NewImage={
+            'pk': {'S': 'prime'},
+            'sk': {'N': '0'},
+            'bool': {'BOOL': False},
+            'num': {'N': '2.5'},
+            'bin': {'B': 'AQID'},
+            'nums': {'NS': ['1', '2', '3']},
+            'strs': {'SS': ['a', 'b']},
+            'bins': {'BS': ['AQID']},
+            'list': {'L': [{'S': 'a'}, {'N': '1'}]},
+            'map': {'M': {'a': {'S': 'b'}}},
+            'added': {'S': 'added'},
+        },
+        SequenceNumber='000000000000000000000',
+        SizeBytes=256,
+        StreamViewType='NEW_AND_OLD_IMAGES',
+    ),
+    eventSourceARN='arn:aws:dynamodb:us-east-2:000000000000:table/prime' \
+        '/stream/1970-01-01T00:00:00.000',
+)
+
+logger = logging.getLogger(__name__)
+
+
+@contextmanager
+def _timed(timings, name):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[name] = round((time.perf_counter() - start) * 1000, 3)
+
+
+def _prime_network(timings, event_bus_name):
+    """
+    Create the events client and make a cheap call, so the service model is
+    loaded, the endpoint resolved, and a TLS connection is in the pool.
+    """
+    with _timed(timings, 'client'):
+        events_clnt = get_events_clnt()
+    with _timed(timings, 'connect'):
+        try:
+            events_clnt.describe_event_bus(Name=event_bus_name)
+        except Exception as err: #pylint: disable=broad-exception-caught
+            # Priming must never fail the init; the handler will report any
+            # real problem with the client.
+            logger.warning('Unable to prime the events connection: %(error)s', {
+                'error': err,
+            })
+
+
+def prime(network=True):
+    """
+    Exercise the record pipeline on a synthetic record, and optionally warm up
+    the events client.
+
+    Args:
+        network (bool): also create the events client and connect it.
+
+    Returns:
+        dict: milliseconds each step took.
+    """
+    #pylint: disable=import-outside-toplevel,cyclic-import
+    from . import EVENT_BUS_NAME, make_event
+    from .streams import generate_records
+
+    timings = {}
+    with _timed(timings, 'total'):
+        with _timed(timings, 'records'):
+            records = list(generate_records([SYNTHETIC_RECORD]))
+        with _timed(timings, 'events'):
+            for record in records:
+                make_event(record, EVENT_BUS_NAME)
+        if network:
+            _prime_network(timings, EVENT_BUS_NAME)
+
+    logger.info('Primed in %(total).3fms: %(timings)r', {
+        'total': timings['total'],
+        'timings': timings,
+    })
+    return timings
+
+
+def _before_snapshot():
+    # Drop the clients so no open connections end up in the snapshot. The
+    # service model stays cached by boto3, so recreating the client is cheap.
+    reset_clients()
+    get_events_clnt()
+
+
+def _after_restore(network):
+    reset_clients()
+    if network:
+        #pylint: disable=import-outside-toplevel,cyclic-import
+        from . import EVENT_BUS_NAME
+
+        timings = {}
+        _prime_network(timings, EVENT_BUS_NAME)
+        logger.info('Primed after restore: %(timings)r', {'timings': timings})
+
+
+def register_snapshot_hooks(network=True):
+    """
+    Register the SnapStart before snapshot and after restore hooks, if the
+    runtime provides `snapshot_restore_py`.
+
+    Args:
+        network (bool): reconnect the events client after restore.
+
+    Returns:
+        bool: the hooks were registered.
+    """
+    try:
+        #pylint: disable=import-outside-toplevel
+        from snapshot_restore_py import register_after_restore, register_before_snapshot
+    except ImportError:
+        return False
+
+    register_before_snapshot(_before_snapshot)
+    register_after_restore(partial(_after_restore, network))
+    logger.debug('Registered the snapshot hooks')
+    return True
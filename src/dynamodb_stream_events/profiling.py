@@ -0,0 +1,266 @@
+"""
+Opt-in diagnostics for sizing and tuning the function.
+
+`MemoryProfiler` traces allocations with `tracemalloc` and reports the peak
+allocation of each stage of the pipeline. It wraps the invocation's metrics
+collector: the pipeline already marks the end of every stage with
+`add_time`, so the peak since the previous mark is attributed to that stage.
+The lanes' collectors (see `MemoryProfiler.lane`) mark it too; tracemalloc
+traces the whole process, so with lanes a peak is that of all the lanes.
+
+`profile_call` runs a function under `cProfile` and logs the functions with
+the highest cumulative time.
+"""
+import cProfile
+import logging
+import os
+from os import path
+import pstats
+import time
+import tracemalloc
+
+from threading import Lock
+
+from . import json
+from .metrics import UNIT_BYTES
+
+MEMORY_PROFILE_MIN_RECORDS = int(os.environ['MEMORY_PROFILE_MIN_RECORDS']) \
+    if os.environ.get('MEMORY_PROFILE_MIN_RECORDS') \
+    else 100
+MEMORY_PROFILE_TOP = int(os.environ['MEMORY_PROFILE_TOP']) \
+    if os.environ.get('MEMORY_PROFILE_TOP') \
+    else 10
+PROFILE_TOP = int(os.environ['PROFILE_TOP']) \
+    if os.environ.get('PROFILE_TOP') \
+    else 20
+PROFILE_DUMP_DIR = os.environ['PROFILE_DUMP_DIR'] \
+    if os.environ.get('PROFILE_DUMP_DIR') \
+    else None
+
+logger = logging.getLogger(__name__)
+
+
+class MemoryProfiler:
+    #pylint: disable=too-many-instance-attributes
+    """
+    Metrics collector wrapper that tracks the peak allocation per stage. For
+    batches of at least `min_records` it also keeps a snapshot at the highest
+    allocation seen, and logs its top allocation sites.
+
+    Args:
+        metrics (Metrics): the collector to forward to.
+        record_count (int): records in the batch.
+        min_records (int): batch size to log the top allocation sites.
+        top (int): number of allocation sites to log.
+    """
+
+    def __init__(self, metrics, record_count, min_records=MEMORY_PROFILE_MIN_RECORDS,
+                 top=MEMORY_PROFILE_TOP):
+        #pylint: disable=too-many-arguments
+        self.metrics = metrics
+        self.record_count = record_count
+        self.top = top
+        self.take_snapshots = record_count >= min_records
+        self.peaks = {}
+        self.peak = 0
+        self.snapshot = None
+        self.lock = Lock()
+
+        self._started = not tracemalloc.is_tracing()
+        if self._started:
+            tracemalloc.start()
+        tracemalloc.reset_peak()
+        self._baseline = tracemalloc.get_traced_memory()[0]
+
+    def __bool__(self):
+        return True
+
+    def __getattr__(self, name):
+        # Anything not about stages goes straight to the wrapped collector.
+        return getattr(self.metrics, name)
+
+    def mark(self, stage):
+        """
+        End a stage: record the peak allocation since the last mark (above
+        what was allocated when profiling started).
+        """
+        with self.lock:
+            peak = tracemalloc.get_traced_memory()[1] - self._baseline
+            if peak > self.peaks.get(stage, 0):
+                self.peaks[stage] = peak
+            if peak > self.peak:
+                self.peak = peak
+                if self.take_snapshots:
+                    # What is still allocated at the end of the stage with the
+                    # highest peak; the closest tracemalloc gets to the peak
+                    # itself.
+                    self.snapshot = tracemalloc.take_snapshot()
+            tracemalloc.reset_peak()
+
+    def add_time(self, stage, start):
+        """ Forward the stage time, and record its peak allocation. """
+        self.metrics.add_time(stage, start)
+        self.mark(stage)
+
+    def timer(self, stage):
+        """ Forward the stage timer; the peak is recorded at the next mark. """
+        return _MarkingTimer(self, stage, self.metrics.timer(stage))
+
+    def lane(self):
+        """
+        Make a collector for a lane thread: the wrapped collector's `lane`,
+        with the lane's stages marked on this profiler.
+        """
+        return _LaneProfiler(self, self.metrics.lane())
+
+    def top_sites(self):
+        """
+        Get the top allocation sites of the peak snapshot.
+
+        Returns:
+            List[dict]: file, line, size and count of each site.
+        """
+        if self.snapshot is None:
+            return []
+        stats = self.snapshot.filter_traces([
+            tracemalloc.Filter(False, tracemalloc.__file__),
+        ]).statistics('lineno')
+        return [
+            {
+                'file': stat.traceback[0].filename,
+                'line': stat.traceback[0].lineno,
+                'size': stat.size,
+                'count': stat.count,
+            }
+            for stat in stats[:self.top]
+        ]
+
+    def stop(self):
+        """ Stop tracing (if this started it) and log the results. """
+        if self._started:
+            tracemalloc.stop()
+            self._started = False
+
+        for stage, peak in self.peaks.items():
+            self.metrics.put(f"{stage}PeakBytes", peak, UNIT_BYTES)
+        self.metrics.put('PeakBytes', self.peak, UNIT_BYTES)
+
+        logger.info('Memory profile: %(profile)s', {
+            'profile': json.dumps({
+                'records': self.record_count,
+                'peak': self.peak,
+                'stages': self.peaks,
+                'top': self.top_sites(),
+            }),
+        })
+
+    def emit(self, stream=None):
+        """ Stop profiling and emit the wrapped metrics. """
+        self.stop()
+        self.metrics.emit(stream)
+
+
+class _LaneProfiler:
+    """ A lane's collector, that marks the stages on the shared profiler. """
+
+    def __init__(self, profiler, metrics):
+        self.profiler = profiler
+        self.metrics = metrics
+
+    def __bool__(self):
+        return True
+
+    def __getattr__(self, name):
+        return getattr(self.metrics, name)
+
+    def add_time(self, stage, start):
+        """ Forward the stage time, and record its peak allocation. """
+        self.metrics.add_time(stage, start)
+        self.profiler.mark(stage)
+
+    def timer(self, stage):
+        """ Forward the stage timer; the peak is recorded at the next mark. """
+        return _MarkingTimer(self.profiler, stage, self.metrics.timer(stage))
+
+
+class _MarkingTimer:
+    #pylint: disable=too-few-public-methods
+    def __init__(self, profiler, stage, timer):
+        self.profiler = profiler
+        self.timer = timer
+        self.stage = stage
+
+    def __enter__(self):
+        # Whatever happened since the last mark belongs to the gap before
+        # this stage, not the stage itself.
+        tracemalloc.reset_peak()
+        return self.timer.__enter__()
+
+    def __exit__(self, *exc):
+        result = self.timer.__exit__(*exc)
+        self.profiler.mark(self.stage)
+        return result
+
+
+def profile_stats(stats, top=PROFILE_TOP):
+    """
+    Summarize profile stats.
+
+    Args:
+        stats (pstats.Stats): the profile stats.
+        top (int): number of functions to include.
+
+    Returns:
+        dict: total time in ms, and the `top` functions by cumulative time
+        with their call count, own time and cumulative time in ms.
+    """
+    stats.sort_stats(pstats.SortKey.CUMULATIVE)
+    functions = []
+    for func in stats.fcn_list[:top]:
+        filename, lineno, name = func
+        _, calls, tottime, cumtime, _ = stats.stats[func]
+        functions.append({
+            'function': f"{filename}:{lineno}({name})",
+            'calls': calls,
+            'tottime': round(tottime * 1000, 3),
+            'cumtime': round(cumtime * 1000, 3),
+        })
+    return {
+        'total': round(stats.total_tt * 1000, 3),
+        'top': functions,
+    }
+
+
+def profile_call(func, *args, top=PROFILE_TOP, dump_dir=PROFILE_DUMP_DIR, **kwargs):
+    """
+    Call a function under cProfile, and log the functions with the highest
+    cumulative time as one line. The profile is logged even if the function
+    raises an exception.
+
+    Args:
+        func (Callable): the function to profile.
+        *args: positional arguments for the function.
+        top (int): number of functions to log.
+        dump_dir (str): directory to also write the raw stats to, for
+            `pstats` or snakeviz. Default: don't write them.
+        **kwargs: keyword arguments for the function.
+
+    Returns:
+        obj: the function's result.
+    """
+    profiler = cProfile.Profile()
+    try:
+        return profiler.runcall(func, *args, **kwargs)
+    finally:
+        stats = pstats.Stats(profiler)
+        summary = profile_stats(stats, top=top)
+        if dump_dir:
+            summary['dump'] = path.join(
+                dump_dir,
+                f"{func.__name__}-{time.time_ns()}-{os.getpid()}.prof"
+            )
+            stats.dump_stats(summary['dump'])
+
+        logger.info('CPU profile: %(profile)s', {
+            'profile': json.dumps(summary),
+        })
@@ -0,0 +1,272 @@
+"""
+Splitting events into PutEvents requests that fit the EventBridge limits, and
+putting them with retries. `put_chunk` is the one PutEvents call, through the
+rate limiter, for the handler and the replay; `put_chunk_isolated` bisects a
+call rejected for invalid entries.
+"""
+from collections import namedtuple
+import logging
+import random
+import time
+
+from .clients import CLIENT_EVENTS_MAX_ATTEMPTS, CLIENT_READ_TIMEOUT, error_code
+from .metrics import NULL_METRICS, STAGE_CHUNK, STAGE_PUT_EVENTS, STAGE_RATE_LIMIT
+from .ratelimit import THROTTLE_ERROR_CODES, AdaptiveRateLimiter
+
+# https://docs.aws.amazon.com/eventbridge/latest/userguide/eb-putevent-size.html
+PUT_EVENTS_MAX_ENTRIES = 10
+PUT_EVENTS_MAX_BYTES = 256 * 1024
+PUT_EVENTS_TIME_BYTES = 14
+
+# Error codes of a PutEvents call rejected for invalid entries.
+POISON_ERROR_CODES = frozenset(['ValidationException'])
+# Error code of the entries that weren't put before the deadline.
+DEADLINE_ERROR_CODE = 'DeadlineExceeded'
+# Seconds a PutEvents call can take, with all its attempts. A call isn't
+# started with less than that left before the deadline.
+PUT_EVENTS_CALL_TIME = CLIENT_READ_TIMEOUT * CLIENT_EVENTS_MAX_ATTEMPTS
+
+logger = logging.getLogger(__name__)
+
+FailedEntry = namedtuple(
+    'FailedEntry',
+    field_names=['entry', 'error_code', 'error_message', 'index', 'record_indexes'],
+    defaults=[None, None]
+)
+
+
+def entry_size(entry):
+    """
+    Calculate the size of a PutEvents entry, the way EventBridge does.
+
+    Args:
+        entry (dict): PutEvents entry.
+
+    Returns:
+        int: size in bytes.
+    """
+    size = PUT_EVENTS_TIME_BYTES if entry.get('Time') else 0
+    for k in ('Source', 'DetailType', 'Detail'):
+        if value := entry.get(k):
+            size += len(value.encode('utf-8'))
+    for resource in entry.get('Resources', []):
+        size += len(resource.encode('utf-8'))
+    return size
+
+
+def chunk_entries(entries, max_entries=PUT_EVENTS_MAX_ENTRIES, max_bytes=PUT_EVENTS_MAX_BYTES,
+                  metrics=NULL_METRICS):
+    """
+    Group entries into lists that fit in a single PutEvents request. Order is
+    preserved. An entry bigger than `max_bytes` is put in a list by itself, and
+    EventBridge will reject it. Entries are consumed lazily, one chunk at a
+    time.
+
+    Args:
+        entries (Iterable[dict]): PutEvents entries.
+        max_entries (int): maximum entries per request.
+        max_bytes (int): maximum total entry size per request.
+        metrics (Metrics): collector for the chunk time (not including the
+            time to produce the entries).
+
+    Yields:
+        Tuple[List[dict], int]: the entries for a request, and their size.
+    """
+    chunk = []
+    chunk_size = 0
+    for entry in entries:
+        if metrics:
+            start = time.perf_counter()
+
+        size = entry_size(entry)
+        if chunk and (len(chunk) >= max_entries or chunk_size + size > max_bytes):
+            if metrics:
+                metrics.add_time(STAGE_CHUNK, start)
+            yield chunk, chunk_size
+            if metrics:
+                start = time.perf_counter()
+            chunk = []
+            chunk_size = 0
+
+        chunk.append(entry)
+        chunk_size += size
+        if metrics:
+            metrics.add_time(STAGE_CHUNK, start)
+
+    if chunk:
+        yield chunk, chunk_size
+
+
+def put_chunk(chunk, events_clnt, metrics=NULL_METRICS, limiter=None, throttle_retries=2,
+              deadline=None):
+    #pylint: disable=too-many-arguments,too-many-positional-arguments
+    """
+    Put a chunk of events. With a rate limiter, it waits for its turn, and a
+    call throttled with an exception is retried up to `throttle_retries`
+    times. The limiter is slowed by calls that are throttled, or that have
+    throttled entries.
+
+    Args:
+        chunk (List[dict]): PutEvents entries.
+        events_clnt (obj): EventBridge client.
+        metrics (Metrics): collector for the timings and throttle counts.
+        limiter (AdaptiveRateLimiter): the rate limiter, or None.
+        throttle_retries (int): times to retry a throttled call.
+        deadline (float): `time.monotonic()` the call must end by. It isn't
+            started (or waited for in the limiter) with less than
+            PUT_EVENTS_CALL_TIME left.
+
+    Returns:
+        dict: the PutEvents response, or None if the chunk was deferred
+        because the call might not end before the `deadline`.
+    """
+    start_by = deadline - PUT_EVENTS_CALL_TIME if deadline is not None else None
+    attempt = 0
+    while True:
+        if limiter is not None:
+            with metrics.timer(STAGE_RATE_LIMIT):
+                if limiter.acquire(len(chunk), start_by) is None:
+                    return None
+        if start_by is not None and time.monotonic() > start_by:
+            return None
+        try:
+            with metrics.timer(STAGE_PUT_EVENTS):
+                res = events_clnt.put_events(Entries=chunk)
+            break
+        except Exception as err: #pylint: disable=broad-exception-caught
+            if error_code(err) not in THROTTLE_ERROR_CODES:
+                raise
+            if metrics:
+                metrics.add('Throttles', 1)
+            if limiter is None or attempt >= throttle_retries:
+                raise
+            limiter.throttled()
+            attempt += 1
+
+    throttled = sum(
+        1 for entry in res.get('Entries', [])
+        if entry.get('ErrorCode') in THROTTLE_ERROR_CODES
+    )
+    if throttled:
+        if metrics:
+            metrics.add('Throttles', 1)
+            metrics.add('ThrottledEntries', throttled)
+        if limiter is not None:
+            limiter.throttled()
+    elif limiter is not None:
+        limiter.success()
+    return res
+
+
+def put_chunk_isolated(chunk, events_clnt, metrics=NULL_METRICS, limiter=None,
+                       throttle_retries=2, deadline=None):
+    #pylint: disable=too-many-arguments,too-many-positional-arguments
+    """
+    Put a chunk of events with `put_chunk`. If EventBridge rejects the whole
+    call as invalid (POISON_ERROR_CODES), the chunk is bisected until the
+    invalid entries are isolated, so the rest are still put.
+
+    Args:
+        chunk (List[dict]): PutEvents entries.
+        events_clnt (obj): EventBridge client.
+        metrics (Metrics): collector for the timings and counts.
+        limiter (AdaptiveRateLimiter): the rate limiter, or None.
+        throttle_retries (int): times to retry a throttled call.
+        deadline (float): `time.monotonic()` the calls must end by.
+
+    Returns:
+        dict: the PutEvents response, with an error entry for each invalid
+        event, or None if the chunk was deferred for the `deadline`. The
+        entries of a half deferred while bisecting have the
+        DEADLINE_ERROR_CODE.
+    """
+    try:
+        return put_chunk(chunk, events_clnt, metrics, limiter, throttle_retries, deadline)
+    except Exception as err: #pylint: disable=broad-exception-caught
+        code = error_code(err)
+        if code not in POISON_ERROR_CODES:
+            raise
+        if len(chunk) == 1:
+            return {
+                'FailedEntryCount': 1,
+                'Entries': [{'ErrorCode': code, 'ErrorMessage': str(err)}],
+            }
+
+    if metrics:
+        metrics.add('Bisections', 1)
+    mid = len(chunk) // 2
+    entries = []
+    for half in (chunk[:mid], chunk[mid:]):
+        res = put_chunk_isolated(half, events_clnt, metrics, limiter, throttle_retries, deadline)
+        if res is None:
+            res = {'Entries': [
+                {'ErrorCode': DEADLINE_ERROR_CODE, 'ErrorMessage': 'Not put before the deadline'}
+            ] * len(half)}
+        entries.extend(res.get('Entries', []))
+    return {
+        'FailedEntryCount': sum(1 for entry in entries if entry.get('ErrorCode')),
+        'Entries': entries,
+    }
+
+
+def put_entries(entries, events_clnt, attempts=5, backoff=0.1, max_backoff=5.0, rate=0,
+                metrics=NULL_METRICS):
+    #pylint: disable=too-many-arguments,too-many-positional-arguments,too-many-locals
+    """
+    Put entries in chunks with `put_chunk`, retrying the entries that fail
+    with an exponential (jittered) backoff between the attempts. A request
+    that raises an error fails all of its entries.
+
+    Args:
+        entries (Iterable[dict]): PutEvents entries.
+        events_clnt (obj): EventBridge client.
+        attempts (int): times to try each entry.
+        backoff (float): seconds to wait before the first retry; doubled
+            for each one after.
+        max_backoff (float): longest wait between attempts.
+        rate (float): highest entries put per second, adapted to throttling
+            (see `ratelimit`); 0 is unlimited.
+        metrics (Metrics): collector for the timings and throttle counts.
+
+    Returns:
+        Tuple[int, List[FailedEntry]]: count of entries put, and the entries
+        that still failed after the last attempt.
+    """
+    limiter = AdaptiveRateLimiter(rate) if rate else None
+    pending = entries
+    put_count = 0
+    failed = []
+    for attempt in range(attempts):
+        if attempt:
+            delay = min(max_backoff, backoff * 2 ** (attempt - 1))
+            time.sleep(random.uniform(delay / 2, delay))
+
+        failed = []
+        for chunk, _ in chunk_entries(pending, metrics=metrics):
+            try:
+                res = put_chunk(chunk, events_clnt, metrics, limiter)
+            except Exception as err: #pylint: disable=broad-exception-caught
+                logger.warning('PutEvents failed (attempt %(attempt)d): %(err)s', {
+                    'attempt': attempt + 1,
+                    'err': err,
+                })
+                failed.extend(
+                    FailedEntry(entry, error_code(err) or type(err).__name__, str(err))
+                    for entry in chunk
+                )
+                continue
+
+            for entry, res_entry in zip(chunk, res.get('Entries', [])):
+                if res_entry.get('ErrorCode') or res_entry.get('ErrorMessage'):
+                    failed.append(FailedEntry(
+                        entry,
+                        res_entry.get('ErrorCode', ''),
+                        res_entry.get('ErrorMessage', '')
+                    ))
+                else:
+                    put_count += 1
+
+        if not failed:
+            break
+        pending = [f.entry for f in failed]
+    return put_count, failed
@@ -0,0 +1,139 @@
+"""
+Client side rate limit for the PutEvents calls, so that when EventBridge
+throttles, the function slows down instead of spending its timeout on
+retries that are throttled too.
+
+The limit is a token bucket of entries per second, adjusted AIMD style: it
+is halved (at most once per DECREASE_INTERVAL, since the lanes are throttled
+together) when a call is throttled, and grows by a small step after each call
+that isn't, up to PUT_EVENTS_RATE_LIMIT. One limiter is shared by the lane
+threads, and kept between warm invocations.
+"""
+import logging
+import os
+from threading import Lock
+import time
+
+PUT_EVENTS_RATE_LIMIT = float(os.environ['PUT_EVENTS_RATE_LIMIT']) \
+    if os.environ.get('PUT_EVENTS_RATE_LIMIT') \
+    else 0.0
+PUT_EVENTS_MIN_RATE = float(os.environ['PUT_EVENTS_MIN_RATE']) \
+    if os.environ.get('PUT_EVENTS_MIN_RATE') \
+    else 10.0
+
+THROTTLE_ERROR_CODES = frozenset(['ThrottlingException', 'Throttling', 'TooManyRequestsException'])
+
+DECREASE_FACTOR = 0.5
+DECREASE_INTERVAL = 0.1
+INCREASE_FRACTION = 0.01
+BURST_SECONDS = 0.1
+
+logger = logging.getLogger(__name__)
+
+_limiters = {}
+_limiters_lock = Lock()
+
+
+class AdaptiveRateLimiter:
+    #pylint: disable=too-many-instance-attributes
+    """
+    Token bucket with an AIMD adjusted rate.
+
+    Args:
+        max_rate (float): highest rate, in tokens per second. The limiter
+            starts at it.
+        min_rate (float): lowest rate it is decreased to.
+        increase (float): tokens per second added after each call that isn't
+            throttled. Default: 1% of `max_rate`.
+        decrease (float): factor the rate is multiplied by on a throttle.
+        burst (float): seconds of tokens the bucket holds.
+    """
+
+    def __init__(self, max_rate, min_rate=PUT_EVENTS_MIN_RATE, increase=None,
+                 decrease=DECREASE_FACTOR, burst=BURST_SECONDS):
+        #pylint: disable=too-many-arguments,too-many-positional-arguments
+        self.max_rate = max_rate
+        self.min_rate = min(min_rate, max_rate)
+        self.increase = increase if increase is not None else max_rate * INCREASE_FRACTION
+        self.decrease = decrease
+        self.burst = burst
+        self.lock = Lock()
+        self.rate = max_rate
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.decreased = 0.0
+
+    @property
+    def capacity(self):
+        """ Tokens the bucket holds: `burst` seconds, but at least one call. """
+        return max(10.0, self.rate * self.burst)
+
+    def acquire(self, tokens=1, deadline=None):
+        """
+        Take tokens, waiting until they are available. Waiting callers are
+        served in the order they asked.
+
+        Args:
+            tokens (int): tokens to take; the number of entries.
+            deadline (float): `time.monotonic()` the wait must end by. If it
+                would end after, the tokens aren't taken and it doesn't wait.
+
+        Returns:
+            float: seconds waited, or None if the wait would overrun the
+            `deadline`.
+        """
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= tokens
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0.0
+            if deadline is not None and now + wait > deadline:
+                self.tokens += tokens
+                return None
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+    def success(self):
+        """ A call wasn't throttled: increase the rate a step. """
+        with self.lock:
+            self.rate = min(self.max_rate, self.rate + self.increase)
+
+    def throttled(self):
+        """
+        A call was throttled: decrease the rate, unless it was just decreased.
+
+        Returns:
+            bool: the rate was decreased.
+        """
+        with self.lock:
+            now = time.monotonic()
+            if now - self.decreased < DECREASE_INTERVAL:
+                return False
+            self.decreased = now
+            self.rate = max(self.min_rate, self.rate * self.decrease)
+            rate = self.rate
+        logger.warning('PutEvents throttled; limiting to %(rate).1f entries/s', {'rate': rate})
+        return True
+
+
+def get_rate_limiter():
+    """
+    Get the rate limiter for PutEvents, creating it on first use.
+
+    Returns:
+        AdaptiveRateLimiter: the limiter, or None if PUT_EVENTS_RATE_LIMIT is
+        0.
+    """
+    if not PUT_EVENTS_RATE_LIMIT:
+        return None
+    limiter = _limiters.get(PUT_EVENTS_RATE_LIMIT)
+    if limiter is None:
+        with _limiters_lock:
+            limiter = _limiters.get(PUT_EVENTS_RATE_LIMIT)
+            if limiter is None:
+                limiter = _limiters[PUT_EVENTS_RATE_LIMIT] = AdaptiveRateLimiter(
+                    PUT_EVENTS_RATE_LIMIT
+                )
+    return limiter
@@ -0,0 +1,147 @@
+"""
+Replay the failed events in the spool (see spool.py), after an EventBridge
+outage or a misconfigured bus has been fixed.
+
+The events are put with the same chunking and PutEvents call as the handler
+(`publish.put_chunk`), through a rate limiter that slows down when they are
+throttled, and the ones that fail are retried with backoff. A spool object is
+deleted once its events are put; the events that still fail are spooled
+again, for the next replay.
+
+Run it with `python -m dynamodb_stream_events.replay`.
+"""
+from argparse import ArgumentParser
+import logging
+import sys
+
+from .clients import get_events_clnt
+from .publish import put_entries
+from .spool import FAILED_SPOOL, open_spool
+
+logger = logging.getLogger(__name__)
+
+
+def replay_spool(spool, events_clnt=None, rate=0, attempts=5, prefix='', event_bus_name=None,
+                 keep=False):
+    #pylint: disable=too-many-arguments,too-many-positional-arguments
+    """
+    Put the events in the spool again.
+
+    Args:
+        spool (obj): the spool, from `open_spool`.
+        events_clnt (obj): EventBridge client. Default: the shared client.
+        rate (float): highest events put per second; 0 is unlimited.
+        attempts (int): times to try each event.
+        prefix (str): only replay the spool objects with names starting with
+            this (for example, a `YYYY/MM/DD/` date).
+        event_bus_name (str): put the events to this bus instead of the one
+            they were spooled with.
+        keep (bool): leave the spool objects, instead of deleting them and
+            spooling the events that still fail.
+
+    Returns:
+        dict: counts of the spool objects, events, events put, events that
+        still failed, and objects skipped because they aren't failed events
+        (like the quarantined records); those are left in the spool.
+    """
+    if events_clnt is None:
+        events_clnt = get_events_clnt()
+
+    stats = dict(objects=0, events=0, put=0, failed=0, skipped=0)
+    for name in spool.names():
+        if not name.startswith(prefix):
+            continue
+
+        try:
+            entries = [f.entry for f in spool.read(name)]
+        except ValueError as err:
+            logger.error('Skipping %(name)s: %(err)s', {'name': name, 'err': err})
+            stats['skipped'] += 1
+            continue
+        if event_bus_name:
+            for entry in entries:
+                entry['EventBusName'] = event_bus_name
+        put_count, failed = put_entries(entries, events_clnt, attempts=attempts, rate=rate)
+
+        logger.info('Replayed %(name)s: %(put)d of %(events)d events put', {
+            'name': name,
+            'put': put_count,
+            'events': len(entries),
+        })
+        stats['objects'] += 1
+        stats['events'] += len(entries)
+        stats['put'] += put_count
+        stats['failed'] += len(failed)
+
+        if not keep:
+            if failed:
+                new_name = spool.write(failed)
+                logger.warning('Spooled %(count)d events that failed again: %(name)s', {
+                    'count': len(failed),
+                    'name': new_name,
+                })
+            spool.delete(name)
+    return stats
+
+
+def get_args():
+    """ Get the command line arguments. """
+    parser = ArgumentParser(description='Replay the failed events in the spool.')
+    parser.add_argument(
+        '--spool',
+        default=FAILED_SPOOL,
+        required=FAILED_SPOOL is None,
+        help='Spool: s3://BUCKET/PREFIX, file:DIR, or a directory. Default: $FAILED_SPOOL'
+    )
+    parser.add_argument(
+        '--prefix',
+        default='',
+        help='Only replay spool objects starting with this, like "2024/07/15/".'
+    )
+    parser.add_argument(
+        '--rate',
+        type=float,
+        default=100,
+        help='Highest events put per second; 0 is unlimited. Default: %(default)r'
+    )
+    parser.add_argument(
+        '--attempts',
+        type=int,
+        default=5,
+        help='Times to try each event. Default: %(default)r'
+    )
+    parser.add_argument(
+        '--event-bus-name',
+        help='Put the events to this bus, instead of the one they failed on.'
+    )
+    parser.add_argument(
+        '--keep',
+        action='store_true',
+        help='Leave the spool objects after replaying them.'
+    )
+    return parser.parse_args()
+
+
+def main(args):
+    """ Replay the spool, and report the counts. """
+    stats = replay_spool(
+        open_spool(args.spool),
+        rate=args.rate,
+        attempts=args.attempts,
+        prefix=args.prefix,
+        event_bus_name=args.event_bus_name,
+        keep=args.keep,
+    )
+    logger.info(
+        'Replayed %(objects)d spool objects: %(put)d of %(events)d events put, '
+        '%(failed)d failed; %(skipped)d objects skipped',
+        stats
+    )
+    return 1 if stats['failed'] or stats['skipped'] else 0
+
+if __name__ == '__main__':
+    logging.basicConfig(
+        level=logging.INFO,
+        stream=sys.stderr,
+    )
+    sys.exit(main(get_args()))
@@ -0,0 +1,243 @@
+"""
+Per-table routing, so one function can serve the streams of many tables.
+
+The routes are loaded once, at init, from ROUTING_CONFIG: a JSON object (or
+the path to a JSON file) keyed by table name. Each table can set:
+
+- `eventBusName`: bus to put the events to.
+- `detailTypeFmt`: format() string for the DetailType.
+- `projection`: attribute names to keep in the images. The keys are always
+  kept.
+- `eventNames`: only publish these events (INSERT, MODIFY, REMOVE).
+- `ttl`: how the REMOVE records of TTL expiry are handled (see
+  `split_ttl_removals`): `publish` them like other records, put `keys` only
+  events, put a `summary` event of their counts per batch, or `drop` them.
+- `ttlEventBusName`, `ttlDetailTypeFmt`: bus and DetailType for the TTL
+  removals (and their summaries), so they don't share a bus and rules with
+  the real changes.
+
+A `*` route is used for tables that aren't listed. Anything not set in a
+route uses the function's defaults.
+"""
+from collections import namedtuple
+import json
+import logging
+import os
+
+from .streams import parse_table_arn
+
+ROUTING_CONFIG = os.environ['ROUTING_CONFIG'] \
+    if os.environ.get('ROUTING_CONFIG') \
+    else None
+
+logger = logging.getLogger(__name__)
+
+TTL_PUBLISH = 'publish'
+TTL_KEYS = 'keys'
+TTL_SUMMARY = 'summary'
+TTL_DROP = 'drop'
+TTL_MODES = (TTL_PUBLISH, TTL_KEYS, TTL_SUMMARY, TTL_DROP)
+TTL_PRINCIPAL_ID = 'dynamodb.amazonaws.com'
+
+Route = namedtuple('Route', [
+    'event_bus_name', 'detail_type_fmt', 'projection', 'event_names',
+    'ttl', 'ttl_event_bus_name', 'ttl_detail_type_fmt',
+])
+DEFAULT_ROUTE = Route(None, None, None, None, None, None, None)
+
+_ROUTE_FIELDS = {
+    'eventBusName': 'event_bus_name',
+    'detailTypeFmt': 'detail_type_fmt',
+    'projection': 'projection',
+    'eventNames': 'event_names',
+    'ttl': 'ttl',
+    'ttlEventBusName': 'ttl_event_bus_name',
+    'ttlDetailTypeFmt': 'ttl_detail_type_fmt',
+}
+
+
+def load_routes(config):
+    """
+    Build the routing index from the config.
+
+    Args:
+        config (str|dict): JSON object, path to a JSON file, or the parsed
+            config.
+
+    Returns:
+        Dict[str, Route]: the route for each table name.
+
+    Raises:
+        ValueError: the config has an unknown setting, or `ttl` mode.
+    """
+    if not config:
+        return {}
+    if isinstance(config, str):
+        if config.lstrip().startswith('{'):
+            config = json.loads(config)
+        else:
+            with open(config, 'r', encoding='utf-8') as config_file:
+                config = json.load(config_file)
+
+    routes = {}
+    for table_name, table_config in config.items():
+        unknown = set(table_config) - set(_ROUTE_FIELDS)
+        if unknown:
+            raise ValueError(
+                f"Unknown routing settings for {table_name}: {', '.join(sorted(unknown))}"
+            )
+
+        fields = {_ROUTE_FIELDS[k]: v for k, v in table_config.items() if v is not None}
+        for k in ('projection', 'event_names'):
+            if k in fields:
+                fields[k] = frozenset(fields[k])
+        if 'ttl_event_bus_name' in fields or 'ttl_detail_type_fmt' in fields:
+            fields.setdefault('ttl', TTL_PUBLISH)
+        if fields.get('ttl', TTL_PUBLISH) not in TTL_MODES:
+            raise ValueError(f"Unknown ttl mode for {table_name}: {fields['ttl']}")
+        routes[table_name] = DEFAULT_ROUTE._replace(**fields)
+    logger.debug('Loaded routes for %(count)d tables', {'count': len(routes)})
+    return routes
+
+
+ROUTES = load_routes(ROUTING_CONFIG)
+
+
+def get_route(table_name):
+    """
+    Get the route for a table.
+
+    Args:
+        table_name (str): name of the table, or None if it isn't known.
+
+    Returns:
+        Route: the table's route, the `*` route, or DEFAULT_ROUTE.
+    """
+    route = ROUTES.get(table_name)
+    if route is None:
+        route = ROUTES.get('*', DEFAULT_ROUTE)
+    return route
+
+
+def filter_records(records):
+    """
+    Drop the records whose eventName isn't in the `eventNames` of their route.
+
+    Args:
+        records (List[dict]): stream event records.
+
+    Returns:
+        List[dict]: the records to publish. `records` itself, if none were
+        dropped.
+    """
+    if not ROUTES:
+        return records
+
+    kept = []
+    for record in records:
+        parsed = parse_table_arn(record['eventSourceARN']) if 'eventSourceARN' in record else None
+        route = get_route(parsed[1] if parsed else None)
+        if route.event_names is None or record.get('eventName') in route.event_names:
+            kept.append(record)
+    return kept if len(kept) < len(records) else records
+
+
+def is_ttl_removal(record):
+    """
+    Check if a stream record is the removal of an item by TTL expiry. Only
+    the record's metadata is looked at, so it is cheap enough to do before
+    deserializing.
+
+    Args:
+        record (dict): stream event record, or one from `generate_records`.
+
+    Returns:
+        bool: it is a TTL removal.
+    """
+    return record.get('eventName') == 'REMOVE' \
+        and record.get('userIdentity', {}).get('principalId') == TTL_PRINCIPAL_ID
+
+
+def split_ttl_removals(records):
+    """
+    Handle the TTL removals of the tables whose route has a `ttl` mode,
+    before the records are deserialized. In `keys` mode the images are
+    removed from the record, `summary` mode counts them by table instead of
+    publishing them, and `drop` mode drops them.
+
+    Args:
+        records (List[dict]): stream event records.
+
+    Returns:
+        Tuple[List[dict], Dict[str, dict], int]: the records to publish
+        (`records` itself, if none were changed); the summary of the TTL
+        removals of each table in `summary` mode, with its `TableName`,
+        `tableARN`, `Count`, the first and last `SequenceNumber` and
+        `ApproximateCreationDateTime`, and the `sequenceNumbers` of the
+        removals; and the count of TTL removals that weren't published as
+        they are.
+    """
+    #pylint: disable=too-many-branches
+    if not any(route.ttl not in (None, TTL_PUBLISH) for route in ROUTES.values()):
+        return records, {}, 0
+
+    kept = []
+    summaries = {}
+    count = 0
+    for record in records:
+        if not is_ttl_removal(record):
+            kept.append(record)
+            continue
+        parsed = parse_table_arn(record['eventSourceARN']) if 'eventSourceARN' in record else None
+        route = get_route(parsed[1] if parsed else None)
+        if route.ttl in (None, TTL_PUBLISH):
+            kept.append(record)
+            continue
+
+        count += 1
+        if route.ttl == TTL_KEYS:
+            kept.append(dict(record, dynamodb={
+                k: v
+                for k, v in record['dynamodb'].items()
+                if k not in ('NewImage', 'OldImage')
+            }))
+        elif route.ttl == TTL_SUMMARY:
+            record_dynamodb = record['dynamodb']
+            table_name = parsed[1] if parsed else None
+            summary = summaries.get(table_name)
+            if summary is None:
+                summary = summaries[table_name] = {
+                    'TableName': table_name,
+                    'tableARN': parsed[0] if parsed else None,
+                    'Count': 0,
+                    'FirstSequenceNumber': record_dynamodb.get('SequenceNumber'),
+                    'FirstApproximateCreationDateTime': \
+                        record_dynamodb.get('ApproximateCreationDateTime'),
+                    'sequenceNumbers': [],
+                }
+            summary['Count'] += 1
+            summary['sequenceNumbers'].append(record_dynamodb.get('SequenceNumber'))
+            summary['LastSequenceNumber'] = record_dynamodb.get('SequenceNumber')
+            summary['LastApproximateCreationDateTime'] = \
+                record_dynamodb.get('ApproximateCreationDateTime')
+    return (kept if count else records), summaries, count
+
+
+def project(record_dynamodb, projection):
+    """
+    Keep only the projected attributes in the images of a record from
+    `generate_records`. The record is changed in place.
+
+    Args:
+        record_dynamodb (dict): the `dynamodb` of the record.
+        projection (Container[str]): attribute names to keep.
+    """
+    for k in ('NewImage', 'OldImage', 'HasChanged'):
+        if isinstance(record_dynamodb.get(k), dict):
+            record_dynamodb[k] = {
+                name: value
+                for name, value in record_dynamodb[k].items()
+                if name in projection
+            }
+    if 'ChangedFields' in record_dynamodb:
+        record_dynamodb['ChangedFields'] = record_dynamodb['ChangedFields'] & projection
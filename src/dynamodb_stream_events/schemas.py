@@ -0,0 +1,236 @@
+"""
+Decoders specialized for the usual shape of each table's items.
+
+The generic `TypeDeserializer` dispatches on the type of every attribute of
+every image. Most tables store items with the same attributes, of the same
+types, so once SCHEMA_MIN_RECORDS images of a table have been seen, its most
+common shape (the attribute names and their types, whatever their order) is
+inferred and a decoder is generated for it, in the shape's most common order:
+a single dict expression that reads each attribute's value straight from its
+type. If no shape is common enough, the images are observed again, up to
+MAX_OBSERVATIONS times.
+
+An image that doesn't have the shape (other attributes, another order, or a
+value of another type) is decoded with the generic deserializer, so the
+results are always the same. If most images stop having the shape, it is
+inferred again.
+"""
+from base64 import b64decode
+from collections import Counter
+import logging
+import os
+from threading import Lock
+
+from .types import DYNAMODB_CONTEXT, Binary, TypeDeserializer
+
+SCHEMA_DECODERS = os.environ['SCHEMA_DECODERS'].lower() in ('1', 'true', 'yes') \
+    if os.environ.get('SCHEMA_DECODERS') \
+    else False
+SCHEMA_MIN_RECORDS = int(os.environ['SCHEMA_MIN_RECORDS']) \
+    if os.environ.get('SCHEMA_MIN_RECORDS') \
+    else 100
+
+# The most common shape has to be at least this fraction of the images seen
+# for a decoder to be worth it; the images that don't fit cost a bit more.
+MIN_SHAPE_FRACTION = 0.5
+# Times SCHEMA_MIN_RECORDS images are observed without finding a common shape
+# before the table is decoded with the generic deserializer for good.
+MAX_OBSERVATIONS = 3
+
+logger = logging.getLogger(__name__)
+
+_decoders = {}
+_decoders_lock = Lock()
+
+
+def _binary(value):
+    if isinstance(value, str):
+        value = b64decode(value)
+    return Binary(value)
+
+def _null(value):
+    #pylint: disable=unused-argument
+    return None
+
+# Expression for the value of each type, with `{v}` the attribute's typed
+# value. Lists and maps use the generic deserializer.
+_TYPE_EXPRS = {
+    'S': "{v}['S']",
+    'N': "_number({v}['N'])",
+    'BOOL': "{v}['BOOL']",
+    'NULL': "_null({v}['NULL'])",
+    'B': "_binary({v}['B'])",
+    'SS': "set({v}['SS'])",
+    'NS': "set(map(_number, {v}['NS']))",
+    'BS': "set(map(_binary, {v}['BS']))",
+}
+
+
+def image_shape(image):
+    """
+    Get the shape of an image.
+
+    Args:
+        image (dict): DynamoDB typed attributes.
+
+    Returns:
+        tuple: the name and type of each attribute, in order.
+    """
+    return tuple((name, next(iter(value), None)) for name, value in image.items())
+
+
+def generate_decoder(shape, deser):
+    """
+    Generate the decoder for an image shape.
+
+    Args:
+        shape (tuple): the shape, from `image_shape`.
+        deser (TypeDeserializer): used for the lists and maps.
+
+    Returns:
+        Callable[[dict], dict]: decodes an image of the shape. It raises
+        `KeyError` if a value isn't of the shape's type.
+    """
+    lines = ['def decode(image):', '    return {']
+    for name, dynamodb_type in shape:
+        value = f"image[{name!r}]"
+        expr = _TYPE_EXPRS[dynamodb_type].format(v=value) if dynamodb_type in _TYPE_EXPRS \
+            else f"_deserialize({value})"
+        lines.append(f"        {name!r}: {expr},")
+    lines.append('    }')
+
+    namespace = {
+        '_number': DYNAMODB_CONTEXT.create_decimal,
+        '_binary': _binary,
+        '_null': _null,
+        '_deserialize': deser.deserialize,
+    }
+    exec(compile('\n'.join(lines), '<schema decoder>', 'exec'), namespace) #pylint: disable=exec-used
+    return namespace['decode']
+
+
+class SchemaDecoder:
+    #pylint: disable=too-many-instance-attributes,too-few-public-methods
+    """
+    Decodes the images of a table, with a generated decoder for its inferred
+    shape once there is one.
+
+    Args:
+        deser (TypeDeserializer): the generic deserializer.
+        min_records (int): images to see before inferring the shape.
+    """
+
+    def __init__(self, deser=None, min_records=SCHEMA_MIN_RECORDS):
+        self.deser = deser if deser is not None else TypeDeserializer()
+        self.min_records = min_records
+        self.lock = Lock()
+        self.shapes = Counter()
+        self.orders = {}
+        self.observations = 0
+        self.names = None
+        self.decoder = None
+        self.hits = 0
+        self.misses = 0
+
+    def decode(self, image):
+        """
+        Decode an image.
+
+        Args:
+            image (dict): DynamoDB typed attributes.
+
+        Returns:
+            dict: the python values.
+        """
+        decoder, names = self.decoder, self.names
+        if decoder is not None:
+            if tuple(image) == names:
+                try:
+                    result = decoder(image)
+                    self.hits += 1
+                    return result
+                except (KeyError, TypeError):
+                    pass
+            self.misses += 1
+            if self.misses >= self.min_records and self.misses > self.hits:
+                self._reset()
+        elif names is None:
+            self._observe(image)
+        return self.deser.deserialize({'M': image})
+
+    def _observe(self, image):
+        """
+        Count the image's shape, and infer the shape when there are enough.
+        The shapes are counted by their sorted attributes, so images that
+        only differ in order count as one.
+        """
+        with self.lock:
+            if self.names is not None:
+                return
+            shape = image_shape(image)
+            key = tuple(sorted(shape))
+            self.shapes[key] += 1
+            self.orders.setdefault(key, Counter())[shape] += 1
+            seen = sum(self.shapes.values())
+            if seen < self.min_records:
+                return
+
+            key, count = self.shapes.most_common(1)[0]
+            shape = self.orders[key].most_common(1)[0][0]
+            self.shapes = Counter()
+            self.orders = {}
+            self.observations += 1
+            if count < seen * MIN_SHAPE_FRACTION:
+                logger.debug('No common shape in %(seen)d images (%(count)d/%(max)d)', {
+                    'seen': seen,
+                    'count': self.observations,
+                    'max': MAX_OBSERVATIONS,
+                })
+                if self.observations >= MAX_OBSERVATIONS:
+                    # Stop observing; without a decoder, all the images are
+                    # decoded with the generic deserializer.
+                    self.names = tuple(name for name, _ in shape)
+                return
+            self.names = tuple(name for name, _ in shape)
+            self.decoder = generate_decoder(shape, self.deser)
+            self.observations = 0
+            logger.debug('Generated a decoder for %(count)d attributes', {'count': len(shape)})
+
+    def _reset(self):
+        """ Most images no longer have the shape: infer it again. """
+        with self.lock:
+            logger.debug('Images no longer fit the shape (%(hits)d/%(misses)d)', {
+                'hits': self.hits,
+                'misses': self.misses,
+            })
+            self.names = None
+            self.decoder = None
+            self.observations = 0
+            self.hits = 0
+            self.misses = 0
+
+
+def get_schema_decoder(table_name, kind):
+    """
+    Get the decoder for a table's images, creating it on first use. They are
+    kept between invocations.
+
+    Args:
+        table_name (str): name of the table.
+        kind (str): `Keys` or `Image`; the keys have their own shape, and the
+            new and old images share one.
+
+    Returns:
+        SchemaDecoder: the decoder, or None if SCHEMA_DECODERS is off or the
+        table isn't known.
+    """
+    if not SCHEMA_DECODERS or table_name is None:
+        return None
+    key = (table_name, kind)
+    decoder = _decoders.get(key)
+    if decoder is None:
+        with _decoders_lock:
+            decoder = _decoders.get(key)
+            if decoder is None:
+                decoder = _decoders[key] = SchemaDecoder()
+    return decoder
@@ -0,0 +1,426 @@
+"""
+Spool of the events that EventBridge didn't accept, so they can be replayed
+in bulk (see replay.py) instead of being recovered from the logs.
+
+Each batch's failed events are written as one gzipped JSONL object, a line
+per event: `{"Entry": ..., "ErrorCode": ..., "ErrorMessage": ...}`. The
+records that couldn't be made into events are quarantined the same way in
+their own spool, as `{"Record": ..., "ErrorCode": ..., "ErrorMessage": ...}`.
+The spools are opened from FAILED_SPOOL and QUARANTINE_SPOOL with
+`open_spool`:
+
+- `s3://BUCKET/PREFIX`: objects in S3. Set `AWS_ENDPOINT_URL_S3` to use
+  another S3 compatible store.
+- `file:DIR` (or just `DIR`): files in a local directory.
+"""
+import abc
+from datetime import datetime, timezone
+import gzip
+import logging
+import os
+from os import path
+from threading import Lock
+import time
+import uuid
+
+from . import json
+from .clients import get_s3_clnt
+from .publish import FailedEntry
+
+FAILED_SPOOL = os.environ['FAILED_SPOOL'] \
+    if os.environ.get('FAILED_SPOOL') \
+    else None
+QUARANTINE_SPOOL = os.environ['QUARANTINE_SPOOL'] \
+    if os.environ.get('QUARANTINE_SPOOL') \
+    else None
+
+SPOOL_SUFFIX = '.jsonl.gz'
+
+logger = logging.getLogger(__name__)
+
+_spools = {}
+_spools_lock = Lock()
+
+
+def _spool_name():
+    """ A unique name for a spool object, that sorts by time. """
+    now = datetime.now(timezone.utc)
+    return f"{now:%Y/%m/%d}/{time.time_ns()}-{uuid.uuid4().hex}{SPOOL_SUFFIX}"
+
+
+def encode_items(items):
+    """
+    Encode items as gzipped JSONL.
+
+    Args:
+        items (Iterable[dict]): the items.
+
+    Returns:
+        bytes: the spool object.
+    """
+    lines = [json.dumps(item) for item in items]
+    return gzip.compress(('\n'.join(lines) + '\n').encode('utf-8'), mtime=0)
+
+
+def decode_items(data):
+    """
+    Decode a spool object.
+
+    Args:
+        data (bytes): gzipped JSONL.
+
+    Returns:
+        List[dict]: the items.
+    """
+    return [
+        json.loads(line)
+        for line in gzip.decompress(data).decode('utf-8').splitlines()
+        if line.strip()
+    ]
+
+
+def encode_failed(failed):
+    """
+    Encode failed entries as gzipped JSONL.
+
+    Args:
+        failed (List[FailedEntry]): the entries.
+
+    Returns:
+        bytes: the spool object.
+    """
+    return encode_items(
+        {'Entry': f.entry, 'ErrorCode': f.error_code, 'ErrorMessage': f.error_message}
+        for f in failed
+    )
+
+
+def decode_failed(data):
+    """
+    Decode a spool object of failed entries.
+
+    Args:
+        data (bytes): gzipped JSONL.
+
+    Returns:
+        List[FailedEntry]: the entries, with their `Time` as a datetime.
+
+    Raises:
+        ValueError: an item has no event, like the quarantined records.
+    """
+    failed = []
+    for line, item in enumerate(decode_items(data), start=1):
+        entry = item.get('Entry')
+        if not entry:
+            raise ValueError(
+                f"Line {line} has no event to replay (ErrorCode {item.get('ErrorCode')}); "
+                "quarantined records can't be replayed"
+            )
+        if entry.get('Time'):
+            entry['Time'] = datetime.fromisoformat(entry['Time'])
+        failed.append(FailedEntry(entry, item.get('ErrorCode'), item.get('ErrorMessage')))
+    return failed
+
+
+class _Spool(abc.ABC):
+    """ Reading and writing failed entries, for the spool classes. """
+
+    # Only the objects with names ending with this are listed.
+    suffix = SPOOL_SUFFIX
+
+    @abc.abstractmethod
+    def write_data(self, data):
+        """ Write a spool object, and return its name. """
+
+    @abc.abstractmethod
+    def read_data(self, name):
+        """ Read a spool object. """
+
+    def write(self, failed):
+        """
+        Write the failed entries.
+
+        Args:
+            failed (List[FailedEntry]): the entries.
+
+        Returns:
+            str: name of the spool object.
+        """
+        return self.write_data(encode_failed(failed))
+
+    def write_items(self, items):
+        """
+        Write other items, like quarantined records.
+
+        Args:
+            items (List[dict]): the items.
+
+        Returns:
+            str: name of the spool object.
+        """
+        return self.write_data(encode_items(items))
+
+    def read(self, name):
+        """
+        Read the failed entries of a spool object.
+
+        Raises:
+            ValueError: it has items without an event, like a quarantine
+                spool object.
+        """
+        return decode_failed(self.read_data(name))
+
+
+class LocalSpool(_Spool):
+    """
+    Spool objects as files in a directory.
+
+    Args:
+        directory (str): the directory; created if it doesn't exist.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def write_data(self, data):
+        """
+        Write a spool object.
+
+        Args:
+            data (bytes): the object.
+
+        Returns:
+            str: name of the spool object.
+        """
+        name = _spool_name()
+        file_path = path.join(self.directory, name)
+        os.makedirs(path.dirname(file_path), exist_ok=True)
+
+        tmp_path = f"{file_path}.tmp"
+        with open(tmp_path, 'wb') as file_p:
+            file_p.write(data)
+        os.replace(tmp_path, file_path)
+        return name
+
+    def names(self):
+        """
+        List the spool objects, oldest first.
+
+        Returns:
+            List[str]: the names.
+        """
+        names = []
+        for dir_path, _, file_names in os.walk(self.directory):
+            names.extend(
+                path.relpath(path.join(dir_path, file_name), self.directory)
+                for file_name in file_names
+                if file_name.endswith(self.suffix)
+            )
+        return sorted(names)
+
+    def read_data(self, name):
+        """ Read a spool object. """
+        with open(path.join(self.directory, name), 'rb') as file_p:
+            return file_p.read()
+
+    def delete(self, name):
+        """ Delete a spool object. """
+        os.remove(path.join(self.directory, name))
+
+
+class S3Spool(_Spool):
+    """
+    Spool objects in an S3 bucket.
+
+    Args:
+        bucket (str): name of the bucket.
+        prefix (str): prefix of the object keys.
+        s3_clnt (obj): S3 client. Default: the shared client.
+    """
+
+    def __init__(self, bucket, prefix='', s3_clnt=None):
+        self.bucket = bucket
+        self.prefix = prefix
+        self.s3_clnt = s3_clnt
+
+    def _clnt(self):
+        if self.s3_clnt is None:
+            self.s3_clnt = get_s3_clnt()
+        return self.s3_clnt
+
+    def write_data(self, data):
+        """
+        Write a spool object.
+
+        Args:
+            data (bytes): the object.
+
+        Returns:
+            str: name of the spool object.
+        """
+        name = _spool_name()
+        self._clnt().put_object(
+            Bucket=self.bucket,
+            Key=f"{self.prefix}{name}",
+            Body=data,
+            ContentType='application/x-ndjson',
+            ContentEncoding='gzip',
+        )
+        return name
+
+    def names(self):
+        """
+        List the spool objects, oldest first.
+
+        Returns:
+            List[str]: the names.
+        """
+        names = []
+        paginator = self._clnt().get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=self.prefix):
+            names.extend(
+                obj['Key'][len(self.prefix):]
+                for obj in page.get('Contents', [])
+                if obj['Key'].endswith(self.suffix)
+            )
+        return sorted(names)
+
+    def read_data(self, name):
+        """ Read a spool object. """
+        res = self._clnt().get_object(Bucket=self.bucket, Key=f"{self.prefix}{name}")
+        return res['Body'].read()
+
+    def delete(self, name):
+        """ Delete a spool object. """
+        self._clnt().delete_object(Bucket=self.bucket, Key=f"{self.prefix}{name}")
+
+
+def open_spool(url):
+    """
+    Open a spool.
+
+    Args:
+        url (str): `s3://BUCKET/PREFIX`, `file:DIR`, or a directory.
+
+    Returns:
+        obj: the spool.
+    """
+    if url.startswith('s3://'):
+        bucket, _, prefix = url[len('s3://'):].partition('/')
+        if prefix and not prefix.endswith('/'):
+            prefix += '/'
+        logger.debug('Using the S3 spool: s3://%(bucket)s/%(prefix)s', {
+            'bucket': bucket,
+            'prefix': prefix,
+        })
+        return S3Spool(bucket, prefix)
+
+    if url.startswith('file:'):
+        url = url[len('file:'):]
+    logger.debug('Using the local spool: %(path)s', {'path': url})
+    return LocalSpool(url)
+
+
+def get_spool(url=None):
+    """
+    Get a spool, opening it on first use.
+
+    Args:
+        url (str): the spool. Default: FAILED_SPOOL.
+
+    Returns:
+        obj: the spool, or None if there isn't one.
+    """
+    if url is None:
+        url = FAILED_SPOOL
+    if not url:
+        return None
+    spool = _spools.get(url)
+    if spool is None:
+        with _spools_lock:
+            spool = _spools.get(url)
+            if spool is None:
+                spool = _spools[url] = open_spool(url)
+    return spool
+
+
+def get_quarantine_spool():
+    """
+    Get the spool for records that couldn't be made into events.
+
+    Returns:
+        obj: the spool, or None if QUARANTINE_SPOOL isn't set.
+    """
+    return get_spool(QUARANTINE_SPOOL or '')
+
+
+def quarantine_failed(records, poison, metrics):
+    """
+    Write the poison records, with their event and error, to the
+    QUARANTINE_SPOOL, if there is one. The records of an envelope are each
+    written with it.
+
+    Args:
+        records (List[dict]): stream event records.
+        poison (List[FailedEntry]): the poison records' entries.
+        metrics (Metrics): collector for the count quarantined.
+
+    Returns:
+        int: the number of records quarantined.
+    """
+    spool = get_quarantine_spool()
+    if spool is None:
+        return 0
+    items = [
+        {
+            'Record': records[idx],
+            'Entry': f.entry,
+            'ErrorCode': f.error_code,
+            'ErrorMessage': f.error_message,
+        }
+        for f in poison
+        for idx in (f.record_indexes or (f.index,))
+    ]
+    try:
+        name = spool.write_items(items)
+    except Exception: #pylint: disable=broad-exception-caught
+        logger.exception('Unable to quarantine %(count)d records', {'count': len(items)})
+        return 0
+
+    logger.info('Quarantined %(count)d records: %(name)s', {
+        'count': len(items),
+        'name': name,
+    })
+    if metrics:
+        metrics.add('RecordsQuarantined', len(items))
+    return len(items)
+
+
+def spool_failed(failed, metrics):
+    """
+    Write the failed entries to the FAILED_SPOOL, if there is one, so they can
+    be replayed (see replay.py).
+
+    Args:
+        failed (List[FailedEntry]): the entries that failed.
+        metrics (Metrics): collector for the count spooled.
+
+    Returns:
+        int: the number of entries spooled.
+    """
+    spool = get_spool()
+    if spool is None:
+        return 0
+    try:
+        name = spool.write(failed)
+    except Exception: #pylint: disable=broad-exception-caught
+        logger.exception('Unable to spool %(count)d failed events', {'count': len(failed)})
+        return 0
+
+    logger.info('Spooled %(count)d failed events: %(name)s', {
+        'count': len(failed),
+        'name': name,
+    })
+    if metrics:
+        metrics.add('EventsSpooled', len(failed))
+    return len(failed)
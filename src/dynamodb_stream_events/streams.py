@@ -3,10 +3,15 @@ Functions to handle converting DynamoDB Streams records to python datatypes.
 """
 from collections.abc import Mapping
 from datetime import datetime, timezone
+from functools import lru_cache
 import logging
 import re
+import time
 
-from boto3.dynamodb.types import TypeDeserializer
+from .logs import debug_records
+from .metrics import NULL_METRICS, STAGE_DESERIALIZE, STAGE_DIFF, UNIT_MILLISECONDS
+from .schemas import get_schema_decoder
+from .types import TypeDeserializer
 
 TABLE_ARN_REGEX = re.compile(r'''^
     (?P<tableARN>
@@ -29,46 +34,113 @@ $''', re.VERBOSE)
 logger = logging.getLogger(__name__)
 
 
-def generate_records(records):
-    #pylint: disable=too-many-locals,too-many-branches
+@lru_cache(maxsize=256)
+def parse_table_arn(arn):
+    """
+    Parse the table ARN and name from a stream (or table) ARN. The records of
+    a batch all come from the same stream, so the results are cached.
+
+    Args:
+        arn (str): the `eventSourceARN` of a record.
+
+    Returns:
+        Tuple[str, str]: the table ARN and name, or None if `arn` isn't a
+        DynamoDB table ARN.
+    """
+    if match := TABLE_ARN_REGEX.match(arn):
+        return match.group('tableARN'), match.group('table')
+    return None
+
+
+def sequence_number_gap(records):
+    """
+    Get the difference between the first and last sequence numbers of a batch.
+
+    Args:
+        records (List[dict]): stream event records.
+
+    Returns:
+        int: the gap, or None if no record has a sequence number.
+    """
+    seqs = (r['dynamodb']['SequenceNumber'] for r in records if 'SequenceNumber' in r['dynamodb'])
+    first = next(seqs, None)
+    if first is None:
+        return None
+    last = next(
+        r['dynamodb']['SequenceNumber']
+        for r in reversed(records)
+        if 'SequenceNumber' in r['dynamodb']
+    )
+    return int(last) - int(first)
+
+
+def generate_records(records, metrics=NULL_METRICS, log_records=None, indexes=None,
+                     batch_metrics=True):
+    #pylint: disable=too-many-locals,too-many-branches,too-many-statements
     """
     Generator that yields a python dict from a  list of stream event records.
 
     Args:
         records (List[dict]): List of stream event records.
+        metrics (Metrics): collector for the deserialize and diff times, the
+            stream lag (`now - ApproximateCreationDateTime`), and the
+            sequence number gap between the first and last record.
+        log_records (Container[int]): indexes of the records to write debug
+            logs for. Default: sampled with `logs.debug_records`.
+        indexes (List[int]): index of each record in the whole batch, when
+            `records` is part of one. Used for `log_records` and logging.
+        batch_metrics (bool): put the sequence number gap. False when
+            `records` is the rest of a batch whose gap was already put.
 
     Yields:
         dict: More python native dict of the record, with types translated.
         Also adds `tableARN` and `dynamodb.ChangedFields`.
     """
     deser = TypeDeserializer()
+    if log_records is None:
+        log_records = debug_records(logger, len(records))
+    if metrics:
+        now = time.time()
+        gap = sequence_number_gap(records) if batch_metrics else None
+        if gap is not None:
+            metrics.put('SequenceNumberGap', gap)
 
     for record_idx, _record in enumerate(records):
+        if metrics:
+            start = time.perf_counter()
+        if indexes is not None:
+            record_idx = indexes[record_idx]
+        debug = record_idx in log_records
+
         record = _record.copy()
         record_dynamodb = record['dynamodb'] = record['dynamodb'].copy()
 
+        if metrics:
+            if 'ApproximateCreationDateTime' in record_dynamodb:
+                metrics.observe(
+                    'StreamLag',
+                    (now - record_dynamodb['ApproximateCreationDateTime']) * 1000,
+                    UNIT_MILLISECONDS
+                )
+
         if 'ApproximateCreationDateTime' in record_dynamodb:
             record_dynamodb['ApproximateCreationDateTime'] = datetime.fromtimestamp(
                 record_dynamodb['ApproximateCreationDateTime'],
                 timezone.utc
             )
-        for k in ('Keys', 'NewImage', 'OldImage'):
-            if k in record_dynamodb:
-                record_dynamodb[k] = deser.deserialize(dict(M=record_dynamodb[k]))
-
         if 'eventSourceARN' in record:
-            if match := TABLE_ARN_REGEX.match(record['eventSourceARN']):
-                record['tableARN'] = match.group('tableARN')
-                record_dynamodb['TableName'] = match.group('table')
-                logger.debug(
-                    '[Record #%(idx)d] parsed tableARN = %(arn)s; ' \
-                    'dynamodb.TableName = %(table)s',
-                    {
-                        'idx': record_idx,
-                        'arn': record['tableARN'],
-                        'table': record_dynamodb['TableName'],
-                    }
-                )
+            if parsed := parse_table_arn(record['eventSourceARN']):
+                record['tableARN'], record_dynamodb['TableName'] = parsed
+                if debug:
+                    logger.debug(
+                        '[Record #%(idx)d] parsed tableARN = %(arn)s; ' \
+                        'dynamodb.TableName = %(table)s',
+                        {
+                            'idx': record_idx,
+                            'arn': record['tableARN'],
+                            'table': record_dynamodb['TableName'],
+                        }
+                    )
             else:
                 logger.warning(
                     '[Record #%(idx)d] Unable to parse eventSourceARN: %(arn)s',
@@ -78,40 +150,60 @@ def generate_records(records):
                     }
                 )
 
+        table_name = record_dynamodb.get('TableName')
+        for k in ('Keys', 'NewImage', 'OldImage'):
+            if k in record_dynamodb:
+                decoder = get_schema_decoder(table_name, 'Keys' if k == 'Keys' else 'Image')
+                if decoder is not None:
+                    record_dynamodb[k] = decoder.decode(record_dynamodb[k])
+                else:
+                    record_dynamodb[k] = deser.deserialize(dict(M=record_dynamodb[k]))
+
+        if metrics:
+            metrics.add_time(STAGE_DESERIALIZE, start)
+            start = time.perf_counter()
+
         new_image = record_dynamodb.get('NewImage')
         old_image = record_dynamodb.get('OldImage')
         if (new_image is None or isinstance(new_image, Mapping)) \
                 and (old_image is None or isinstance(old_image, Mapping)):
-            new_image_keys = set(new_image.keys()) if new_image else set()
-            old_image_keys = set(old_image.keys()) if old_image else set()
+            # The fields are handled in image order, not set order, so that
+            # HasChanged (and the event detail) is the same in any process.
+            new_image = new_image or {}
+            old_image = old_image or {}
 
             changed_fields = set()
             has_changed = {}
 
-            add_fields = new_image_keys - old_image_keys
+            add_fields = [k for k in new_image if k not in old_image]
             if add_fields:
-                logger.debug('[Record #%(idx)d] Added fields: %(names)s', {
-                    'idx': record_idx,
-                    'names': '; '.join(add_fields)
-                })
+                if debug:
+                    logger.debug('[Record #%(idx)d] Added fields: %(names)s', {
+                        'idx': record_idx,
+                        'names': '; '.join(add_fields)
+                    })
                 changed_fields.update(add_fields)
                 has_changed.update({k: True for k in add_fields})
 
-            rem_fields = old_image_keys - new_image_keys
+            rem_fields = [k for k in old_image if k not in new_image]
             if rem_fields:
-                logger.debug('[Record #%(idx)d] Added fields: %(names)s', {
-                    'idx': record_idx,
-                    'names': '; '.join(rem_fields)
-                })
+                if debug:
+                    logger.debug('[Record #%(idx)d] Removed fields: %(names)s', {
+                        'idx': record_idx,
+                        'names': '; '.join(rem_fields)
+                    })
                 changed_fields.update(rem_fields)
                 has_changed.update({k: True for k in rem_fields})
 
-            for k in new_image_keys & old_image_keys:
+            for k in new_image:
+                if k not in old_image:
+                    continue
                 if new_image[k] != old_image[k]:
-                    logger.debug('[Record #%(idx)d] Changed: %(name)s', {
-                        'idx': record_idx,
-                        'name': k,
-                    })
+                    if debug:
+                        logger.debug('[Record #%(idx)d] Changed: %(name)s', {
+                            'idx': record_idx,
+                            'name': k,
+                        })
                     changed_fields.add(k)
                     has_changed[k] = True
                 else:
@@ -120,4 +212,7 @@ def generate_records(records):
             record_dynamodb['ChangedFields'] = frozenset(changed_fields)
             record_dynamodb['HasChanged']    = has_changed
 
+        if metrics:
+            metrics.add_time(STAGE_DIFF, start)
+
         yield record
@@ -0,0 +1,147 @@
+"""
+Lightweight DynamoDB type handling.
+
+This mirrors `boto3.dynamodb.types`, but importing that module imports the
+whole `boto3` package (and botocore with it), which is a large part of the
+Lambda cold start. Nothing here needs more than the standard library.
+"""
+from base64 import b64decode
+from decimal import Clamped, Context, Inexact, Overflow, Rounded, Underflow
+
+DYNAMODB_CONTEXT = Context(
+    Emin=-128,
+    Emax=126,
+    prec=38,
+    traps=[Clamped, Overflow, Inexact, Rounded, Underflow],
+)
+
+BINARY_TYPES = (bytearray, bytes)
+
+
+class Binary:
+    """
+    Wrapper around binary data from DynamoDB. It compares equal to both other
+    `Binary` objects and the raw bytes, and orders by the bytes so that binary
+    sets can be sorted.
+    """
+    __slots__ = ('value',)
+
+    def __init__(self, value):
+        if not isinstance(value, BINARY_TYPES):
+            raise TypeError('Value must be of the following types: bytearray, bytes')
+        self.value = value
+
+    def __eq__(self, other):
+        if isinstance(other, Binary):
+            return self.value == other.value
+        return self.value == other
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def __lt__(self, other):
+        if isinstance(other, Binary):
+            return self.value < other.value
+        return self.value < other
+
+    def __repr__(self):
+        return f"Binary({self.value!r})"
+
+    def __bytes__(self):
+        return bytes(self.value)
+
+    def __hash__(self):
+        return hash(self.value)
+
+
+class TypeDeserializer:
+    #pylint: disable=too-few-public-methods
+    """
+    Deserializes DynamoDB typed values to python types:
+
+    - NULL -> None
+    - BOOL -> bool
+    - N -> Decimal
+    - S -> str
+    - B -> Binary (base64 strings from the stream are decoded)
+    - NS, SS, BS -> set
+    - L -> list
+    - M -> dict
+    """
+
+    def __init__(self):
+        self._deserializers = {
+            'NULL': self._deserialize_null,
+            'BOOL': self._deserialize_bool,
+            'N': self._deserialize_n,
+            'S': self._deserialize_s,
+            'B': self._deserialize_b,
+            'NS': self._deserialize_ns,
+            'SS': self._deserialize_ss,
+            'BS': self._deserialize_bs,
+            'L': self._deserialize_l,
+            'M': self._deserialize_m,
+        }
+
+    def deserialize(self, value):
+        """
+        Deserialize a single DynamoDB typed value.
+
+        Args:
+            value (dict): single key dict of the DynamoDB type and its value.
+
+        Returns:
+            The python value.
+
+        Raises:
+            TypeError: the value is empty or an unsupported type.
+        """
+        if not value:
+            raise TypeError(
+                'Value must be a nonempty dictionary whose key is a valid dynamodb type.'
+            )
+        for dynamodb_type, type_value in value.items():
+            try:
+                deserializer = self._deserializers[dynamodb_type]
+            except KeyError as err:
+                raise TypeError(f"Dynamodb type {dynamodb_type} is not supported") from err
+            return deserializer(type_value)
+        return None
+
+    @staticmethod
+    def _deserialize_null(value):
+        #pylint: disable=unused-argument
+        return None
+
+    @staticmethod
+    def _deserialize_bool(value):
+        return value
+
+    @staticmethod
+    def _deserialize_n(value):
+        return DYNAMODB_CONTEXT.create_decimal(value)
+
+    @staticmethod
+    def _deserialize_s(value):
+        return value
+
+    @staticmethod
+    def _deserialize_b(value):
+        if isinstance(value, str):
+            value = b64decode(value)
+        return Binary(value)
+
+    def _deserialize_ns(self, value):
+        return set(map(self._deserialize_n, value))
+
+    def _deserialize_ss(self, value):
+        return set(value)
+
+    def _deserialize_bs(self, value):
+        return set(map(self._deserialize_b, value))
+
+    def _deserialize_l(self, value):
+        return [self.deserialize(v) for v in value]
+
+    def _deserialize_m(self, value):
+        return {k: self.deserialize(v) for k, v in value.items()}
@@ -0,0 +1,186 @@
+"""
+Pool of worker processes to make the events of large batches on several
+CPUs. Deserializing, diffing and JSON encoding are pure python, so threads
+can't spread them across the vCPUs Lambda gives larger functions.
+
+Lambda has no `/dev/shm`, so `multiprocessing.Pool` and `Queue` (which need
+POSIX semaphores) can't be used. Each worker is a process with its own `Pipe`,
+and is sent one contiguous slice of the batch at a time. The workers are
+started on first use and kept for the warm invocations that follow.
+"""
+import logging
+import multiprocessing
+from threading import Lock
+import traceback
+
+from .logs import NO_RECORDS
+from .metrics import NULL_METRICS, STAGE_WORKERS, Metrics
+from .streams import sequence_number_gap
+
+logger = logging.getLogger(__name__)
+
+_pools = {}
+_pools_lock = Lock()
+
+
+def _worker_main(conn, make_events):
+    """
+    Worker process loop: receive a slice of records, and send back the events
+    (and the metrics, if wanted) or the error.
+    """
+    while True:
+        try:
+            msg = conn.recv()
+        except EOFError:
+            break
+        if msg is None:
+            break
+
+        records, event_bus_name, with_metrics = msg
+        metrics = Metrics() if with_metrics else NULL_METRICS
+        try:
+            events = list(make_events(records, event_bus_name, metrics, log_records=NO_RECORDS))
+        except Exception: #pylint: disable=broad-exception-caught
+            conn.send((None, None, traceback.format_exc()))
+        else:
+            conn.send((events, metrics if with_metrics else None, None))
+    conn.close()
+
+
+class WorkerPool:
+    """
+    The worker processes.
+
+    Args:
+        size (int): number of processes.
+        make_events (Callable): the package's `make_events`. It is passed in
+            (by reference) rather than imported, to avoid a circular import.
+    """
+
+    def __init__(self, size, make_events):
+        ctx = multiprocessing.get_context('spawn')
+        self.size = size
+        self.make_events_func = make_events
+        self.lock = Lock()
+        self.workers = []
+        for _ in range(size):
+            parent_conn, child_conn = ctx.Pipe()
+            process = ctx.Process(
+                target=_worker_main,
+                args=(child_conn, make_events),
+                daemon=True
+            )
+            process.start()
+            child_conn.close()
+            self.workers.append((process, parent_conn))
+        self.broken = False
+        logger.debug('Started %(size)d worker processes', {'size': size})
+
+    def make_events(self, records, event_bus_name, metrics=NULL_METRICS):
+        """
+        Make the events for the records, across the workers. A slice that
+        fails in a worker is made in this process instead.
+
+        Args:
+            records (List[dict]): stream event records.
+            event_bus_name (str): name of the bus to put the events to.
+            metrics (Metrics): collector for the stage timings.
+
+        Returns:
+            List[dict]: PutEvents entries, in record order.
+        """
+        slice_size = -(-len(records) // self.size)
+        slices = [records[idx:idx + slice_size] for idx in range(0, len(records), slice_size)]
+        with metrics.timer(STAGE_WORKERS):
+            results = self._dispatch(slices, event_bus_name, bool(metrics))
+
+        events = []
+        for records_slice, (slice_events, slice_metrics, error) in zip(slices, results):
+            if error:
+                logger.warning('Making events in a worker failed; making them here: %(error)s', {
+                    'error': error,
+                })
+                slice_events = list(self.make_events_func(
+                    records_slice,
+                    event_bus_name,
+                    metrics,
+                    log_records=NO_RECORDS
+                ))
+            elif slice_metrics is not None:
+                metrics.merge(slice_metrics)
+            events.extend(slice_events)
+
+        if metrics:
+            # The workers only know the gap of their own slice.
+            gap = sequence_number_gap(records)
+            if gap is not None:
+                metrics.put('SequenceNumberGap', gap)
+        return events
+
+    def _dispatch(self, slices, event_bus_name, with_metrics):
+        """
+        Send a slice of records to each worker, and wait for the results.
+
+        Returns:
+            List[tuple]: the events, metrics and error for each slice.
+        """
+        results = []
+        with self.lock:
+            sent = []
+            for (_, conn), records_slice in zip(self.workers, slices):
+                try:
+                    conn.send((records_slice, event_bus_name, with_metrics))
+                    sent.append(conn)
+                except OSError:
+                    self.broken = True
+                    sent.append(None)
+            for conn in sent:
+                try:
+                    results.append(conn.recv() if conn else (None, None, 'Worker is gone'))
+                except (EOFError, OSError):
+                    self.broken = True
+                    results.append((None, None, 'Worker exited'))
+        return results
+
+    def close(self):
+        """ Stop the worker processes. """
+        for process, conn in self.workers:
+            try:
+                conn.send(None)
+            except OSError:
+                pass
+            conn.close()
+            process.join(timeout=5)
+            if process.is_alive():
+                process.kill()
+        self.workers = []
+
+
+def get_worker_pool(size, make_events):
+    """
+    Get the worker pool, starting it on first use (or if a worker has died).
+
+    Args:
+        size (int): number of worker processes.
+        make_events (Callable): the package's `make_events`.
+
+    Returns:
+        WorkerPool: the pool.
+    """
+    pool = _pools.get(size)
+    if pool is None or pool.broken:
+        with _pools_lock:
+            pool = _pools.get(size)
+            if pool is None or pool.broken:
+                if pool is not None:
+                    pool.close()
+                pool = _pools[size] = WorkerPool(size, make_events)
+    return pool
+
+
+def close_worker_pools():
+    """ Stop all the worker processes. """
+    with _pools_lock:
+        for pool in _pools.values():
+            pool.close()
+        _pools.clear()
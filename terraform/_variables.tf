@@ -56,6 +56,39 @@ variable "dynamodb_table" {
                     kms_key_arn = string
                 })
     description = "DynamoDB table to monitor. Streams must be enabled."
+    default     = null
+}
+
+variable "dynamodb_tables" {
+    type        = list(object({
+                    arn                  = string
+                    name                 = string
+                    stream_arn           = string
+                    kms_key_arn          = optional(string)
+                    event_bus_name       = optional(string)
+                    event_detailtype_fmt = optional(string)
+                    projection           = optional(list(string))
+                    event_names          = optional(list(string))
+                    ttl                  = optional(string)
+                    ttl_event_bus_name   = optional(string)
+                    ttl_detail_type_fmt  = optional(string)
+                }))
+    description = "More DynamoDB tables to monitor, each with optional routing settings. Streams must be enabled."
+    default     = []
+
+    validation {
+        condition     = alltrue([ for t in var.dynamodb_tables : t.ttl == null ? true : contains(["publish", "keys", "summary", "drop"], t.ttl) ])
+        error_message = "The ttl must be one of: publish, keys, summary, drop."
+    }
+}
+
+variable "kinesis_streams" {
+    type        = list(object({
+                    stream_arn  = string
+                    kms_key_arn = optional(string)
+                }))
+    description = "Kinesis Data Streams that DynamoDB tables send their changes to, to trigger from."
+    default     = []
 }
 
 variable "event_detailtype_fmt" {
@@ -70,6 +103,190 @@ variable "event_bus_name" {
     default     = "default"
 }
 
+variable "init_prime" {
+    type        = string
+    description = "Prime the function during init: off, local (records and events only), or network (also connect to EventBridge)."
+    default     = "network"
+
+    validation {
+        condition     = contains(["off", "local", "network"], var.init_prime)
+        error_message = "Value must be one of: off, local, or network."
+    }
+}
+
+variable "metrics_enabled" {
+    type        = bool
+    description = "Log per-invocation stage timings and counts in CloudWatch Embedded Metric Format."
+    default     = true
+}
+
+variable "debug_sample_rate" {
+    type        = number
+    description = "Fraction of records to write per-record debug logs for, when the logging level is DEBUG."
+    default     = 0.01
+
+    validation {
+        condition     = var.debug_sample_rate >= 0 && var.debug_sample_rate <= 1
+        error_message = "Value must be between 0 and 1."
+    }
+}
+
+variable "parallel_lanes" {
+    type        = number
+    description = "Split each batch into this many lanes by item key, and publish the lanes in parallel."
+    default     = 1
+
+    validation {
+        condition     = var.parallel_lanes >= 1 && var.parallel_lanes <= 10
+        error_message = "Value must be between 1 and 10."
+    }
+}
+
+variable "encode_workers" {
+    type        = number
+    description = "Make the events of large batches in this many worker processes. 0 makes them in the handler."
+    default     = 0
+}
+
+variable "encode_workers_min_records" {
+    type        = number
+    description = "Only use the worker processes for batches of at least this many records."
+    default     = 1000
+}
+
+variable "schema_decoders" {
+    type        = bool
+    description = "Infer the usual shape of each table's items, and decode them with generated decoders for it."
+    default     = false
+}
+
+variable "aggregate_records" {
+    type        = number
+    description = "Put runs of up to this many records for the same table and eventName as one envelope event. 0 puts an event per record."
+    default     = 0
+}
+
+variable "aggregate_max_bytes" {
+    type        = number
+    description = "Size budget of an envelope event, in bytes."
+    default     = 65536
+
+    validation {
+        condition     = var.aggregate_max_bytes > 0 && var.aggregate_max_bytes <= 262144
+        error_message = "Must be between 1 and 262144 (256 KiB)."
+    }
+}
+
+variable "idempotency" {
+    type        = string
+    description = "Skip records that were already published: off, memory, or dynamodb:TABLE."
+    default     = "off"
+
+    validation {
+        condition     = can(regex("^(off|memory|dynamodb:[a-zA-Z0-9_.-]{3,255})$", var.idempotency))
+        error_message = "Value must be off, memory, or dynamodb:TABLE."
+    }
+}
+
+variable "idempotency_cache_size" {
+    type        = number
+    description = "Number of published record IDs to keep in memory."
+    default     = 10000
+}
+
+variable "failed_spool" {
+    type        = object({
+                    bucket = string
+                    prefix = optional(string, "")
+                })
+    description = "S3 bucket and prefix to write the events EventBridge doesn't accept to, for replaying."
+    default     = null
+
+    validation {
+        condition     = var.failed_spool == null ? true : can(regex("^(.+/)?$", var.failed_spool.prefix))
+        error_message = "Prefix must be empty or end with a '/'."
+    }
+}
+
+variable "quarantine_spool" {
+    type        = object({
+                    bucket = string
+                    prefix = optional(string, "")
+                })
+    description = "S3 bucket and prefix to quarantine the records that can't be made into valid events to."
+    default     = null
+
+    validation {
+        condition     = var.quarantine_spool == null ? true : can(regex("^(.+/)?$", var.quarantine_spool.prefix))
+        error_message = "Prefix must be empty or end with a '/'."
+    }
+}
+
+variable "put_events_rate_limit" {
+    type        = number
+    description = "Highest PutEvents entries per second for each concurrent function; the rate adapts to throttling below it. 0 is unlimited."
+    default     = 0
+}
+
+variable "deadline_margin_ms" {
+    type        = number
+    description = "Milliseconds before the function times out to stop publishing and return the records not put as failures. 0 turns it off."
+    default     = 1000
+}
+
+variable "client_max_pool_connections" {
+    type        = number
+    description = "HTTP connections each AWS client keeps. Default: enough for the parallel lanes (at least 10)."
+    default     = null
+}
+
+variable "client_connect_timeout" {
+    type        = number
+    description = "Seconds to wait for a connection to an AWS service."
+    default     = 2
+}
+
+variable "client_read_timeout" {
+    type        = number
+    description = "Seconds to wait for an AWS service to respond. Default: derived from the function timeout, so the attempts of a PutEvents call take at most a quarter of the time before the deadline; a call isn't started with less than that left."
+    default     = null
+}
+
+variable "client_retry_mode" {
+    type        = string
+    description = "botocore retry mode of the AWS clients: legacy, standard, or adaptive."
+    default     = "standard"
+
+    validation {
+        condition     = contains(["legacy", "standard", "adaptive"], var.client_retry_mode)
+        error_message = "The client_retry_mode must be one of: legacy, standard, adaptive."
+    }
+}
+
+variable "client_max_attempts" {
+    type        = number
+    description = "Attempts the AWS clients make for a call, including the first."
+    default     = 3
+}
+
+variable "client_events_max_attempts" {
+    type        = number
+    description = "Attempts the EventBridge client makes for a PutEvents call, including the first. The function retries throttling itself."
+    default     = 2
+}
+
+variable "client_tcp_keepalive" {
+    type        = bool
+    description = "Turn on TCP keep-alive for the AWS client connections."
+    default     = true
+}
+
+variable "client_latency_log" {
+    type        = bool
+    description = "Debug log the wire latency of each AWS call attempt."
+    default     = false
+}
+
 variable "function_tags" {
     type        = map(string)
     description = "Extra tags to add to the Lambda function only."
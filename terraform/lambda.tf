@@ -1,3 +1,37 @@
+# =========================================================
+# Locals
+# =========================================================
+
+locals {
+    # Keyed by "dynamodb" for var.dynamodb_table, so its trigger isn't
+    # replaced, and by table name for var.dynamodb_tables.
+    dynamodb_tables = merge(
+        var.dynamodb_table == null ? {} : { dynamodb = var.dynamodb_table },
+        { for t in var.dynamodb_tables : t.name => t },
+    )
+
+    routing_config = {
+        for t in var.dynamodb_tables : t.name => {
+            eventBusName     = t.event_bus_name
+            detailTypeFmt    = t.event_detailtype_fmt
+            projection       = t.projection
+            eventNames       = t.event_names
+            ttl              = t.ttl
+            ttlEventBusName  = t.ttl_event_bus_name
+            ttlDetailTypeFmt = t.ttl_detail_type_fmt
+        } if t.event_bus_name != null || t.event_detailtype_fmt != null || t.projection != null || t.event_names != null || t.ttl != null || t.ttl_event_bus_name != null || t.ttl_detail_type_fmt != null
+    }
+
+    # Seconds; the client timeouts are derived from it.
+    function_timeout = 10
+
+    event_bus_names = distinct(concat(
+        [ var.event_bus_name ],
+        [ for t in var.dynamodb_tables : t.event_bus_name if t.event_bus_name != null ],
+        [ for t in var.dynamodb_tables : t.ttl_event_bus_name if t.ttl_event_bus_name != null ],
+    ))
+}
+
 # =========================================================
 # Data
 # =========================================================
@@ -16,18 +50,47 @@ data "aws_iam_policy_document" "this" {
         resources = [ "*" ]
     }
 
-    statement {
-        effect    = "Allow"
-        actions   = [
-            "dynamodb:DescribeStream",
-            "dynamodb:GetRecords",
-            "dynamodb:GetShardIterator",
-        ]
-        resources = [ var.dynamodb_table.stream_arn ]
+    dynamic "statement" {
+        for_each = length(local.dynamodb_tables) == 0 ? [] : [ true ]
+        content {
+            effect    = "Allow"
+            actions   = [
+                "dynamodb:DescribeStream",
+                "dynamodb:GetRecords",
+                "dynamodb:GetShardIterator",
+            ]
+            resources = [ for t in local.dynamodb_tables : t.stream_arn ]
+        }
+    }
+
+    dynamic "statement" {
+        for_each = length(var.kinesis_streams) == 0 ? [] : [ true ]
+        content {
+            effect    = "Allow"
+            actions   = [
+                "kinesis:DescribeStream",
+                "kinesis:DescribeStreamSummary",
+                "kinesis:GetRecords",
+                "kinesis:GetShardIterator",
+                "kinesis:ListShards",
+                "kinesis:ListStreams",
+                "kinesis:SubscribeToShard",
+            ]
+            resources = [ for s in var.kinesis_streams : s.stream_arn ]
+        }
+    }
+
+    dynamic "statement" {
+        for_each = { for s in var.kinesis_streams : s.stream_arn => s if s.kms_key_arn != null }
+        content {
+            effect    = "Allow"
+            actions   = [ "kms:Decrypt" ]
+            resources = [ statement.value.kms_key_arn ]
+        }
     }
 
     dynamic "statement" {
-        for_each = var.dynamodb_table.kms_key_arn == null ? [] : [ var.dynamodb_table.kms_key_arn ]
+        for_each = { for k, t in local.dynamodb_tables : k => t if t.kms_key_arn != null }
         content {
             effect  = "Allow"
             actions = [
@@ -35,13 +98,13 @@ data "aws_iam_policy_document" "this" {
                 "kms:Decrypt",
                 "kms:Encrypt",
             ]
-            resources = [ statement.value ]
+            resources = [ statement.value.kms_key_arn ]
 
             condition {
                 test     = "StringEquals"
                 variable = "kms:EncryptionContext:aws:dynamodb:tableName"
 
-                values = [ var.dynamodb_table.name ]
+                values = [ statement.value.name ]
             }
 
             condition {
@@ -53,11 +116,44 @@ data "aws_iam_policy_document" "this" {
         }
     }
 
+    dynamic "statement" {
+        for_each = startswith(var.idempotency, "dynamodb:") ? [ trimprefix(var.idempotency, "dynamodb:") ] : []
+        content {
+            effect    = "Allow"
+            actions   = [
+                "dynamodb:BatchGetItem",
+                "dynamodb:BatchWriteItem",
+            ]
+            resources = [
+                "arn:${local.partition}:dynamodb:${local.region_name}:${local.account_id}:table/${statement.value}"
+            ]
+        }
+    }
+
+    dynamic "statement" {
+        for_each = [ for spool in [ var.failed_spool, var.quarantine_spool ] : spool if spool != null ]
+        content {
+            effect    = "Allow"
+            actions   = [ "s3:PutObject" ]
+            resources = [
+                "arn:${local.partition}:s3:::${statement.value.bucket}/${statement.value.prefix}*"
+            ]
+        }
+    }
+
+    statement {
+        effect    = "Allow"
+        actions   = [ "events:DescribeEventBus" ]
+        resources = [
+            for name in local.event_bus_names : "arn:${local.partition}:events:${local.region_name}:${local.account_id}:event-bus/${name}"
+        ]
+    }
+
     statement {
         effect    = "Allow"
         actions   = [ "events:PutEvents" ]
         resources = [
-            "arn:${local.partition}:events:${local.region_name}:${local.account_id}:event-bus/${var.event_bus_name}"
+            for name in local.event_bus_names : "arn:${local.partition}:events:${local.region_name}:${local.account_id}:event-bus/${name}"
         ]
         condition {
             test     = "StringEquals"
@@ -80,13 +176,37 @@ module "this" {
     description   = "Send DynamoDB Stream Records to EventBridge"
     handler       = "dynamodb_stream_events.handler"
     runtime       = "python3.11"
-    timeout       = 10
+    timeout       = local.function_timeout
     function_tags = var.function_tags
 
     environment_variables = {
-        EVENT_BUS_NAME       = var.event_bus_name
-        EVENT_DETAILTYPE_FMT = var.event_detailtype_fmt
-        LOGGING_LEVEL        = local.partition == "aws" || local.is_debug ? "DEBUG" : "INFO"
+        EVENT_BUS_NAME              = var.event_bus_name
+        EVENT_DETAILTYPE_FMT        = var.event_detailtype_fmt
+        INIT_PRIME                  = var.init_prime
+        METRICS_ENABLED             = var.metrics_enabled ? "true" : "false"
+        DEBUG_SAMPLE_RATE           = tostring(var.debug_sample_rate)
+        PARALLEL_LANES              = tostring(var.parallel_lanes)
+        ENCODE_WORKERS              = tostring(var.encode_workers)
+        ENCODE_WORKERS_MIN_RECORDS  = tostring(var.encode_workers_min_records)
+        SCHEMA_DECODERS             = tostring(var.schema_decoders)
+        AGGREGATE_RECORDS           = tostring(var.aggregate_records)
+        AGGREGATE_MAX_BYTES         = tostring(var.aggregate_max_bytes)
+        IDEMPOTENCY                 = var.idempotency
+        IDEMPOTENCY_CACHE_SIZE      = tostring(var.idempotency_cache_size)
+        PUT_EVENTS_RATE_LIMIT       = tostring(var.put_events_rate_limit)
+        DEADLINE_MARGIN_MS          = tostring(var.deadline_margin_ms)
+        CLIENT_MAX_POOL_CONNECTIONS = tostring(coalesce(var.client_max_pool_connections, max(10, var.parallel_lanes)))
+        CLIENT_CONNECT_TIMEOUT      = tostring(var.client_connect_timeout)
+        CLIENT_READ_TIMEOUT         = tostring(coalesce(var.client_read_timeout, max(1, floor((local.function_timeout * 1000 - var.deadline_margin_ms) / 4 / var.client_events_max_attempts / 1000))))
+        CLIENT_RETRY_MODE           = var.client_retry_mode
+        CLIENT_MAX_ATTEMPTS         = tostring(var.client_max_attempts)
+        CLIENT_EVENTS_MAX_ATTEMPTS  = tostring(var.client_events_max_attempts)
+        CLIENT_TCP_KEEPALIVE        = var.client_tcp_keepalive ? "true" : "false"
+        CLIENT_LATENCY_LOG          = var.client_latency_log ? "true" : "false"
+        FAILED_SPOOL                = var.failed_spool == null ? "" : "s3://${var.failed_spool.bucket}/${var.failed_spool.prefix}"
+        QUARANTINE_SPOOL            = var.quarantine_spool == null ? "" : "s3://${var.quarantine_spool.bucket}/${var.quarantine_spool.prefix}"
+        ROUTING_CONFIG              = length(local.routing_config) == 0 ? "" : jsonencode(local.routing_config)
+        LOGGING_LEVEL               = local.partition == "aws" || local.is_debug ? "DEBUG" : "INFO"
     }
     cloudwatch_logs_kms_key_id        = var.cloudwatch_logs_kms_key_id
     cloudwatch_logs_retention_in_days = local.is_debug ? 7 : 30
@@ -100,24 +220,42 @@ module "this" {
         version_id = data.aws_s3_object.this[0].version_id
     }
 
-    event_source_mapping = {
-        dynamodb = {
-            event_source_arn  = var.dynamodb_table.stream_arn
-            starting_position = "LATEST"
-        }
-    }
+    event_source_mapping = merge(
+        {
+            for k, t in local.dynamodb_tables : k => {
+                event_source_arn        = t.stream_arn
+                starting_position       = "LATEST"
+                function_response_types = [ "ReportBatchItemFailures" ]
+            }
+        },
+        {
+            for s in var.kinesis_streams : "kinesis-${element(split("/", s.stream_arn), 1)}" => {
+                event_source_arn        = s.stream_arn
+                starting_position       = "LATEST"
+                function_response_types = [ "ReportBatchItemFailures" ]
+            }
+        },
+    )
 
     create_current_version_async_event_config   = false
     create_current_version_allowed_triggers     = false
     create_unqualified_alias_allowed_triggers   = true
     create_unqualified_alias_async_event_config = true
 
-    allowed_triggers = {
-        dynamodb = {
-            principal  = "dynamodb.amazonaws.com"
-            source_arn = var.dynamodb_table.stream_arn
-        }
-    }
+    allowed_triggers = merge(
+        {
+            for k, t in local.dynamodb_tables : k => {
+                principal  = "dynamodb.amazonaws.com"
+                source_arn = t.stream_arn
+            }
+        },
+        {
+            for s in var.kinesis_streams : "kinesis-${element(split("/", s.stream_arn), 1)}" => {
+                principal  = "kinesis.amazonaws.com"
+                source_arn = s.stream_arn
+            }
+        },
+    )
 
     attach_policy_json = true
     policy_json        = data.aws_iam_policy_document.this.json
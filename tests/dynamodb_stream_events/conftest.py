@@ -3,3 +3,4 @@ import sys
 
 BASE = dirname(dirname(dirname(__file__)))
 sys.path.insert(0, join(BASE, 'build'))
+sys.path.insert(1, join(BASE, 'scripts'))
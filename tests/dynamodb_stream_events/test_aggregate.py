@@ -0,0 +1,91 @@
+import json
+
+import dynamodb_stream_events as init
+from dynamodb_stream_events import aggregate, spool
+from dynamodb_stream_events.metrics import Metrics
+from dynamodb_stream_events.publish import entry_size
+from synthetic import RecordShape, SyntheticRecords
+
+class RecordingEventsClient:
+    """ Keeps the entries put, and fails the ones with `fail` in their DetailType. """
+    def __init__(self, fail=None):
+        self.fail = fail
+        self.entries = []
+
+    def put_events(self, Entries):
+        #pylint: disable=invalid-name
+        res_entries = []
+        for entry in Entries:
+            if self.fail and self.fail in entry['DetailType']:
+                res_entries.append({'ErrorCode': 'InternalFailure', 'ErrorMessage': 'Failed'})
+            else:
+                self.entries.append(entry)
+                res_entries.append({'EventId': str(len(self.entries))})
+        return {'Entries': res_entries}
+
+def make_events(names):
+    return [
+        dict(
+            Source='dynamodb-streams.aws.illinois.edu',
+            Resources=['arn'],
+            DetailType=f"DynamoDB Streams Record {name}",
+            Detail=json.dumps({'idx': idx}),
+            EventBusName='default',
+        )
+        for idx, name in enumerate(names)
+    ]
+
+def test_aggregate():
+    names = ['INSERT', 'INSERT', 'INSERT', 'MODIFY', 'INSERT', 'INSERT']
+    aggregator = aggregate.EventAggregator(max_records=2)
+    envelopes = list(aggregator.aggregate(
+        make_events(names),
+        [10 + idx for idx in range(len(names))],
+        {10 + idx: name for idx, name in enumerate(names)},
+    ))
+
+    assert [json.loads(e['Detail']) for e in envelopes] == [
+        {'Records': [{'idx': 0}, {'idx': 1}]},
+        {'Records': [{'idx': 2}]},
+        {'Records': [{'idx': 3}]},
+        {'Records': [{'idx': 4}, {'idx': 5}]},
+    ]
+    assert envelopes[0]['DetailType'] == 'DynamoDB Streams Record INSERT (Aggregated)'
+    assert envelopes[0]['Resources'] == ['arn']
+    assert aggregator.event_indexes == [10, 12, 13, 14]
+    assert aggregator.record_indexes == [[10, 11], [12], [13], [14, 15]]
+
+def test_aggregate_max_bytes():
+    events = make_events(['INSERT'] * 10)
+    aggregator = aggregate.EventAggregator(max_records=100, max_bytes=200)
+    envelopes = list(aggregator.aggregate(events, range(10), {idx: 'INSERT' for idx in range(10)}))
+
+    assert len(envelopes) > 1
+    assert all(entry_size(e) <= 200 for e in envelopes)
+    assert sum(len(indexes) for indexes in aggregator.record_indexes) == 10
+
+def test_put_records_aggregate(monkeypatch):
+    monkeypatch.setattr(init, 'AGGREGATE_RECORDS', 10)
+    records = SyntheticRecords(RecordShape(width=3)).batch(25, event_name='INSERT')
+    events_clnt = RecordingEventsClient()
+    metrics = Metrics('Test')
+    init.put_records(records, _events_clnt=events_clnt, metrics=metrics)
+
+    assert [len(json.loads(e['Detail'])['Records']) for e in events_clnt.entries] == [10, 10, 5]
+    details = [d for e in events_clnt.entries for d in json.loads(e['Detail'])['Records']]
+    assert [d['SequenceNumber'] for d in details] == \
+        [r['dynamodb']['SequenceNumber'] for r in records]
+    assert metrics.values['RecordsIn'] == 25
+    assert metrics.values['EventsOut'] == 3
+
+def test_put_records_aggregate_failed(monkeypatch):
+    monkeypatch.setattr(init, 'AGGREGATE_RECORDS', 10)
+    monkeypatch.setattr(spool, 'FAILED_SPOOL', None)
+    synthetic = SyntheticRecords()
+    records = synthetic.batch(6, event_name='INSERT') + synthetic.batch(3, event_name='REMOVE')
+    events_clnt = RecordingEventsClient(fail='REMOVE')
+    failed = init.put_records(records, _events_clnt=events_clnt)
+
+    # All the records of the failed envelope are reported.
+    assert len(events_clnt.entries) == 1
+    assert failed == [r['dynamodb']['SequenceNumber'] for r in records[6:]]
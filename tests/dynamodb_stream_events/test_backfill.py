@@ -0,0 +1,230 @@
+import gzip
+import json
+import os
+
+import boto3
+from moto import mock_s3
+import pytest
+
+import dynamodb_stream_events as init
+from dynamodb_stream_events import backfill, checkpoints
+from dynamodb_stream_events.checkpoints import SHARD_END
+
+TABLE_ARN = 'arn:aws:dynamodb:us-east-2:123456789012:table/ExportedTable'
+
+def item_lines(start, count):
+    return [
+        json.dumps({'Item': {'pk': {'S': f"item{idx}"}, 'value': {'N': str(idx)}}})
+        for idx in range(start, start + count)
+    ]
+
+def write_export(directory, files):
+    data_dir = os.path.join(directory, 'data')
+    os.makedirs(data_dir, exist_ok=True)
+    for name, lines in files.items():
+        with gzip.open(os.path.join(data_dir, name), 'wt', encoding='utf-8') as file_p:
+            file_p.write('\n'.join(lines) + '\n')
+    with open(os.path.join(directory, 'manifest-summary.json'), 'w', encoding='utf-8') as file_p:
+        json.dump({
+            'tableArn': TABLE_ARN,
+            'exportTime': '2020-07-15T12:00:00.000Z',
+            'outputFormat': 'DYNAMODB_JSON',
+        }, file_p)
+
+class Collector:
+    """ Keeps the records, and fails the ones with the `fail` keys `times` times. """
+    def __init__(self, fail=(), times=1000):
+        self.fail = set(fail)
+        self.times = times
+        self.records = []
+
+    def __call__(self, records):
+        failed = []
+        for record in records:
+            pk = record['dynamodb']['Keys']['pk']['S']
+            if pk in self.fail and self.times:
+                failed.append(record['dynamodb']['SequenceNumber'])
+            else:
+                self.records.append(record)
+        if failed:
+            self.times -= 1
+        return failed
+
+@pytest.fixture
+def export_dir(tmp_path):
+    directory = tmp_path / 'export'
+    write_export(str(directory), {
+        'a.json.gz': item_lines(0, 7),
+        'b.json.gz': item_lines(7, 5),
+    })
+    return directory
+
+@pytest.fixture
+def store(tmp_path):
+    return checkpoints.open_checkpoint_store(f"sqlite:{tmp_path}/checkpoints.db")
+
+def make_backfill(export_dir, store, **kwargs):
+    kwargs.setdefault('process', Collector())
+    kwargs.setdefault('batch_size', 3)
+    return backfill.Backfill(
+        backfill.open_export(str(export_dir)),
+        str(export_dir),
+        TABLE_ARN,
+        ['pk'],
+        store,
+        **kwargs
+    )
+
+def test_backfill(export_dir, store):
+    export_backfill = make_backfill(export_dir, store, created=1594814400.0)
+    stats = export_backfill.run()
+    records = export_backfill.process.records
+
+    assert stats == dict(files=2, skipped=0, failed=0, items=12, invalid=0)
+    assert sorted(r['dynamodb']['Keys']['pk']['S'] for r in records) == \
+        sorted(f"item{idx}" for idx in range(12))
+    record = next(r for r in records if r['dynamodb']['Keys']['pk']['S'] == 'item8')
+    assert record['eventName'] == 'INSERT'
+    assert record['eventSourceARN'] == TABLE_ARN
+    assert record['eventID'] == 'backfill:data/b.json.gz:2'
+    assert record['dynamodb']['NewImage'] == {'pk': {'S': 'item8'}, 'value': {'N': '8'}}
+    assert record['dynamodb']['SequenceNumber'] == '2'
+    assert record['dynamodb']['ApproximateCreationDateTime'] == 1594814400.0
+    assert store.get(str(export_dir), 'data/a.json.gz') == SHARD_END
+
+    # A second run has nothing left to do.
+    stats = make_backfill(export_dir, store).run()
+    assert stats['skipped'] == 2 and stats['items'] == 0
+
+def test_backfill_resume(export_dir, store):
+    store.put(str(export_dir), 'data/a.json.gz', '3')
+    store.put(str(export_dir), 'data/b.json.gz', SHARD_END)
+    export_backfill = make_backfill(export_dir, store)
+    stats = export_backfill.run()
+
+    assert stats == dict(files=1, skipped=1, failed=0, items=4, invalid=0)
+    assert [r['dynamodb']['Keys']['pk']['S'] for r in export_backfill.process.records] == \
+        ['item3', 'item4', 'item5', 'item6']
+
+def test_backfill_failed(export_dir, store):
+    export_backfill = make_backfill(
+        export_dir,
+        store,
+        process=Collector(fail={'item4'}),
+        attempts=1,
+        workers=1,
+    )
+    stats = export_backfill.run()
+
+    assert stats == dict(files=1, skipped=0, failed=1, items=8, invalid=0)
+    # The file stops at the last batch that was published.
+    assert store.get(str(export_dir), 'data/a.json.gz') == '3'
+    assert store.get(str(export_dir), 'data/b.json.gz') == SHARD_END
+
+def test_backfill_raises(export_dir, store):
+    class RaisingCollector(Collector):
+        def __call__(self, records):
+            if any(r['dynamodb']['Keys']['pk']['S'] == 'item4' for r in records):
+                raise RuntimeError('unavailable')
+            return super().__call__(records)
+
+    export_backfill = make_backfill(
+        export_dir,
+        store,
+        process=RaisingCollector(),
+        attempts=1,
+        workers=1,
+    )
+    stats = export_backfill.run()
+
+    # The batch that raised is counted as failed, and the other file is done.
+    assert stats == dict(files=1, skipped=0, failed=1, items=8, invalid=0)
+    assert store.get(str(export_dir), 'data/a.json.gz') == '3'
+    assert store.get(str(export_dir), 'data/b.json.gz') == SHARD_END
+
+def test_backfill_retry(export_dir, store):
+    export_backfill = make_backfill(
+        export_dir,
+        store,
+        process=Collector(fail={'item4'}, times=1),
+        attempts=2,
+    )
+    stats = export_backfill.run()
+
+    assert stats['files'] == 2 and stats['failed'] == 0
+    assert len(export_backfill.process.records) == 12
+
+def test_backfill_invalid(tmp_path, store):
+    directory = tmp_path / 'export'
+    write_export(str(directory), {
+        'a.json.gz': item_lines(0, 2) + ['', '{"Item": ', '{"Other": {}}'] + item_lines(2, 2),
+    })
+    export_backfill = make_backfill(directory, store, batch_size=10)
+    stats = export_backfill.run()
+
+    assert stats == dict(files=1, skipped=0, failed=0, items=4, invalid=2)
+    assert [r['dynamodb']['SequenceNumber'] for r in export_backfill.process.records] == \
+        ['1', '2', '6', '7']
+
+def test_backfill_put_records(monkeypatch, export_dir, store):
+    class EventsClient:
+        def __init__(self):
+            self.entries = []
+
+        def put_events(self, Entries):
+            #pylint: disable=invalid-name
+            self.entries.extend(Entries)
+            return {'Entries': [{'EventId': str(idx)} for idx in range(len(Entries))]}
+
+    events_clnt = EventsClient()
+    monkeypatch.setattr(init, 'get_events_clnt', lambda: events_clnt)
+    stats = make_backfill(export_dir, store, process=backfill.process_records).run()
+
+    assert stats['items'] == 12
+    assert len(events_clnt.entries) == 12
+    assert events_clnt.entries[0]['DetailType'] == 'DynamoDB Streams Record INSERT'
+    assert events_clnt.entries[0]['Resources'] == [TABLE_ARN]
+    detail = json.loads(events_clnt.entries[0]['Detail'])
+    assert detail['TableName'] == 'ExportedTable'
+    assert detail['NewImage']['pk'] == detail['Keys']['pk']
+
+def test_s3_export(monkeypatch, tmp_path):
+    monkeypatch.setenv('AWS_DEFAULT_REGION', 'us-east-2')
+    monkeypatch.setenv('AWS_ACCESS_KEY_ID', 'testing')
+    monkeypatch.setenv('AWS_SECRET_ACCESS_KEY', 'testing')
+    with mock_s3():
+        s3_clnt = boto3.client('s3')
+        s3_clnt.create_bucket(
+            Bucket='export-bucket',
+            CreateBucketConfiguration={'LocationConstraint': 'us-east-2'},
+        )
+        prefix = 'AWSDynamoDB/01234-abcd/'
+        s3_clnt.put_object(
+            Bucket='export-bucket',
+            Key=f"{prefix}data/a.json.gz",
+            Body=gzip.compress(('\n'.join(item_lines(0, 3)) + '\n').encode('utf-8')),
+        )
+        s3_clnt.put_object(Bucket='export-bucket', Key=f"{prefix}manifest-files.json", Body=b'')
+
+        export = backfill.open_export(f"s3://export-bucket/{prefix}")
+        export.s3_clnt = s3_clnt
+        assert export.names() == ['data/a.json.gz']
+        assert export.read_summary() is None
+
+        s3_clnt.put_object(
+            Bucket='export-bucket',
+            Key=f"{prefix}manifest-summary.json",
+            Body=json.dumps({'tableArn': TABLE_ARN}).encode('utf-8'),
+        )
+        assert export.read_summary() == {'tableArn': TABLE_ARN}
+
+        collector = Collector()
+        stats = backfill.Backfill(
+            export,
+            f"s3://export-bucket/{prefix}",
+            TABLE_ARN,
+            ['pk'],
+            checkpoints.open_checkpoint_store(f"sqlite:{tmp_path}/checkpoints.db"),
+            process=collector,
+        ).run()
+        assert stats['items'] == 3
@@ -0,0 +1,40 @@
+import json
+
+import pytest
+
+from dynamodb_stream_events import checkpoints
+
+STREAM_ARN = 'arn:aws:dynamodb:us-east-2:123456789012:table/Test/stream/1'
+
+@pytest.mark.parametrize('url_fmt,store_type', [
+    ('{path}/checkpoints.json', checkpoints.FileCheckpointStore),
+    ('file:{path}/checkpoints.json', checkpoints.FileCheckpointStore),
+    ('sqlite:{path}/checkpoints.db', checkpoints.SQLiteCheckpointStore),
+])
+def test_checkpoint_store(tmp_path, url_fmt, store_type):
+    url = url_fmt.format(path=tmp_path)
+    store = checkpoints.open_checkpoint_store(url)
+    assert isinstance(store, store_type)
+
+    assert store.get(STREAM_ARN, 'shard-1') is None
+    store.put(STREAM_ARN, 'shard-1', '100')
+    store.put(STREAM_ARN, 'shard-1', '200')
+    store.put(STREAM_ARN, 'shard-2', checkpoints.SHARD_END)
+    store.put('other', 'shard-1', '300')
+    store.close()
+
+    # Persisted for the next process.
+    store = checkpoints.open_checkpoint_store(url)
+    assert store.get(STREAM_ARN, 'shard-1') == '200'
+    assert store.get(STREAM_ARN, 'shard-2') == checkpoints.SHARD_END
+    assert store.get('other', 'shard-1') == '300'
+    assert store.get('other', 'shard-2') is None
+    store.close()
+
+def test_file_checkpoint_store_format(tmp_path):
+    file_path = tmp_path / 'checkpoints.json'
+    store = checkpoints.FileCheckpointStore(str(file_path))
+    store.put(STREAM_ARN, 'shard-1', '100')
+
+    assert json.loads(file_path.read_text()) == {STREAM_ARN: {'shard-1': '100'}}
+    assert not (tmp_path / 'checkpoints.json.tmp').exists()
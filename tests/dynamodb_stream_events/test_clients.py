@@ -0,0 +1,69 @@
+import logging
+
+from botocore.exceptions import ClientError
+from moto import mock_events
+import pytest
+
+from dynamodb_stream_events import clients
+
+@pytest.fixture
+def latencies():
+    seen = []
+    def hook(service, operation, latency_ms, exception):
+        seen.append((service, operation, latency_ms, exception))
+    clients.add_latency_hook(hook)
+    clients.reset_clients()
+    yield seen
+    clients.remove_latency_hook(hook)
+    clients.reset_clients()
+
+def test_client_config(monkeypatch):
+    monkeypatch.setattr(clients, 'CLIENT_MAX_POOL_CONNECTIONS', 32)
+    monkeypatch.setattr(clients, 'CLIENT_READ_TIMEOUT', 4.5)
+    config = clients.client_config()
+
+    assert config.max_pool_connections == 32
+    assert config.connect_timeout == clients.CLIENT_CONNECT_TIMEOUT
+    assert config.read_timeout == 4.5
+    assert config.retries == {'mode': 'standard', 'max_attempts': 3}
+    assert config.tcp_keepalive is True
+
+    # The app retries PutEvents itself.
+    assert clients.client_config('events').retries == {'mode': 'standard', 'max_attempts': 2}
+
+def test_latency_hook(latencies):
+    with mock_events():
+        events_clnt = clients.get_events_clnt()
+        assert events_clnt.meta.config.max_pool_connections == clients.CLIENT_MAX_POOL_CONNECTIONS
+
+        events_clnt.list_event_buses()
+        with pytest.raises(ClientError):
+            events_clnt.describe_event_bus(Name='does-not-exist')
+
+    assert [(s, o) for s, o, _, _ in latencies] == [
+        ('eventbridge', 'ListEventBuses'),
+        ('eventbridge', 'DescribeEventBus'),
+    ]
+    assert all(latency_ms >= 0 for _, _, latency_ms, _ in latencies)
+
+def test_latency_hook_errors(latencies, caplog):
+    def failing_hook(*args):
+        raise ValueError('hook')
+    clients.add_latency_hook(failing_hook)
+    try:
+        with mock_events():
+            clients.get_events_clnt().list_event_buses()
+    finally:
+        clients.remove_latency_hook(failing_hook)
+
+    # A hook that raises doesn't fail the call, or the other hooks.
+    assert len(latencies) == 1
+    assert 'Latency hook failed' in caplog.text
+
+def test_log_latency(caplog):
+    with caplog.at_level(logging.DEBUG, logger=clients.__name__):
+        clients.log_latency('eventbridge', 'PutEvents', 12.5)
+        clients.log_latency('eventbridge', 'PutEvents', 3.0, ValueError())
+
+    assert 'eventbridge.PutEvents: 12.500 ms' in caplog.text
+    assert 'eventbridge.PutEvents: 3.000 ms (ValueError)' in caplog.text
@@ -0,0 +1,239 @@
+import json
+import time
+
+import boto3
+from moto import mock_dynamodb
+import pytest
+
+import dynamodb_stream_events as init
+from dynamodb_stream_events import idempotency
+from dynamodb_stream_events.metrics import Metrics
+from synthetic import SyntheticRecords
+
+class FailingEventsClient:
+    """ Fails the entries for the sequence numbers in `fail`. """
+    def __init__(self, fail=()):
+        self.fail = set(fail)
+        self.sequence_numbers = []
+
+    def put_events(self, Entries):
+        #pylint: disable=invalid-name
+        res_entries = []
+        for entry in Entries:
+            seq = json.loads(entry['Detail'])['SequenceNumber']
+            self.sequence_numbers.append(seq)
+            if seq in self.fail:
+                res_entries.append({'ErrorCode': 'InternalFailure', 'ErrorMessage': 'Failed'})
+            else:
+                res_entries.append({'EventId': seq})
+        return {'FailedEntryCount': len(self.fail), 'Entries': res_entries}
+
+@pytest.fixture
+def memory_cache(monkeypatch):
+    monkeypatch.setattr(idempotency, 'IDEMPOTENCY', 'memory')
+    idempotency.reset_idempotency_cache()
+    yield idempotency.get_idempotency_cache()
+    idempotency.reset_idempotency_cache()
+
+def seqs(records):
+    return [r['dynamodb']['SequenceNumber'] for r in records]
+
+def test_idempotency_key():
+    assert idempotency.idempotency_key(dict(eventID='abc', dynamodb={})) == 'abc'
+    assert idempotency.idempotency_key(dict(
+        eventSourceARN='arn:stream',
+        dynamodb=dict(SequenceNumber='100'),
+    )) == 'arn:stream#100'
+    assert idempotency.idempotency_key(dict(dynamodb={})) is None
+
+def test_cache_lru():
+    records = SyntheticRecords().batch(5)
+    cache = idempotency.IdempotencyCache(size=3)
+    assert cache.unpublished(records) is records
+
+    cache.put(records)
+    # Only the last three are remembered.
+    assert cache.unpublished(records) == records[:2]
+
+    # Checking a key makes it recent, so it's kept over the others.
+    cache.unpublished(records[2:3])
+    cache.put(records[:1])
+    assert cache.unpublished(records) == records[1:2] + records[3:4]
+
+def test_cache_unknown_records():
+    records = [dict(eventName='INSERT', dynamodb={})] * 2
+    cache = idempotency.IdempotencyCache()
+    cache.put(records)
+    assert cache.unpublished(records) is records
+
+def test_sqlite_store(tmp_path):
+    db_path = str(tmp_path / 'idempotency.db')
+    store = idempotency.SQLiteIdempotencyStore(db_path)
+    store.put(['a', 'b'])
+    store.close()
+
+    store = idempotency.SQLiteIdempotencyStore(db_path)
+    assert store.published(['a', 'b', 'c']) == {'a', 'b'}
+
+    # Expired keys aren't found.
+    store = idempotency.SQLiteIdempotencyStore(db_path, ttl=-1)
+    store.put(['c'])
+    assert store.published(['a', 'b', 'c']) == {'a', 'b'}
+
+def test_dynamodb_store(monkeypatch):
+    monkeypatch.setenv('AWS_DEFAULT_REGION', 'us-east-2')
+    monkeypatch.setenv('AWS_ACCESS_KEY_ID', 'testing')
+    monkeypatch.setenv('AWS_SECRET_ACCESS_KEY', 'testing')
+    with mock_dynamodb():
+        ddb_clnt = boto3.client('dynamodb')
+        ddb_clnt.create_table(
+            TableName='Idempotency',
+            KeySchema=[dict(AttributeName='pk', KeyType='HASH')],
+            AttributeDefinitions=[dict(AttributeName='pk', AttributeType='S')],
+            BillingMode='PAY_PER_REQUEST',
+        )
+        store = idempotency.DynamoDBIdempotencyStore('Idempotency', ddb_clnt=ddb_clnt)
+        keys = [f"key-{idx}" for idx in range(130)]
+        store.put(keys[:60])
+        assert store.published(keys) == set(keys[:60])
+
+        item = ddb_clnt.get_item(TableName='Idempotency', Key={'pk': {'S': 'key-0'}})['Item']
+        assert int(item['expires']['N']) > time.time() + 86000
+
+def test_sqlite_store_cleanup(tmp_path):
+    db_path = str(tmp_path / 'idempotency.db')
+    store = idempotency.SQLiteIdempotencyStore(db_path, ttl=-1)
+    store.put(['a', 'b'])
+    # The expired keys are only deleted now and then, not on every put.
+    assert store.conn.execute('SELECT COUNT(*) FROM published').fetchone()[0] == 2
+    store.close()
+
+    store = idempotency.SQLiteIdempotencyStore(db_path)
+    assert store.conn.execute('SELECT COUNT(*) FROM published').fetchone()[0] == 0
+
+class UnprocessedClient:
+    """ Leaves the requests unprocessed for the first `unprocessed` calls. """
+    def __init__(self, unprocessed):
+        self.unprocessed = unprocessed
+        self.calls = 0
+
+    def batch_write_item(self, RequestItems):
+        #pylint: disable=invalid-name
+        self.calls += 1
+        if self.calls <= self.unprocessed:
+            return {'UnprocessedItems': RequestItems}
+        return {'UnprocessedItems': {}}
+
+    def batch_get_item(self, RequestItems):
+        #pylint: disable=invalid-name
+        self.calls += 1
+        if self.calls <= self.unprocessed:
+            return {'Responses': {}, 'UnprocessedKeys': RequestItems}
+        return {'Responses': {'Idempotency': [
+            {'pk': key['pk'], 'expires': {'N': str(int(time.time()) + 60)}}
+            for key in RequestItems['Idempotency']['Keys']
+        ]}}
+
+def test_dynamodb_store_unprocessed(monkeypatch):
+    monkeypatch.setattr(idempotency, 'DYNAMODB_BATCH_BACKOFF', 0.001)
+    ddb_clnt = UnprocessedClient(unprocessed=2)
+    store = idempotency.DynamoDBIdempotencyStore('Idempotency', ddb_clnt=ddb_clnt)
+    store.put(['a', 'b'])
+    assert ddb_clnt.calls == 3
+
+    ddb_clnt = UnprocessedClient(unprocessed=2)
+    store = idempotency.DynamoDBIdempotencyStore('Idempotency', ddb_clnt=ddb_clnt)
+    assert store.published(['a', 'b']) == {'a', 'b'}
+    assert ddb_clnt.calls == 3
+
+def test_dynamodb_store_unprocessed_attempts(monkeypatch, caplog):
+    monkeypatch.setattr(idempotency, 'DYNAMODB_BATCH_BACKOFF', 0.001)
+    ddb_clnt = UnprocessedClient(unprocessed=100)
+    store = idempotency.DynamoDBIdempotencyStore('Idempotency', ddb_clnt=ddb_clnt)
+    with pytest.raises(RuntimeError):
+        store.put(['a'])
+    assert ddb_clnt.calls == idempotency.DYNAMODB_BATCH_ATTEMPTS
+
+    # The cache logs the error, and publishes the records.
+    records = SyntheticRecords().batch(2)
+    cache = idempotency.IdempotencyCache(store=store)
+    assert cache.unpublished(records) == records
+    assert 'Unable to check the idempotency store' in caplog.text
+
+def test_store_errors(caplog):
+    class BrokenStore:
+        def published(self, keys):
+            raise RuntimeError('unavailable')
+
+        def put(self, keys):
+            raise RuntimeError('unavailable')
+
+    records = SyntheticRecords().batch(3)
+    cache = idempotency.IdempotencyCache(store=BrokenStore())
+    cache.put(records[:1])
+    assert cache.unpublished(records) == records[1:]
+    assert 'Unable to update the idempotency store' in caplog.text
+    assert 'Unable to check the idempotency store' in caplog.text
+
+def test_open_idempotency_store(tmp_path):
+    assert idempotency.open_idempotency_store('memory') is None
+    store = idempotency.open_idempotency_store(f"sqlite:{tmp_path}/idempotency.db")
+    assert isinstance(store, idempotency.SQLiteIdempotencyStore)
+    store = idempotency.open_idempotency_store('dynamodb:Idempotency')
+    assert isinstance(store, idempotency.DynamoDBIdempotencyStore)
+    assert store.table_name == 'Idempotency'
+    with pytest.raises(ValueError):
+        idempotency.open_idempotency_store('redis:localhost')
+
+def test_get_idempotency_cache_off(monkeypatch):
+    monkeypatch.setattr(idempotency, 'IDEMPOTENCY', 'off')
+    assert idempotency.get_idempotency_cache() is None
+
+def test_put_records_retry(memory_cache):
+    records = SyntheticRecords().batch(12)
+    failed = seqs(records[3:5])
+
+    events_clnt = FailingEventsClient(fail=failed)
+    init.put_records(records, _events_clnt=events_clnt)
+    assert events_clnt.sequence_numbers == seqs(records)
+
+    # The retry only publishes the records that failed.
+    events_clnt = FailingEventsClient()
+    metrics = Metrics('Test')
+    init.put_records(records, _events_clnt=events_clnt, metrics=metrics)
+    assert events_clnt.sequence_numbers == failed
+    assert metrics.values['RecordsSkipped'] == 10
+    assert metrics.values['EventsOut'] == 2
+
+    events_clnt = FailingEventsClient()
+    init.put_records(records, _events_clnt=events_clnt)
+    assert not events_clnt.sequence_numbers
+
+def test_put_records_retry_lanes(memory_cache):
+    records = SyntheticRecords().batch(40)
+    failed = seqs(records[5:6] + records[30:32])
+
+    init.put_records(records, _events_clnt=FailingEventsClient(fail=failed), lanes=4)
+    events_clnt = FailingEventsClient()
+    init.put_records(records, _events_clnt=events_clnt, lanes=4)
+    assert sorted(events_clnt.sequence_numbers) == sorted(failed)
+
+def test_put_records_raises(memory_cache):
+    records = SyntheticRecords().batch(25)
+
+    class RaisingEventsClient(FailingEventsClient):
+        def put_events(self, Entries):
+            #pylint: disable=invalid-name
+            if self.sequence_numbers:
+                raise RuntimeError('failed')
+            return super().put_events(Entries)
+
+    events_clnt = RaisingEventsClient()
+    failed = init.put_records(records, _events_clnt=events_clnt, lanes=1)
+    assert events_clnt.sequence_numbers == seqs(records[:10])
+    assert failed == seqs(records[10:])
+
+    # The calls that were put before the error aren't put again.
+    events_clnt = FailingEventsClient()
+    init.put_records(records, _events_clnt=events_clnt, lanes=1)
+    assert events_clnt.sequence_numbers == seqs(records[10:])
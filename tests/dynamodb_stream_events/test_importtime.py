@@ -0,0 +1,43 @@
+import os
+import re
+import subprocess
+import sys
+
+import pytest
+
+# Cumulative import time budget for the package, in microseconds. The package
+# itself is ~15ms; importing boto3 alone is well over 100ms.
+IMPORTTIME_BUDGET_US = int(os.environ.get('IMPORTTIME_BUDGET_US', '100000'))
+
+IMPORTTIME_RE = re.compile(r'^import time:\s+(?P<self>\d+)\s+\|\s+(?P<cumulative>\d+)\s+\|(?P<name>.+)$')
+
+def run_importtime(code):
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(p for p in sys.path if p)
+    env.pop('PYTHONDONTWRITEBYTECODE', None)
+    # Run twice so the measured run uses cached bytecode, like the package.
+    for _ in range(2):
+        proc = subprocess.run(
+            [sys.executable, '-X', 'importtime', '-c', code],
+            env=env,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            text=True,
+            check=True,
+        )
+
+    times = {}
+    for line in proc.stderr.splitlines():
+        if match := IMPORTTIME_RE.match(line):
+            times[match.group('name').strip()] = int(match.group('cumulative'))
+    return times
+
+def test_import_budget():
+    times = run_importtime('import dynamodb_stream_events')
+    assert 'dynamodb_stream_events' in times
+    assert times['dynamodb_stream_events'] < IMPORTTIME_BUDGET_US
+
+@pytest.mark.parametrize("module", ['boto3', 'botocore'])
+def test_import_no_boto3(module):
+    times = run_importtime('import dynamodb_stream_events')
+    assert module not in times
@@ -1,13 +1,21 @@
 from contextlib import contextmanager
 import json
+import logging
+import threading
+import time
 
 import boto3
+from botocore.exceptions import ClientError
 from freezegun import freeze_time
 from moto import mock_events, mock_logs
 from moto.core.models import DEFAULT_ACCOUNT_ID
 import pytest
 
 import dynamodb_stream_events as init
+from dynamodb_stream_events import logs, publish, spool
+from dynamodb_stream_events.metrics import Metrics
+from eventbridge_standin import EventBridgeStandin
+from synthetic import RecordShape, SyntheticRecords
 
 @contextmanager
 def setup_events(event_bus_name='default'):
@@ -500,3 +508,339 @@ def test_event_detailtype_fmt():
 
     finally:
         init.EVENT_DETAILTYPE_FMT = event_detailtype_fmt_orig
+
+@freeze_time('2020-07-15T00:00:00Z')
+def test_put_records_chunks():
+    records = [FIXTURES[2]] * 25
+    metrics = Metrics("Test")
+    with setup_events() as (events_clnt, logs_clnt):
+        init.put_records(records, _events_clnt=events_clnt, metrics=metrics)
+
+        events = get_events(logs_clnt)
+        assert len(events) == 25
+
+    assert metrics.values['RecordsIn'] == 25
+    assert metrics.values['EventsOut'] == 25
+    assert metrics.values['FailedEntries'] == 0
+    assert metrics.values['PutEventsCalls'] == 3
+    assert metrics.values['BytesPublished'] > 0
+    for stage in ('Deserialize', 'Diff', 'Encode', 'Chunk', 'PutEvents'):
+        assert metrics.values[f"{stage}Time"] >= 0
+
+@contextmanager
+def setup_standin(**kwargs):
+    with EventBridgeStandin(**kwargs) as standin:
+        events_clnt = boto3.client(
+            'events',
+            endpoint_url=standin.endpoint_url,
+            aws_access_key_id='testing',
+            aws_secret_access_key='testing',
+        )
+        yield standin, events_clnt
+
+def test_put_records_standin_limits():
+    """ The stand-in rejects requests over the real limits; none should be. """
+    records = SyntheticRecords(RecordShape(width=20, types=('S',), string_size=1024)).batch(60)
+    with setup_standin() as (standin, events_clnt):
+        init.put_records(records, _events_clnt=events_clnt)
+
+    assert standin.stats['invalid'] == 0
+    assert standin.stats['entries'] == 60
+    assert standin.stats['requests'] > 6
+
+def test_put_records_standin_failures(caplog):
+    records = SyntheticRecords().batch(20)
+    with setup_standin(failure_rate=1.0) as (standin, events_clnt):
+        metrics = Metrics('Test')
+        init.put_records(records, _events_clnt=events_clnt, metrics=metrics)
+
+    assert standin.stats['failed_entries'] == 20
+    assert metrics.values['FailedEntries'] == 20
+    assert metrics.values['EventsOut'] == 0
+    assert 'Injected failure (InternalFailure)' in caplog.text
+
+def test_put_records_summary(caplog, monkeypatch):
+    records = SyntheticRecords().batch(25, event_name='INSERT')
+    monkeypatch.setattr(logs, 'DEBUG_SAMPLE_RATE', 0.0)
+    with setup_standin(failure_rate=0.0) as (_, events_clnt):
+        with caplog.at_level(logging.DEBUG, logger=init.__name__):
+            init.put_records(records, _events_clnt=events_clnt)
+
+    messages = [r.getMessage() for r in caplog.records if r.name == init.__name__]
+    summaries = [m for m in messages if m.startswith('Batch: ')]
+    assert len(summaries) == 1
+    summary = json.loads(summaries[0][len('Batch: '):])
+    assert summary['records'] == 25
+    assert summary['events'] == 25
+    assert summary['failed'] == 0
+    assert summary['calls'] == 3
+    assert summary['bytes'] > 0
+    assert summary['eventNames'] == {'INSERT': 25}
+    assert summary['firstSequenceNumber'] == records[0]['dynamodb']['SequenceNumber']
+    assert summary['lastSequenceNumber'] == records[-1]['dynamodb']['SequenceNumber']
+
+    # The records weren't sampled for the debug logs.
+    assert not [m for m in messages if m.startswith('[Record #')]
+
+class RecordingEventsClient:
+    """ Keeps the details put, and how many calls overlapped. """
+    def __init__(self, delay=0.01):
+        self.delay = delay
+        self.lock = threading.Lock()
+        self.details = []
+        self.active = 0
+        self.max_active = 0
+
+    def put_events(self, Entries):
+        #pylint: disable=invalid-name
+        with self.lock:
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+        time.sleep(self.delay)
+        with self.lock:
+            self.active -= 1
+            self.details.extend(json.loads(e['Detail']) for e in Entries)
+        return {
+            'FailedEntryCount': 0,
+            'Entries': [{'EventId': str(idx)} for idx in range(len(Entries))],
+        }
+
+def test_put_records_lanes(caplog):
+    records = SyntheticRecords().batch(100)
+    for idx, record in enumerate(records):
+        record['dynamodb']['Keys'] = dict(pk=dict(S=f"item-{idx % 7}"))
+
+    events_clnt = RecordingEventsClient()
+    metrics = Metrics('Test')
+    with caplog.at_level(logging.INFO, logger=init.__name__):
+        init.put_records(records, _events_clnt=events_clnt, metrics=metrics, lanes=4)
+
+    assert len(events_clnt.details) == 100
+    assert events_clnt.max_active > 1
+    # The events for each item are in sequence order.
+    by_item = {}
+    for detail in events_clnt.details:
+        by_item.setdefault(detail['Keys']['pk'], []).append(int(detail['SequenceNumber']))
+    assert len(by_item) == 7
+    for seqs in by_item.values():
+        assert seqs == sorted(seqs)
+
+    assert metrics.values['RecordsIn'] == 100
+    assert metrics.values['EventsOut'] == 100
+    assert metrics.values['SequenceNumberGap'] == \
+        int(records[-1]['dynamodb']['SequenceNumber']) - int(records[0]['dynamodb']['SequenceNumber'])
+    assert len(metrics.observations['StreamLag']) == 100
+
+    summaries = [r.getMessage() for r in caplog.records if r.getMessage().startswith('Batch: ')]
+    assert len(summaries) == 1
+    summary = json.loads(summaries[0][len('Batch: '):])
+    assert summary['records'] == 100
+    assert summary['events'] == 100
+    assert 1 < summary['lanes'] <= 4
+
+class ValidatingEventsClient(RecordingEventsClient):
+    """ Rejects the whole call if an entry has `poison` in its detail. """
+    def __init__(self):
+        super().__init__(delay=0)
+        self.calls = 0
+
+    def put_events(self, Entries):
+        #pylint: disable=invalid-name
+        self.calls += 1
+        if any('"poison"' in e['Detail'] for e in Entries):
+            raise ClientError(
+                {'Error': {'Code': 'ValidationException', 'Message': 'Invalid detail'}},
+                'PutEvents'
+            )
+        return super().put_events(Entries)
+
+def poison_records(count, poison_idxs):
+    records = SyntheticRecords().batch(count)
+    for idx in poison_idxs:
+        # Not a DynamoDB attribute value, so deserializing it raises.
+        records[idx]['dynamodb']['NewImage'] = {'attr0': {'BAD': 'value'}}
+    return records
+
+@pytest.mark.parametrize('lanes', [1, 4])
+def test_put_records_poison(monkeypatch, tmp_path, lanes):
+    monkeypatch.setattr(spool, 'QUARANTINE_SPOOL', str(tmp_path))
+    records = poison_records(20, [5, 12])
+    events_clnt = RecordingEventsClient(delay=0)
+    metrics = Metrics('Test')
+    failed = init.put_records(records, _events_clnt=events_clnt, metrics=metrics, lanes=lanes)
+
+    assert failed == []
+    assert len(events_clnt.details) == 18
+    assert metrics.values['PoisonRecords'] == 2
+    assert metrics.values['RecordsQuarantined'] == 2
+    # Making the events again after a poison record keeps the batch's gap.
+    assert metrics.values['SequenceNumberGap'] == \
+        int(records[-1]['dynamodb']['SequenceNumber']) - int(records[0]['dynamodb']['SequenceNumber'])
+
+    quarantine = spool.get_quarantine_spool()
+    items = spool.decode_items(quarantine.read_data(quarantine.names()[0]))
+    assert [item['Record'] for item in items] == [records[5], records[12]]
+    assert items[0]['Entry'] is None
+    assert items[0]['ErrorCode'] == 'TypeError'
+
+def test_put_records_poison_no_quarantine(monkeypatch):
+    monkeypatch.setattr(spool, 'QUARANTINE_SPOOL', None)
+    records = poison_records(10, [3, 7])
+    events_clnt = RecordingEventsClient(delay=0)
+    failed = init.put_records(records, _events_clnt=events_clnt)
+
+    assert len(events_clnt.details) == 8
+    assert failed == [records[idx]['dynamodb']['SequenceNumber'] for idx in (3, 7)]
+
+def test_put_records_bisect(monkeypatch, tmp_path):
+    monkeypatch.setattr(spool, 'QUARANTINE_SPOOL', str(tmp_path))
+    records = SyntheticRecords().batch(10)
+    records[6]['dynamodb']['NewImage']['attr0'] = {'S': 'poison'}
+    events_clnt = ValidatingEventsClient()
+    metrics = Metrics('Test')
+    failed = init.put_records(records, _events_clnt=events_clnt, metrics=metrics)
+
+    assert failed == []
+    assert len(events_clnt.details) == 9
+    assert metrics.values['Bisections'] == 3
+    assert metrics.values['FailedEntries'] == 1
+
+    quarantine = spool.get_quarantine_spool()
+    items = spool.decode_items(quarantine.read_data(quarantine.names()[0]))
+    assert len(items) == 1
+    assert items[0]['Record'] == records[6]
+    assert items[0]['ErrorCode'] == 'ValidationException'
+    assert json.loads(items[0]['Entry']['Detail'])['SequenceNumber'] == \
+        records[6]['dynamodb']['SequenceNumber']
+
+def test_handler_batch_item_failures(monkeypatch):
+    monkeypatch.setattr(spool, 'QUARANTINE_SPOOL', None)
+    monkeypatch.setattr(init, 'get_events_clnt', lambda: RecordingEventsClient(delay=0))
+    records = poison_records(5, [2])
+
+    res = init.handler({'Records': records}, None)
+    assert res == {
+        'batchItemFailures': [{'itemIdentifier': records[2]['dynamodb']['SequenceNumber']}],
+    }
+    assert init.handler({'Records': SyntheticRecords().batch(3)}, None) == {'batchItemFailures': []}
+
+class LambdaContext:
+    def __init__(self, remaining_ms):
+        self.remaining_ms = remaining_ms
+
+    def get_remaining_time_in_millis(self):
+        return self.remaining_ms
+
+def test_get_deadline():
+    now = time.monotonic()
+    deadline = init.get_deadline(LambdaContext(10000), margin_ms=1000)
+    assert now + 8.9 < deadline < time.monotonic() + 9.1
+
+    assert init.get_deadline(None) is None
+    assert init.get_deadline(LambdaContext(10000), margin_ms=0) is None
+
+def test_put_records_lanes_error():
+    records = SyntheticRecords().batch(40)
+
+    class FailingEventsClient(RecordingEventsClient):
+        def put_events(self, Entries):
+            #pylint: disable=invalid-name
+            if any(json.loads(e['Detail'])['SequenceNumber'] == first for e in Entries):
+                raise RuntimeError('failed')
+            return super().put_events(Entries)
+
+    first = records[0]['dynamodb']['SequenceNumber']
+    events_clnt = FailingEventsClient(delay=0.02)
+    failed = init.put_records(records, _events_clnt=events_clnt, lanes=4)
+
+    # The failed lane's records are returned, and the other lanes finished.
+    lane = next(lane for lane in init.partition_lanes(records, 4) if 0 in lane)
+    assert failed == [records[idx]['dynamodb']['SequenceNumber'] for idx in lane]
+    assert events_clnt.active == 0
+    assert len(events_clnt.details) == len(records) - len(lane)
+
+def test_put_records_deadline(monkeypatch, tmp_path):
+    monkeypatch.setattr(spool, 'FAILED_SPOOL', str(tmp_path))
+    records = SyntheticRecords().batch(25)
+    events_clnt = RecordingEventsClient(delay=0)
+    metrics = Metrics('Test')
+    failed = init.put_records(
+        records,
+        _events_clnt=events_clnt,
+        metrics=metrics,
+        deadline=time.monotonic() - 1,
+    )
+
+    # The first call is always put; the rest are left for the retry.
+    assert [d['SequenceNumber'] for d in events_clnt.details] == \
+        [r['dynamodb']['SequenceNumber'] for r in records[:10]]
+    assert failed == [r['dynamodb']['SequenceNumber'] for r in records[10:]]
+    assert metrics.values['DeferredRecords'] == 15
+    assert metrics.values['PutEventsCalls'] == 1
+    assert not spool.get_spool().names()
+
+def test_put_records_deadline_not_reached():
+    records = SyntheticRecords().batch(25)
+    events_clnt = RecordingEventsClient(delay=0)
+    failed = init.put_records(records, _events_clnt=events_clnt, deadline=time.monotonic() + 60)
+
+    assert failed == []
+    assert len(events_clnt.details) == 25
+
+def test_put_records_deadline_call_time(monkeypatch):
+    monkeypatch.setattr(publish, 'PUT_EVENTS_CALL_TIME', 2.0)
+    records = SyntheticRecords().batch(25)
+    events_clnt = RecordingEventsClient(delay=0)
+    # The deadline hasn't passed, but a call started now might not end by it.
+    failed = init.put_records(records, _events_clnt=events_clnt, deadline=time.monotonic() + 1)
+
+    assert len(events_clnt.details) == 10
+    assert failed == [r['dynamodb']['SequenceNumber'] for r in records[10:]]
+
+def test_put_records_deadline_lanes():
+    records = SyntheticRecords().batch(100)
+    for idx, record in enumerate(records):
+        record['dynamodb']['Keys'] = dict(pk=dict(S=f"item-{idx % 7}"))
+    events_clnt = RecordingEventsClient(delay=0)
+    failed = init.put_records(
+        records,
+        _events_clnt=events_clnt,
+        lanes=4,
+        deadline=time.monotonic() - 1,
+    )
+
+    # Each lane puts its first call, and stops at the record after it.
+    lane_indexes = init.partition_lanes(records, 4)
+    put = sorted(idx for indexes in lane_indexes for idx in indexes[:10])
+    assert sorted(d['SequenceNumber'] for d in events_clnt.details) == \
+        sorted(records[idx]['dynamodb']['SequenceNumber'] for idx in put)
+    assert failed == [
+        r['dynamodb']['SequenceNumber']
+        for idx, r in enumerate(records)
+        if idx not in put
+    ]
+
+def test_put_records_deadline_poison(monkeypatch, tmp_path):
+    monkeypatch.setattr(spool, 'QUARANTINE_SPOOL', str(tmp_path))
+    records = poison_records(25, [3, 15])
+    events_clnt = RecordingEventsClient(delay=0)
+    failed = init.put_records(records, _events_clnt=events_clnt, deadline=time.monotonic() - 1)
+
+    # The poison record after the stop is left for the retry to quarantine.
+    assert len(events_clnt.details) == 10
+    assert failed == [r['dynamodb']['SequenceNumber'] for r in records[11:]]
+    quarantine = spool.get_quarantine_spool()
+    items = spool.decode_items(quarantine.read_data(quarantine.names()[0]))
+    assert [item['Record'] for item in items] == [records[3]]
+
+def test_handler_deadline(monkeypatch):
+    monkeypatch.setattr(init, 'get_events_clnt', lambda: RecordingEventsClient(delay=0))
+    records = SyntheticRecords().batch(15)
+
+    res = init.handler({'Records': records}, LambdaContext(500))
+    assert res == {
+        'batchItemFailures': [
+            {'itemIdentifier': r['dynamodb']['SequenceNumber']} for r in records[10:]
+        ],
+    }
+    assert init.handler({'Records': records}, LambdaContext(60000)) == {'batchItemFailures': []}
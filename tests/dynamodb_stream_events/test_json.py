@@ -7,7 +7,7 @@ from boto3.dynamodb.types import Binary
 import pytest
 import pytz
 
-from dynamodb_stream_events import json
+from dynamodb_stream_events import json, types
 
 LOCAL_TZ = pytz.timezone('America/Chicago')
 
@@ -32,6 +32,7 @@ def test_dumps_stdtypes(value):
     pytest.param(bytearray([1, 2, 3]), '"AQID"', id="bytearray"),
     pytest.param(array('i', [1, 2, 3]), '"AQAAAAIAAAADAAAA"', id="array"),
     pytest.param(Binary(b'\x01\x02\x03'), '"AQID"', id="Binary"),
+    pytest.param(types.Binary(b'\x01\x02\x03'), '"AQID"', id="types.Binary"),
     pytest.param(date(2020, 7, 15), '"2020-07-15"', id="date"),
     pytest.param(time(15, 1, 2), '"15:01:02"', id="time"),
     pytest.param(time(15, 1, 2, 123), '"15:01:02.000123"', id="time-ms"),
@@ -45,6 +46,7 @@ def test_dumps_stdtypes(value):
     pytest.param(set([3, 2, 1]), '[1, 2, 3]', id="set1"),
     pytest.param(frozenset([1, 2, 3]), '[1, 2, 3]', id="frozenset0"),
     pytest.param(frozenset([3, 2, 1]), '[1, 2, 3]', id="frozenset1"),
+    pytest.param(set([types.Binary(b'\x04'), types.Binary(b'\x01')]), '["AQ==", "BA=="]', id="set-Binary"),
 ])
 def test_dumps(value, expected):
     res = json.dumps(value)
@@ -0,0 +1,187 @@
+from base64 import b64encode
+from hashlib import md5
+import json
+
+import pytest
+
+import dynamodb_stream_events as init
+from dynamodb_stream_events import kinesis, spool
+from dynamodb_stream_events.metrics import Metrics
+from synthetic import SyntheticRecords
+
+KINESIS_STREAM_ARN = 'arn:aws:kinesis:us-east-2:123456789012:stream/SyntheticStream'
+
+class EntriesClient:
+    def __init__(self):
+        self.entries = []
+
+    def put_events(self, Entries):
+        #pylint: disable=invalid-name
+        self.entries.extend(Entries)
+        return {
+            'FailedEntryCount': 0,
+            'Entries': [{'EventId': str(idx)} for idx in range(len(Entries))],
+        }
+
+def to_change(record):
+    """ Make a DynamoDB Streams record into a Kinesis Data Streams for DynamoDB one. """
+    record_dynamodb = {
+        k: v
+        for k, v in record['dynamodb'].items()
+        if k not in ('SequenceNumber', 'StreamViewType')
+    }
+    record_dynamodb['ApproximateCreationDateTime'] = \
+        int(record_dynamodb['ApproximateCreationDateTime'] * 1000)
+    return {
+        'awsRegion': 'us-east-2',
+        'eventID': record['eventID'],
+        'eventName': record['eventName'],
+        'userIdentity': None,
+        'recordFormat': 'application/json',
+        'tableName': 'SyntheticTable',
+        'dynamodb': record_dynamodb,
+        'eventSource': 'aws:dynamodb',
+    }
+
+def _varint(value):
+    data = bytearray()
+    while True:
+        byte = value & 0x7f
+        value >>= 7
+        if value:
+            data.append(byte | 0x80)
+        else:
+            data.append(byte)
+            return bytes(data)
+
+def _field(number, value):
+    return _varint(number << 3 | 2) + _varint(len(value)) + value
+
+def kpl_aggregate(payloads):
+    message = _field(1, b'pk')
+    for payload in payloads:
+        message += _field(3, _varint(1 << 3) + _varint(0) + _field(3, payload))
+    return kinesis.KPL_MAGIC + message + md5(message).digest()
+
+def kinesis_record(data, seq):
+    return {
+        'kinesis': {
+            'kinesisSchemaVersion': '1.0',
+            'partitionKey': 'pk',
+            'sequenceNumber': str(seq),
+            'data': b64encode(data).decode('ascii'),
+            'approximateArrivalTimestamp': 1594843200.0,
+        },
+        'eventSource': 'aws:kinesis',
+        'eventVersion': '1.0',
+        'eventID': f"shardId-000000000000:{seq}",
+        'eventName': 'aws:kinesis:record',
+        'eventSourceARN': KINESIS_STREAM_ARN,
+        'awsRegion': 'us-east-2',
+    }
+
+def kinesis_records(records, start=1000):
+    return [
+        kinesis_record(json.dumps(to_change(record)).encode('utf-8'), start + idx)
+        for idx, record in enumerate(records)
+    ]
+
+def test_deaggregate():
+    payloads = [b'{"a": 1}', b'x' * 300, b'']
+    assert kinesis.deaggregate(kpl_aggregate(payloads)) == payloads
+    assert kinesis.deaggregate(b'{"a": 1}') == [b'{"a": 1}']
+
+    # A bad checksum isn't an aggregated record.
+    data = kpl_aggregate(payloads)[:-1] + b'\x00'
+    assert kinesis.deaggregate(data) == [data]
+
+def test_from_kinesis():
+    records = SyntheticRecords().batch(5)
+    stream_records, poison = kinesis.from_kinesis(kinesis_records(records))
+
+    assert not poison
+    assert len(stream_records) == 5
+    record = stream_records[0]
+    assert record['eventSourceARN'] == \
+        'arn:aws:dynamodb:us-east-2:123456789012:table/SyntheticTable'
+    assert record['dynamodb']['SequenceNumber'] == '1000'
+    assert record['dynamodb']['ApproximateCreationDateTime'] == \
+        pytest.approx(records[0]['dynamodb']['ApproximateCreationDateTime'], abs=0.001)
+    assert record['dynamodb']['NewImage'] == records[0]['dynamodb']['NewImage']
+    assert 'userIdentity' not in record and 'tableName' not in record
+
+def test_from_kinesis_aggregated():
+    records = SyntheticRecords().batch(6)
+    payloads = [json.dumps(to_change(r)).encode('utf-8') for r in records]
+    event_records = [
+        kinesis_record(kpl_aggregate(payloads[:4]), 1000),
+        kinesis_record(payloads[4], 1001),
+        kinesis_record(kpl_aggregate(payloads[5:]), 1002),
+    ]
+    stream_records, poison = kinesis.from_kinesis(event_records)
+
+    assert not poison
+    assert [r['eventID'] for r in stream_records] == [r['eventID'] for r in records]
+    assert [r['dynamodb']['SequenceNumber'] for r in stream_records] == \
+        ['1000'] * 4 + ['1001', '1002']
+
+def test_from_kinesis_poison():
+    records = kinesis_records(SyntheticRecords().batch(4))
+    records[1]['kinesis']['data'] = b64encode(b'{"not": "json"').decode('ascii')
+    records[2]['kinesis']['data'] = b64encode(b'{"no": "dynamodb"}').decode('ascii')
+    stream_records, poison = kinesis.from_kinesis(records)
+
+    assert len(stream_records) == 2
+    assert [(f.index, f.error_code) for f in poison] == [(1, 'JSONDecodeError'), (2, 'KeyError')]
+
+def test_from_kinesis_sequence_number():
+    records = SyntheticRecords().batch(1)
+    change = to_change(records[0])
+    change['dynamodb']['SequenceNumber'] = '42'
+    stream_records, _ = kinesis.from_kinesis([
+        kinesis_record(json.dumps(change).encode('utf-8'), 1000)
+    ])
+    assert stream_records[0]['dynamodb']['SequenceNumber'] == '1000'
+
+def test_put_kinesis_records_order(monkeypatch):
+    monkeypatch.setattr(spool, 'QUARANTINE_SPOOL', None)
+    monkeypatch.setattr(spool, 'FAILED_SPOOL', None)
+    records = kinesis_records(SyntheticRecords().batch(5))
+    records[3]['kinesis']['data'] = b64encode(b'garbage').decode('ascii')
+
+    class FailingClient(EntriesClient):
+        """ Fails the second entry, of the second record. """
+        def put_events(self, Entries):
+            #pylint: disable=invalid-name
+            res = super().put_events(Entries)
+            res['Entries'][1] = {'ErrorCode': 'InternalFailure', 'ErrorMessage': 'Failed'}
+            return res
+
+    # The publish failure and the poison record are in batch order.
+    failed = init.put_kinesis_records(records, _events_clnt=FailingClient())
+    assert failed == ['1001', '1003']
+
+def test_put_kinesis_records(monkeypatch, tmp_path):
+    monkeypatch.setattr(spool, 'QUARANTINE_SPOOL', str(tmp_path))
+    records = kinesis_records(SyntheticRecords().batch(10))
+    records[3]['kinesis']['data'] = b64encode(b'garbage').decode('ascii')
+    events_clnt = EntriesClient()
+    metrics = Metrics('Test')
+    failed = init.put_kinesis_records(records, _events_clnt=events_clnt, metrics=metrics)
+
+    assert failed == []
+    assert len(events_clnt.entries) == 9
+    assert events_clnt.entries[0]['Resources'] == \
+        ['arn:aws:dynamodb:us-east-2:123456789012:table/SyntheticTable']
+    assert metrics.values['PoisonRecords'] == 1
+    assert metrics.values['RecordsQuarantined'] == 1
+
+def test_handler_kinesis(monkeypatch):
+    monkeypatch.setattr(spool, 'QUARANTINE_SPOOL', None)
+    monkeypatch.setattr(init, 'get_events_clnt', EntriesClient)
+    records = kinesis_records(SyntheticRecords().batch(5))
+    records[2]['kinesis']['data'] = b64encode(b'garbage').decode('ascii')
+
+    assert init.handler({'Records': records}, None) == {
+        'batchItemFailures': [{'itemIdentifier': '1002'}],
+    }
@@ -0,0 +1,27 @@
+from dynamodb_stream_events import lanes
+from synthetic import SyntheticRecords
+
+def test_record_key():
+    record = dict(dynamodb=dict(Keys=dict(sk=dict(N='1'), pk=dict(S='a'))))
+    assert lanes.record_key(record) == (('pk', (('S', 'a'),)), ('sk', (('N', '1'),)))
+    assert lanes.record_key(dict(dynamodb={})) == ()
+
+def test_partition_lanes():
+    records = SyntheticRecords().batch(200)
+    for idx, record in enumerate(records):
+        record['dynamodb']['Keys'] = dict(pk=dict(S=f"item-{idx % 20}"))
+
+    lane_indexes = lanes.partition_lanes(records, 4)
+    assert 1 < len(lane_indexes) <= 4
+    assert sorted(idx for indexes in lane_indexes for idx in indexes) == list(range(200))
+    for indexes in lane_indexes:
+        # In batch order, and each item only in one lane.
+        assert indexes == sorted(indexes)
+        assert {idx % 20 for idx in indexes}.isdisjoint(
+            {idx % 20 for other in lane_indexes if other is not indexes for idx in other}
+        )
+
+def test_get_lane_executor():
+    executor = lanes.get_lane_executor(3)
+    assert lanes.get_lane_executor(3) is executor
+    assert executor.submit(lambda: 42).result() == 42
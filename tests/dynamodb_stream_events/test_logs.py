@@ -0,0 +1,25 @@
+import logging
+
+import pytest
+
+from dynamodb_stream_events import logs
+
+@pytest.fixture
+def logger():
+    logger = logging.getLogger('test_logs')
+    logger.setLevel(logging.DEBUG)
+    return logger
+
+def test_debug_records_all(logger):
+    assert list(logs.debug_records(logger, 5, rate=1.0)) == [0, 1, 2, 3, 4]
+
+def test_debug_records_none(logger):
+    assert not logs.debug_records(logger, 5, rate=0.0)
+
+    logger.setLevel(logging.INFO)
+    assert not logs.debug_records(logger, 5, rate=1.0)
+
+def test_debug_records_sampled(logger):
+    sampled = logs.debug_records(logger, 10000, rate=0.1)
+    assert sampled <= set(range(10000))
+    assert 500 < len(sampled) < 1500
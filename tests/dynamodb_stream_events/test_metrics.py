@@ -0,0 +1,127 @@
+import io
+import json
+import time
+
+import pytest
+
+from dynamodb_stream_events import metrics
+
+def test_metrics_add():
+    m = metrics.Metrics('Test', dict(FunctionName='foo'))
+    m.add('RecordsIn', 2)
+    m.add('RecordsIn', 3)
+    m.put('Other', 7, metrics.UNIT_BYTES)
+    m.put('Other', 8, metrics.UNIT_BYTES)
+    assert m.values == dict(RecordsIn=5, Other=8)
+    assert m.units == dict(RecordsIn=metrics.UNIT_COUNT, Other=metrics.UNIT_BYTES)
+
+def test_metrics_timer():
+    m = metrics.Metrics('Test')
+    with m.timer(metrics.STAGE_DIFF):
+        time.sleep(0.01)
+    m.add_time(metrics.STAGE_DIFF, time.perf_counter())
+    assert m.values['DiffTime'] >= 10
+    assert m.units['DiffTime'] == metrics.UNIT_MILLISECONDS
+
+def test_metrics_to_emf():
+    m = metrics.Metrics('Test', dict(FunctionName='foo'))
+    m.add('RecordsIn', 2)
+    m.add('DeserializeTime', 1.23456, metrics.UNIT_MILLISECONDS)
+    assert m.to_emf(timestamp=1594771200.5) == {
+        '_aws': {
+            'Timestamp': 1594771200500,
+            'CloudWatchMetrics': [{
+                'Namespace': 'Test',
+                'Dimensions': [['FunctionName']],
+                'Metrics': [
+                    {'Name': 'DeserializeTime', 'Unit': 'Milliseconds'},
+                    {'Name': 'RecordsIn', 'Unit': 'Count'},
+                ],
+            }],
+        },
+        'FunctionName': 'foo',
+        'DeserializeTime': 1.235,
+        'RecordsIn': 2,
+    }
+
+def test_metrics_emit():
+    m = metrics.Metrics('Test')
+    stream = io.StringIO()
+    m.emit(stream)
+    assert stream.getvalue() == ''
+
+    m.add('RecordsIn', 2)
+    m.emit(stream)
+    lines = stream.getvalue().splitlines()
+    assert len(lines) == 1
+    assert json.loads(lines[0])['RecordsIn'] == 2
+
+def test_null_metrics():
+    m = metrics.NULL_METRICS
+    assert not m
+    with m.timer(metrics.STAGE_DIFF):
+        pass
+    m.add('RecordsIn', 1)
+    m.put('RecordsIn', 1)
+    m.add_time(metrics.STAGE_DIFF, time.perf_counter())
+
+    stream = io.StringIO()
+    m.emit(stream)
+    assert stream.getvalue() == ''
+
+@pytest.mark.parametrize("enabled", [True, False])
+def test_new_metrics(monkeypatch, enabled):
+    monkeypatch.setattr(metrics, 'METRICS_ENABLED', enabled)
+    monkeypatch.setenv('AWS_LAMBDA_FUNCTION_NAME', 'foo')
+    m = metrics.new_metrics()
+    if enabled:
+        assert isinstance(m, metrics.Metrics)
+        assert m.dimensions == dict(FunctionName='foo')
+    else:
+        assert m is metrics.NULL_METRICS
+
+@pytest.mark.parametrize("pct,expected", [
+    (0, 1),
+    (50, 50),
+    (99, 99),
+    (100, 100),
+])
+def test_percentile(pct, expected):
+    assert metrics.percentile(list(range(1, 101)), pct) == expected
+
+def test_percentile_single():
+    assert metrics.percentile([7], 50) == 7
+    assert metrics.percentile([7], 99) == 7
+
+def test_metrics_observe():
+    m = metrics.Metrics('Test')
+    assert m.summary('StreamLag') == {}
+    for value in (30, 10, 20):
+        m.observe('StreamLag', value, metrics.UNIT_MILLISECONDS)
+    assert m.summary('StreamLag') == dict(
+        StreamLagMin=10,
+        StreamLagP50=20,
+        StreamLagP99=30,
+        StreamLagMax=30,
+    )
+
+    doc = m.to_emf(timestamp=0)
+    assert doc['StreamLagP50'] == 20
+    assert {'Name': 'StreamLagMax', 'Unit': 'Milliseconds'} in doc['_aws']['CloudWatchMetrics'][0]['Metrics']
+    assert 'StreamLag' not in doc
+
+def test_metrics_merge():
+    m = metrics.Metrics('Test')
+    m.add('RecordsIn', 2)
+    m.observe('StreamLag', 5, metrics.UNIT_MILLISECONDS)
+    other = metrics.Metrics('Test')
+    other.add('RecordsIn', 3)
+    other.add('EncodeTime', 1.5, metrics.UNIT_MILLISECONDS)
+    other.observe('StreamLag', 1, metrics.UNIT_MILLISECONDS)
+
+    m.merge(other)
+    assert m.values == dict(RecordsIn=5, EncodeTime=1.5)
+    assert m.units['EncodeTime'] == metrics.UNIT_MILLISECONDS
+    assert m.observations == dict(StreamLag=[5, 1])
+
+    metrics.NULL_METRICS.merge(other)
@@ -0,0 +1,272 @@
+from datetime import datetime, timezone
+from threading import Lock, Thread
+import time
+
+import boto3
+from moto import mock_dynamodb, mock_dynamodbstreams
+import pytest
+
+from dynamodb_stream_events import checkpoints, poller
+from dynamodb_stream_events.checkpoints import SHARD_END
+from dynamodbstreams_standin import DynamoDBStreamsStandin
+from synthetic import StubEventsClient
+
+import dynamodb_stream_events as init
+
+def make_records(*names):
+    return [
+        dict(
+            eventName='INSERT',
+            dynamodb=dict(
+                ApproximateCreationDateTime=datetime(2020, 7, 15, tzinfo=timezone.utc),
+                Keys=dict(pk=dict(S=name)),
+                NewImage=dict(pk=dict(S=name)),
+            ),
+        )
+        for name in names
+    ]
+
+class Collector:
+    def __init__(self):
+        self.lock = Lock()
+        self.names = []
+        self.batches = []
+
+    def __call__(self, records):
+        with self.lock:
+            self.batches.append(records)
+            self.names.extend(r['dynamodb']['Keys']['pk']['S'] for r in records)
+
+@pytest.fixture
+def standin():
+    return DynamoDBStreamsStandin(page_size=2)
+
+@pytest.fixture
+def store(tmp_path):
+    return checkpoints.open_checkpoint_store(f"sqlite:{tmp_path}/checkpoints.db")
+
+def make_poller(standin, store, **kwargs):
+    kwargs.setdefault('process', Collector())
+    kwargs.setdefault('min_sleep', 0.001)
+    kwargs.setdefault('max_sleep', 0.01)
+    kwargs.setdefault('refresh_interval', 0.05)
+    return poller.StreamPoller(standin.stream_arn, store, streams_clnt=standin, **kwargs)
+
+def run_until(stream_poller, condition, timeout=5):
+    thread = Thread(target=stream_poller.run)
+    thread.start()
+    deadline = time.monotonic() + timeout
+    try:
+        while not condition() and time.monotonic() < deadline:
+            time.sleep(0.01)
+    finally:
+        stream_poller.stop()
+        thread.join(timeout)
+    assert not thread.is_alive()
+    assert condition()
+
+def test_to_lambda_records():
+    records = make_records('a')
+    records[0]['dynamodb']['ApproximateCreationDateTime'] = datetime(2020, 7, 15)
+    result = poller.to_lambda_records('arn:stream', records)
+
+    assert result[0]['eventSourceARN'] == 'arn:stream'
+    assert result[0]['dynamodb']['ApproximateCreationDateTime'] == 1594771200.0
+    # The GetRecords records aren't changed.
+    assert isinstance(records[0]['dynamodb']['ApproximateCreationDateTime'], datetime)
+
+def test_lineage(standin, store):
+    # shard-0 split into shard-1 and shard-2; shard-1 split again into shard-3.
+    standin.add_shard('shard-0')
+    standin.add_records('shard-0', make_records('0a', '0b', '0c'))
+    standin.close_shard('shard-0')
+    standin.add_shard('shard-1', 'shard-0')
+    standin.add_shard('shard-2', 'shard-0')
+    standin.add_records('shard-1', make_records('1a', '1b'))
+    standin.add_records('shard-2', make_records('2a', '2b'))
+    standin.close_shard('shard-1')
+    standin.add_shard('shard-3', 'shard-1')
+    standin.add_records('shard-3', make_records('3a'))
+    standin.close_shard('shard-2')
+    standin.close_shard('shard-3')
+    standin.status = 'DISABLED'
+
+    stream_poller = make_poller(standin, store, limit=2)
+    stream_poller.run()
+
+    names = stream_poller.process.names
+    assert sorted(names) == ['0a', '0b', '0c', '1a', '1b', '2a', '2b', '3a']
+    # Parents are read to the end before their children.
+    assert names[:3] == ['0a', '0b', '0c']
+    assert names.index('1b') < names.index('3a')
+    assert names.index('1a') < names.index('1b')
+    assert names.index('2a') < names.index('2b')
+    for shard_id in ('shard-0', 'shard-1', 'shard-2', 'shard-3'):
+        assert store.get(standin.stream_arn, shard_id) == SHARD_END
+
+    batch = stream_poller.process.batches[0]
+    assert batch[0]['eventSourceARN'] == standin.stream_arn
+    assert batch[0]['dynamodb']['ApproximateCreationDateTime'] == 1594771200.0
+
+def test_checkpoint_restart(standin, store):
+    standin.add_shard('shard-0')
+    seqs = standin.add_records('shard-0', make_records('a', 'b', 'c'))
+    store.put(standin.stream_arn, 'shard-0', seqs[1])
+
+    stream_poller = make_poller(standin, store)
+    run_until(stream_poller, lambda: stream_poller.process.names)
+    assert stream_poller.process.names == ['c']
+    assert store.get(standin.stream_arn, 'shard-0') == seqs[2]
+
+    standin.add_records('shard-0', make_records('d'))
+    stream_poller = make_poller(standin, store)
+    run_until(stream_poller, lambda: stream_poller.process.names)
+    assert stream_poller.process.names == ['d']
+
+def test_latest(standin, store):
+    standin.add_shard('shard-0')
+    standin.add_records('shard-0', make_records('old-0'))
+    standin.close_shard('shard-0')
+    standin.add_shard('shard-1', 'shard-0')
+    standin.add_records('shard-1', make_records('old-1'))
+
+    stream_poller = make_poller(standin, store, initial_position='LATEST')
+    thread = Thread(target=stream_poller.run)
+    thread.start()
+    try:
+        deadline = time.monotonic() + 5
+        while standin.calls['get_records'] < 2 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        standin.add_records('shard-1', make_records('new'))
+        while not stream_poller.process.names and time.monotonic() < deadline:
+            time.sleep(0.01)
+    finally:
+        stream_poller.stop()
+        thread.join()
+
+    assert stream_poller.process.names == ['new']
+    assert store.get(standin.stream_arn, 'shard-0') == SHARD_END
+
+def test_expired_iterator(standin, store):
+    standin.add_shard('shard-0')
+    standin.add_records('shard-0', make_records('a', 'b'))
+
+    collector = Collector()
+    def _process(records):
+        collector(records)
+        standin.expire_iterators()
+
+    stream_poller = make_poller(standin, store, process=_process, limit=1)
+    run_until(stream_poller, lambda: len(collector.names) >= 2)
+    assert collector.names == ['a', 'b']
+
+def test_process_retry(standin, store):
+    standin.add_shard('shard-0')
+    standin.add_records('shard-0', make_records('a'))
+
+    collector = Collector()
+    failures = []
+    def _process(records):
+        if len(failures) < 2:
+            failures.append(records)
+            raise RuntimeError('failed')
+        collector(records)
+
+    stream_poller = make_poller(standin, store, process=_process)
+    run_until(stream_poller, lambda: collector.names)
+    assert collector.names == ['a']
+    assert len(failures) == 2
+
+def test_process_failed(standin, store):
+    standin.add_shard('shard-0')
+    seqs = standin.add_records('shard-0', make_records('a', 'b', 'c'))
+
+    collector = Collector()
+    calls = []
+    def _process(records):
+        calls.append([r['dynamodb']['Keys']['pk']['S'] for r in records])
+        failed = [r for r in records if r['dynamodb']['Keys']['pk']['S'] == 'b']
+        collector([r for r in records if r not in failed])
+        return [r['dynamodb']['SequenceNumber'] for r in failed]
+
+    # While 'b' keeps failing, only 'a' is checkpointed.
+    stream_poller = make_poller(standin, store, process=_process, limit=3)
+    run_until(stream_poller, lambda: len(calls) >= 3)
+    assert calls[:3] == [['a', 'b', 'c'], ['b'], ['b']]
+    assert collector.names == ['a', 'c']
+    assert store.get(standin.stream_arn, 'shard-0') == seqs[0]
+
+    # Only the records that failed are retried.
+    calls = []
+    def _retry(records):
+        calls.append([r['dynamodb']['Keys']['pk']['S'] for r in records])
+        return [seqs[1]] if len(calls) == 1 else []
+
+    # After a restart 'b' is read again, and retried until it works.
+    stream_poller = make_poller(standin, store, process=_retry, limit=3)
+    run_until(stream_poller, lambda: store.get(standin.stream_arn, 'shard-0') == seqs[2])
+    assert calls == [['b', 'c'], ['b']]
+
+def test_idle_backoff(standin, store):
+    standin.add_shard('shard-0')
+    stream_poller = make_poller(standin, store, min_sleep=0.005, max_sleep=0.08)
+    thread = Thread(target=stream_poller.run)
+    thread.start()
+    time.sleep(0.5)
+    stream_poller.stop()
+    thread.join()
+
+    # Without backing off it would have polled about 100 times.
+    assert 2 <= standin.calls['get_records'] < 20
+
+def test_poll_failed_backoff(standin, store, caplog):
+    standin.add_shard('shard-0')
+    calls = []
+    def _get_shard_iterator(**kwargs):
+        calls.append(time.monotonic())
+        raise RuntimeError('unavailable')
+    standin.get_shard_iterator = _get_shard_iterator
+
+    stream_poller = make_poller(standin, store, min_sleep=0.005, refresh_interval=0.08)
+    thread = Thread(target=stream_poller.run)
+    thread.start()
+    time.sleep(0.5)
+    stream_poller.stop()
+    thread.join()
+
+    # 0.01, 0.02, 0.04, then every 0.08s, instead of as fast as it fails.
+    assert 4 <= len(calls) < 12
+    assert stream_poller.failures['shard-0'][0] == len(calls)
+    assert 'Polling failed 3 times' in caplog.text
+
+def test_moto(monkeypatch):
+    monkeypatch.setenv('AWS_DEFAULT_REGION', 'us-east-2')
+    monkeypatch.setenv('AWS_ACCESS_KEY_ID', 'testing')
+    monkeypatch.setenv('AWS_SECRET_ACCESS_KEY', 'testing')
+    with mock_dynamodb(), mock_dynamodbstreams():
+        ddb_clnt = boto3.client('dynamodb')
+        table = ddb_clnt.create_table(
+            TableName='Test',
+            KeySchema=[dict(AttributeName='pk', KeyType='HASH')],
+            AttributeDefinitions=[dict(AttributeName='pk', AttributeType='S')],
+            BillingMode='PAY_PER_REQUEST',
+            StreamSpecification=dict(StreamEnabled=True, StreamViewType='NEW_AND_OLD_IMAGES'),
+        )
+        stream_arn = table['TableDescription']['LatestStreamArn']
+        for idx in range(15):
+            ddb_clnt.put_item(TableName='Test', Item=dict(pk=dict(S=f"item-{idx}")))
+
+        events_clnt = StubEventsClient()
+        store = checkpoints.SQLiteCheckpointStore(':memory:')
+        stream_poller = poller.StreamPoller(
+            stream_arn,
+            store,
+            streams_clnt=boto3.client('dynamodbstreams'),
+            process=lambda records: init.put_records(records, _events_clnt=events_clnt),
+            min_sleep=0.001,
+            max_sleep=0.01,
+        )
+        run_until(stream_poller, lambda: events_clnt.entries >= 15)
+
+    assert events_clnt.entries == 15
+    assert events_clnt.calls == 2
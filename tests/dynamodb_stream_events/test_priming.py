@@ -0,0 +1,57 @@
+import sys
+import types
+
+import boto3
+from moto import mock_events
+
+from dynamodb_stream_events import clients, priming
+
+def test_prime_local():
+    timings = priming.prime(network=False)
+    assert set(timings) == {'total', 'records', 'events'}
+
+def test_prime_network():
+    with mock_events():
+        clients.reset_clients()
+        try:
+            timings = priming.prime(network=True)
+            assert set(timings) == {'total', 'records', 'events', 'client', 'connect'}
+            assert clients.get_events_clnt() is clients.get_events_clnt()
+        finally:
+            clients.reset_clients()
+
+def test_prime_network_error(caplog):
+    with mock_events():
+        clients.reset_clients()
+        try:
+            clients._clients['events'] = boto3.client('events')
+            timings = {}
+            priming._prime_network(timings, 'does-not-exist')
+            assert set(timings) == {'client', 'connect'}
+            assert 'Unable to prime the events connection' in caplog.text
+        finally:
+            clients.reset_clients()
+
+def test_register_snapshot_hooks_missing(monkeypatch):
+    monkeypatch.setitem(sys.modules, 'snapshot_restore_py', None)
+    assert not priming.register_snapshot_hooks()
+
+def test_register_snapshot_hooks(monkeypatch):
+    hooks = {}
+    module = types.ModuleType('snapshot_restore_py')
+    module.register_before_snapshot = lambda func: hooks.__setitem__('before', func)
+    module.register_after_restore = lambda func: hooks.__setitem__('after', func)
+    monkeypatch.setitem(sys.modules, 'snapshot_restore_py', module)
+
+    assert priming.register_snapshot_hooks(network=False)
+    with mock_events():
+        clients.reset_clients()
+        try:
+            hooks['before']()
+            before_clnt = clients.get_events_clnt()
+
+            hooks['after']()
+            assert 'events' not in clients._clients
+            assert clients.get_events_clnt() is not before_clnt
+        finally:
+            clients.reset_clients()
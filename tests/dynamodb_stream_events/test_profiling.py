@@ -0,0 +1,166 @@
+import io
+import json
+import logging
+import pstats
+import tracemalloc
+
+import pytest
+
+import dynamodb_stream_events as init
+from dynamodb_stream_events import metrics, profiling
+from synthetic import RecordShape, StubEventsClient, SyntheticRecords
+
+# Items of about 400 KB, the DynamoDB maximum.
+LARGE_SHAPE = RecordShape(width=4, types=('S',), view_type='NEW_IMAGE', string_size=100_000)
+
+def _put_records_peak(count):
+    records = SyntheticRecords(LARGE_SHAPE, seed=count).batch(count, event_name='INSERT')
+    events_clnt = StubEventsClient()
+
+    tracemalloc.start()
+    try:
+        tracemalloc.reset_peak()
+        baseline = tracemalloc.get_traced_memory()[0]
+        init.put_records(records, _events_clnt=events_clnt)
+        peak = tracemalloc.get_traced_memory()[1] - baseline
+    finally:
+        tracemalloc.stop()
+
+    assert events_clnt.entries == count
+    return peak
+
+def test_put_records_bounded_peak():
+    # Each event is about 400 KB, so each is put by itself. Only one event is
+    # in memory at a time, so the peak doesn't grow with the batch.
+    small_peak = _put_records_peak(5)
+    large_peak = _put_records_peak(20)
+    assert large_peak < small_peak * 1.5
+    assert large_peak < 8 * 400_000
+
+def test_memory_profiler(caplog):
+    m = metrics.Metrics('Test')
+    profiler = profiling.MemoryProfiler(m, record_count=2, min_records=1, top=3)
+    assert profiler
+    assert tracemalloc.is_tracing()
+
+    start = 0.0
+    data = [bytearray(100_000)]
+    profiler.add_time(metrics.STAGE_ENCODE, start)
+    with profiler.timer(metrics.STAGE_PUT_EVENTS):
+        data.append(bytearray(500_000))
+        del data[1]
+    profiler.add('RecordsIn', 2)
+
+    assert profiler.peaks[metrics.STAGE_ENCODE] >= 100_000
+    assert profiler.peaks[metrics.STAGE_PUT_EVENTS] >= 500_000
+    assert profiler.peak == profiler.peaks[metrics.STAGE_PUT_EVENTS]
+
+    stream = io.StringIO()
+    with caplog.at_level(logging.INFO, logger=profiling.__name__):
+        profiler.emit(stream)
+    assert not tracemalloc.is_tracing()
+
+    doc = json.loads(stream.getvalue())
+    assert doc['RecordsIn'] == 2
+    assert doc['PutEventsPeakBytes'] >= 500_000
+    assert doc['PeakBytes'] == doc['PutEventsPeakBytes']
+
+    messages = [r.getMessage() for r in caplog.records if r.name == profiling.__name__]
+    assert len(messages) == 1
+    assert messages[0].startswith('Memory profile: ')
+    profile = json.loads(messages[0][len('Memory profile: '):])
+    assert profile['records'] == 2
+    assert 0 < len(profile['top']) <= 3
+    assert set(profile['top'][0]) == {'file', 'line', 'size', 'count'}
+
+def test_memory_profiler_small_batch():
+    profiler = profiling.MemoryProfiler(metrics.NULL_METRICS, record_count=2, min_records=10)
+    assert profiler
+    profiler.add_time(metrics.STAGE_ENCODE, 0.0)
+    profiler.emit()
+    assert profiler.snapshot is None
+    assert profiler.top_sites() == []
+
+def test_memory_profiler_lanes():
+    records = SyntheticRecords(LARGE_SHAPE, seed=1).batch(8, event_name='INSERT')
+    m = metrics.Metrics('Test')
+    profiler = profiling.MemoryProfiler(m, record_count=8)
+    try:
+        init.put_records(records, _events_clnt=StubEventsClient(), metrics=profiler, lanes=4)
+    finally:
+        profiler.stop()
+
+    # The lanes' stages are marked, and their metrics merged.
+    assert profiler.peaks[metrics.STAGE_ENCODE] >= 400_000
+    assert profiler.peaks[metrics.STAGE_PUT_EVENTS] > 0
+    assert m.values['PutEventsCalls'] == 8
+    assert m.values['EncodeTime'] > 0
+
+@pytest.mark.parametrize('enabled', [False, True])
+def test_handler_memory_profile(monkeypatch, enabled):
+    seen = {}
+    def _put_records(records, metrics, deadline=None):
+        #pylint: disable=redefined-outer-name
+        seen['metrics'] = metrics
+        return []
+    monkeypatch.setattr(init, 'MEMORY_PROFILE', enabled)
+    monkeypatch.setattr(init, 'put_records', _put_records)
+
+    init.handler({'Records': []}, None)
+    assert isinstance(seen['metrics'], profiling.MemoryProfiler) == enabled
+    assert not tracemalloc.is_tracing()
+
+def _busy(count):
+    return sum(i * i for i in range(count))
+
+def test_profile_call(caplog, tmp_path):
+    with caplog.at_level(logging.INFO, logger=profiling.__name__):
+        result = profiling.profile_call(_busy, 1000, top=5, dump_dir=str(tmp_path))
+    assert result == _busy(1000)
+
+    messages = [r.getMessage() for r in caplog.records if r.name == profiling.__name__]
+    assert len(messages) == 1
+    assert messages[0].startswith('CPU profile: ')
+    profile = json.loads(messages[0][len('CPU profile: '):])
+    assert profile['total'] >= 0
+    assert 0 < len(profile['top']) <= 5
+    assert any('(_busy)' in f['function'] for f in profile['top'])
+    assert set(profile['top'][0]) == {'function', 'calls', 'tottime', 'cumtime'}
+
+    dumps = list(tmp_path.iterdir())
+    assert [str(d) for d in dumps] == [profile['dump']]
+    assert dumps[0].name.startswith('_busy-')
+    assert pstats.Stats(profile['dump']).total_calls > 0
+
+def test_profile_call_exception(caplog):
+    def _fail():
+        raise ValueError('failed')
+
+    with caplog.at_level(logging.INFO, logger=profiling.__name__):
+        with pytest.raises(ValueError):
+            profiling.profile_call(_fail, dump_dir=None)
+    messages = [r.getMessage() for r in caplog.records if r.name == profiling.__name__]
+    assert len(messages) == 1
+    assert 'dump' not in json.loads(messages[0][len('CPU profile: '):])
+
+@pytest.mark.parametrize('sample_rate,marker,records,profiled', [
+    (0.0, None, [{'dynamodb': {'NewImage': {'profile': {'BOOL': True}}}}], False),
+    (1.0, None, [], True),
+    (0.0, 'profile', [{'dynamodb': {'NewImage': {'other': {'BOOL': True}}}}], False),
+    (0.0, 'profile', [
+        {'dynamodb': {'Keys': {}}},
+        {'dynamodb': {'NewImage': {'profile': {'BOOL': True}}}},
+    ], True),
+])
+def test_handler_profile(monkeypatch, sample_rate, marker, records, profiled):
+    calls = []
+    def _profile_call(func, *args, **kwargs):
+        calls.append(func)
+        return []
+    monkeypatch.setattr(init, 'PROFILE_SAMPLE_RATE', sample_rate)
+    monkeypatch.setattr(init, 'PROFILE_MARKER', marker)
+    monkeypatch.setattr(init, 'put_records', lambda records, metrics, deadline=None: [])
+    monkeypatch.setattr(profiling, 'profile_call', _profile_call)
+
+    init.handler({'Records': records}, None)
+    assert calls == ([init.put_records] if profiled else [])
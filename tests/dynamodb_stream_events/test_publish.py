@@ -0,0 +1,108 @@
+from datetime import datetime, timezone
+import time
+
+import pytest
+
+from dynamodb_stream_events import publish
+
+def make_entry(detail_size=10):
+    return dict(
+        Time=datetime(2020, 7, 15, tzinfo=timezone.utc),
+        Source='src',
+        Resources=['arn'],
+        DetailType='type',
+        Detail='x' * detail_size,
+        EventBusName='default',
+    )
+
+def test_entry_size():
+    assert publish.entry_size(make_entry()) == 14 + 3 + 3 + 4 + 10
+    assert publish.entry_size(dict(Detail='é')) == 2
+
+@pytest.mark.parametrize("count,expected", [
+    (0, []),
+    (1, [1]),
+    (10, [10]),
+    (11, [10, 1]),
+    (25, [10, 10, 5]),
+])
+def test_chunk_entries_count(count, expected):
+    chunks = list(publish.chunk_entries(make_entry() for _ in range(count)))
+    assert [len(c) for c, _ in chunks] == expected
+    assert all(size == len(c) * publish.entry_size(make_entry()) for c, size in chunks)
+
+def test_chunk_entries_bytes():
+    entries = [make_entry(100 * 1024) for _ in range(5)]
+    chunks = list(publish.chunk_entries(entries))
+    assert [len(c) for c, _ in chunks] == [2, 2, 1]
+    assert [e for c, _ in chunks for e in c] == entries
+
+def test_chunk_entries_oversized():
+    entries = [make_entry(), make_entry(300 * 1024), make_entry()]
+    chunks = list(publish.chunk_entries(entries))
+    assert [len(c) for c, _ in chunks] == [1, 1, 1]
+
+class FlakyEventsClient:
+    """ Fails each entry `failures` times before accepting it. """
+    def __init__(self, failures=1, raise_calls=0):
+        self.failures = failures
+        self.raise_calls = raise_calls
+        self.attempts = {}
+        self.accepted = []
+        self.calls = 0
+
+    def put_events(self, Entries):
+        #pylint: disable=invalid-name
+        self.calls += 1
+        if self.calls <= self.raise_calls:
+            raise RuntimeError('Connection reset')
+        res_entries = []
+        for entry in Entries:
+            count = self.attempts[entry['Detail']] = self.attempts.get(entry['Detail'], 0) + 1
+            if count <= self.failures:
+                res_entries.append({'ErrorCode': 'InternalFailure', 'ErrorMessage': 'Failed'})
+            else:
+                self.accepted.append(entry['Detail'])
+                res_entries.append({'EventId': entry['Detail']})
+        return {'Entries': res_entries}
+
+def make_entries(count):
+    return [dict(make_entry(), Detail=f"detail-{idx}") for idx in range(count)]
+
+def test_put_entries_retry():
+    entries = make_entries(25)
+    events_clnt = FlakyEventsClient(failures=2)
+    put_count, failed = publish.put_entries(entries, events_clnt, backoff=0.001)
+
+    assert put_count == 25
+    assert not failed
+    assert events_clnt.accepted == [e['Detail'] for e in entries]
+    assert events_clnt.calls == 9
+
+def test_put_entries_failed():
+    entries = make_entries(5)
+    events_clnt = FlakyEventsClient(failures=10)
+    put_count, failed = publish.put_entries(entries, events_clnt, attempts=3, backoff=0.001)
+
+    assert put_count == 0
+    assert [f.entry for f in failed] == entries
+    assert failed[0].error_code == 'InternalFailure'
+    assert failed[0].error_message == 'Failed'
+    assert events_clnt.calls == 3
+
+def test_put_entries_errors():
+    entries = make_entries(15)
+    events_clnt = FlakyEventsClient(failures=0, raise_calls=1)
+    put_count, failed = publish.put_entries(entries, events_clnt, attempts=1)
+
+    assert put_count == 5
+    assert [f.entry for f in failed] == entries[:10]
+    assert failed[0].error_code == 'RuntimeError'
+    assert failed[0].error_message == 'Connection reset'
+
+def test_put_entries_rate():
+    entries = make_entries(50)
+    start = time.monotonic()
+    publish.put_entries(entries, FlakyEventsClient(failures=0), rate=200)
+    # The first 20 events are the limiter's burst; the other 30 take 0.15s.
+    assert time.monotonic() - start >= 0.1
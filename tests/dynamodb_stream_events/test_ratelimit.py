@@ -0,0 +1,175 @@
+from threading import Thread
+import time
+
+from botocore.exceptions import ClientError
+import pytest
+
+import dynamodb_stream_events as init
+from dynamodb_stream_events import publish, ratelimit
+from dynamodb_stream_events.metrics import Metrics
+from synthetic import SyntheticRecords
+
+def throttling_error():
+    return ClientError(
+        {'Error': {'Code': 'ThrottlingException', 'Message': 'Rate exceeded'}},
+        'PutEvents'
+    )
+
+class ThrottlingEventsClient:
+    """ Raises ThrottlingException for the first calls, then throttles entries. """
+    def __init__(self, raise_calls=0, throttle_entries=0):
+        self.raise_calls = raise_calls
+        self.throttle_entries = throttle_entries
+        self.calls = 0
+        self.entries = 0
+
+    def put_events(self, Entries):
+        #pylint: disable=invalid-name
+        self.calls += 1
+        if self.calls <= self.raise_calls:
+            raise throttling_error()
+        res_entries = []
+        for _ in Entries:
+            if self.throttle_entries:
+                self.throttle_entries -= 1
+                res_entries.append({'ErrorCode': 'ThrottlingException', 'ErrorMessage': 'Rate'})
+            else:
+                self.entries += 1
+                res_entries.append({'EventId': str(self.entries)})
+        return {'Entries': res_entries}
+
+@pytest.fixture
+def limiter(monkeypatch):
+    monkeypatch.setattr(ratelimit, 'PUT_EVENTS_RATE_LIMIT', 10000.0)
+    ratelimit._limiters.clear()
+    yield ratelimit.get_rate_limiter()
+    ratelimit._limiters.clear()
+
+def test_acquire():
+    limiter = ratelimit.AdaptiveRateLimiter(200)
+    start = time.monotonic()
+    waits = [limiter.acquire(10) for _ in range(6)]
+    elapsed = time.monotonic() - start
+
+    # The first 20 tokens are the burst; the other 40 take 0.2s.
+    assert waits[0] == 0
+    assert 0.18 <= elapsed < 0.5
+
+def test_acquire_deadline():
+    limiter = ratelimit.AdaptiveRateLimiter(100)
+    assert limiter.acquire(10) == 0
+
+    # The 10 tokens would take 0.1s: they aren't taken, and it doesn't wait.
+    start = time.monotonic()
+    assert limiter.acquire(10, deadline=start + 0.02) is None
+    assert time.monotonic() - start < 0.02
+    assert 0.05 <= limiter.acquire(10, deadline=time.monotonic() + 1) <= 0.1
+
+def test_acquire_threads():
+    limiter = ratelimit.AdaptiveRateLimiter(400)
+    def _acquire():
+        for _ in range(3):
+            limiter.acquire(10)
+
+    threads = [Thread(target=_acquire) for _ in range(4)]
+    start = time.monotonic()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    # 120 tokens, 40 of them the burst.
+    assert time.monotonic() - start >= 0.18
+
+def test_aimd(monkeypatch):
+    monkeypatch.setattr(ratelimit, 'DECREASE_INTERVAL', 0.05)
+    limiter = ratelimit.AdaptiveRateLimiter(1000, min_rate=100)
+    assert limiter.rate == 1000
+
+    assert limiter.throttled()
+    assert limiter.rate == 500
+    # Throttles together (like the lanes) only decrease once.
+    assert not limiter.throttled()
+    assert limiter.rate == 500
+
+    time.sleep(0.06)
+    limiter.throttled()
+    assert limiter.rate == 250
+    for _ in range(5):
+        time.sleep(0.06)
+        limiter.throttled()
+    assert limiter.rate == 100
+
+    for _ in range(10):
+        limiter.success()
+    assert limiter.rate == 200
+    for _ in range(200):
+        limiter.success()
+    assert limiter.rate == 1000
+
+def test_get_rate_limiter(monkeypatch, limiter):
+    assert limiter is ratelimit.get_rate_limiter()
+    assert limiter.max_rate == 10000.0
+
+    monkeypatch.setattr(ratelimit, 'PUT_EVENTS_RATE_LIMIT', 0.0)
+    assert ratelimit.get_rate_limiter() is None
+
+def test_put_records_throttled(limiter):
+    records = SyntheticRecords().batch(15)
+    events_clnt = ThrottlingEventsClient(raise_calls=2)
+    metrics = Metrics('Test')
+    init.put_records(records, _events_clnt=events_clnt, metrics=metrics)
+
+    assert events_clnt.entries == 15
+    assert metrics.values['Throttles'] == 2
+    assert metrics.values['EventsOut'] == 15
+    assert limiter.rate < 10000
+    assert metrics.values['PutEventsRateLimit'] == limiter.rate
+    assert 'RateLimitTime' in metrics.values
+
+def test_put_records_throttled_retries(limiter):
+    events_clnt = ThrottlingEventsClient(raise_calls=10)
+    records = SyntheticRecords().batch(5)
+    failed = init.put_records(records, _events_clnt=events_clnt)
+    assert events_clnt.calls == init.PUT_EVENTS_THROTTLE_RETRIES + 1
+    assert failed == [r['dynamodb']['SequenceNumber'] for r in records]
+
+def test_put_records_limiter_deadline(monkeypatch):
+    monkeypatch.setattr(ratelimit, 'PUT_EVENTS_RATE_LIMIT', 100.0)
+    monkeypatch.setattr(publish, 'PUT_EVENTS_CALL_TIME', 0.0)
+    ratelimit._limiters.clear()
+    records = SyntheticRecords().batch(30)
+    events_clnt = ThrottlingEventsClient()
+    metrics = Metrics('Test')
+    failed = init.put_records(records, _events_clnt=events_clnt, metrics=metrics, lanes=1,
+                              deadline=time.monotonic() + 0.08)
+    ratelimit._limiters.clear()
+
+    # The burst puts the first call; the next would wait 0.1s for the
+    # limiter, so it is deferred instead.
+    assert metrics.values['RateLimitTime'] < 50
+    assert events_clnt.calls == 1
+    assert metrics.values['DeferredRecords'] == 20
+    assert failed == [r['dynamodb']['SequenceNumber'] for r in records[10:]]
+
+def test_put_records_throttled_entries(limiter):
+    records = SyntheticRecords().batch(15)
+    events_clnt = ThrottlingEventsClient(throttle_entries=3)
+    metrics = Metrics('Test')
+    init.put_records(records, _events_clnt=events_clnt, metrics=metrics)
+
+    assert metrics.values['Throttles'] == 1
+    assert metrics.values['ThrottledEntries'] == 3
+    assert metrics.values['FailedEntries'] == 3
+    assert limiter.rate == 5000 + limiter.increase
+
+def test_put_records_no_limiter(monkeypatch):
+    monkeypatch.setattr(ratelimit, 'PUT_EVENTS_RATE_LIMIT', 0.0)
+    events_clnt = ThrottlingEventsClient(raise_calls=1)
+    metrics = Metrics('Test')
+    records = SyntheticRecords().batch(15)
+    failed = init.put_records(records, _events_clnt=events_clnt, metrics=metrics, lanes=1)
+    # The throttled call's records, and the rest of the lane, are returned.
+    assert events_clnt.calls == 1
+    assert metrics.values['Throttles'] == 1
+    assert metrics.values['DeferredRecords'] == 15
+    assert failed == [r['dynamodb']['SequenceNumber'] for r in records]
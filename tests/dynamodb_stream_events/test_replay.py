@@ -0,0 +1,94 @@
+from datetime import datetime, timezone
+import json
+
+from dynamodb_stream_events import replay, spool
+from dynamodb_stream_events.publish import FailedEntry
+
+def make_failed(count, start=0):
+    return [
+        FailedEntry(
+            dict(
+                Time=datetime(2020, 7, 15, tzinfo=timezone.utc),
+                Source='dynamodb-streams.aws.illinois.edu',
+                Resources=[],
+                DetailType='DynamoDB Streams Record INSERT',
+                Detail=json.dumps({'idx': idx}),
+                EventBusName='default',
+            ),
+            'InternalFailure',
+            'Failed',
+        )
+        for idx in range(start, start + count)
+    ]
+
+class EventsClient:
+    """ Fails the entries with the details in `fail`. """
+    def __init__(self, fail=()):
+        self.fail = set(fail)
+        self.entries = []
+
+    def put_events(self, Entries):
+        #pylint: disable=invalid-name
+        res_entries = []
+        for entry in Entries:
+            if entry['Detail'] in self.fail:
+                res_entries.append({'ErrorCode': 'InternalFailure', 'ErrorMessage': 'Failed'})
+            else:
+                self.entries.append(entry)
+                res_entries.append({'EventId': entry['Detail']})
+        return {'Entries': res_entries}
+
+def test_replay_spool(tmp_path):
+    local_spool = spool.LocalSpool(str(tmp_path))
+    local_spool.write(make_failed(15))
+    local_spool.write(make_failed(5, start=15))
+
+    events_clnt = EventsClient()
+    stats = replay.replay_spool(local_spool, events_clnt)
+
+    assert stats == dict(objects=2, events=20, put=20, failed=0, skipped=0)
+    assert [json.loads(e['Detail'])['idx'] for e in events_clnt.entries] == list(range(20))
+    assert events_clnt.entries[0]['Time'] == datetime(2020, 7, 15, tzinfo=timezone.utc)
+    assert not local_spool.names()
+
+def test_replay_spool_failed(tmp_path):
+    local_spool = spool.LocalSpool(str(tmp_path))
+    name = local_spool.write(make_failed(10))
+
+    fail = {json.dumps({'idx': 3}), json.dumps({'idx': 7})}
+    events_clnt = EventsClient(fail=fail)
+    stats = replay.replay_spool(local_spool, events_clnt, attempts=2)
+
+    assert stats == dict(objects=1, events=10, put=8, failed=2, skipped=0)
+    # The events that failed again are spooled for the next replay.
+    names = local_spool.names()
+    assert len(names) == 1 and names[0] != name
+    assert {f.entry['Detail'] for f in local_spool.read(names[0])} == fail
+
+def test_replay_spool_quarantine(tmp_path, caplog):
+    local_spool = spool.LocalSpool(str(tmp_path))
+    quarantined = local_spool.write_items([
+        {'Record': {'eventID': '1'}, 'Entry': None, 'ErrorCode': 'KeyError', 'ErrorMessage': 'x'},
+    ])
+    local_spool.write(make_failed(3))
+
+    events_clnt = EventsClient()
+    stats = replay.replay_spool(local_spool, events_clnt)
+
+    # The quarantine object is left, and the others are still replayed.
+    assert stats == dict(objects=1, events=3, put=3, failed=0, skipped=1)
+    assert local_spool.names() == [quarantined]
+    assert "quarantined records can't be replayed" in caplog.text
+
+def test_replay_spool_options(tmp_path):
+    local_spool = spool.LocalSpool(str(tmp_path))
+    name = local_spool.write(make_failed(3))
+
+    events_clnt = EventsClient()
+    stats = replay.replay_spool(local_spool, events_clnt, prefix='1999/', keep=True)
+    assert stats['objects'] == 0
+
+    stats = replay.replay_spool(local_spool, events_clnt, event_bus_name='other', keep=True)
+    assert stats['put'] == 3
+    assert {e['EventBusName'] for e in events_clnt.entries} == {'other'}
+    assert local_spool.names() == [name]
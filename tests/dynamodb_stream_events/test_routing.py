@@ -0,0 +1,253 @@
+import json
+import logging
+
+import pytest
+
+import dynamodb_stream_events as init
+from dynamodb_stream_events import routing, spool
+from dynamodb_stream_events.metrics import Metrics
+from synthetic import RecordShape, SyntheticRecords
+
+OTHER_STREAM_ARN = 'arn:aws:dynamodb:us-east-2:123456789012:table/OtherTable/stream/1'
+
+CONFIG = {
+    'SyntheticTable': {
+        'eventBusName': 'synthetic-bus',
+        'detailTypeFmt': 'Synthetic {eventName}',
+        'projection': ['pk', 'sk', 'attr2'],
+        'eventNames': ['INSERT', 'MODIFY'],
+    },
+    '*': {
+        'eventBusName': 'other-bus',
+    },
+}
+
+class EntriesClient:
+    def __init__(self):
+        self.entries = []
+
+    def put_events(self, Entries):
+        #pylint: disable=invalid-name
+        self.entries.extend(Entries)
+        return {
+            'FailedEntryCount': 0,
+            'Entries': [{'EventId': str(idx)} for idx in range(len(Entries))],
+        }
+
+@pytest.fixture
+def routes(monkeypatch):
+    routes = routing.load_routes(json.dumps(CONFIG))
+    monkeypatch.setattr(routing, 'ROUTES', routes)
+    return routes
+
+def test_load_routes(tmp_path):
+    assert routing.load_routes(None) == {}
+
+    config_path = tmp_path / 'routes.json'
+    config_path.write_text(json.dumps(CONFIG))
+    routes = routing.load_routes(str(config_path))
+    assert routes == routing.load_routes(json.dumps(CONFIG))
+
+    route = routes['SyntheticTable']
+    assert route.event_bus_name == 'synthetic-bus'
+    assert route.detail_type_fmt == 'Synthetic {eventName}'
+    assert route.projection == frozenset(['pk', 'sk', 'attr2'])
+    assert route.event_names == frozenset(['INSERT', 'MODIFY'])
+    assert routes['*'] == routing.DEFAULT_ROUTE._replace(event_bus_name='other-bus')
+
+    with pytest.raises(ValueError, match='eventBus'):
+        routing.load_routes({'Table': {'eventBus': 'x'}})
+
+def test_get_route(routes):
+    assert routing.get_route('SyntheticTable') is routes['SyntheticTable']
+    assert routing.get_route('OtherTable') is routes['*']
+    assert routing.get_route(None) is routes['*']
+
+def test_get_route_default(monkeypatch):
+    monkeypatch.setattr(routing, 'ROUTES', {})
+    assert routing.get_route('SyntheticTable') is routing.DEFAULT_ROUTE
+
+def test_filter_records(routes):
+    synthetic = SyntheticRecords()
+    records = synthetic.batch(3, event_name='INSERT') + synthetic.batch(3, event_name='REMOVE')
+    other = synthetic.batch(2, event_name='REMOVE')
+    for record in other:
+        record['eventSourceARN'] = OTHER_STREAM_ARN
+
+    assert routing.filter_records(records + other) == records[:3] + other
+    # Nothing dropped: the same list.
+    assert routing.filter_records(other) is other
+
+def test_put_records_routes(routes, caplog):
+    shape = RecordShape(width=6, types=('S',))
+    synthetic = SyntheticRecords(shape)
+    records = synthetic.batch(4, event_name='MODIFY') + synthetic.batch(2, event_name='REMOVE')
+    other = synthetic.batch(3, event_name='REMOVE')
+    for record in other:
+        record['eventSourceARN'] = OTHER_STREAM_ARN
+
+    events_clnt = EntriesClient()
+    metrics = Metrics('Test')
+    with caplog.at_level(logging.INFO, logger=init.__name__):
+        init.put_records(records + other, 'default-bus', _events_clnt=events_clnt, metrics=metrics)
+
+    entries = events_clnt.entries
+    assert len(entries) == 7
+    for entry in entries[:4]:
+        assert entry['EventBusName'] == 'synthetic-bus'
+        assert entry['DetailType'] == 'Synthetic MODIFY'
+        detail = json.loads(entry['Detail'])
+        assert set(detail['NewImage']) == {'pk', 'sk', 'attr2'}
+        assert set(detail['OldImage']) == {'pk', 'sk', 'attr2'}
+        assert detail['HasChanged'] == {'pk': False, 'sk': False, 'attr2': True}
+        assert detail['ChangedFields'] == ['attr2']
+        assert set(detail['Keys']) == {'pk', 'sk'}
+    for entry in entries[4:]:
+        assert entry['EventBusName'] == 'other-bus'
+        assert entry['DetailType'] == 'DynamoDB Streams Record REMOVE'
+        assert len(json.loads(entry['Detail'])['OldImage']) == 8
+
+    assert metrics.values['RecordsIn'] == 9
+    assert metrics.values['RecordsFiltered'] == 2
+    assert metrics.values['EventsOut'] == 7
+
+    summaries = [r.getMessage() for r in caplog.records if r.getMessage().startswith('Batch: ')]
+    summary = json.loads(summaries[0][len('Batch: '):])
+    assert summary['records'] == 9
+    assert summary['filtered'] == 2
+    assert summary['events'] == 7
+
+def test_put_records_no_routes(monkeypatch):
+    monkeypatch.setattr(routing, 'ROUTES', {})
+    records = SyntheticRecords().batch(3)
+    events_clnt = EntriesClient()
+    init.put_records(records, 'default-bus', _events_clnt=events_clnt)
+
+    assert [e['EventBusName'] for e in events_clnt.entries] == ['default-bus'] * 3
+
+def ttl_removals(synthetic, count):
+    records = synthetic.batch(count, event_name='REMOVE')
+    for record in records:
+        record['userIdentity'] = {'type': 'Service', 'principalId': 'dynamodb.amazonaws.com'}
+    return records
+
+def test_load_routes_ttl():
+    routes = routing.load_routes({
+        'Keys': {'ttl': 'keys'},
+        'Bus': {'ttlEventBusName': 'ttl-bus'},
+    })
+    assert routes['Keys'].ttl == routing.TTL_KEYS
+    assert routes['Bus'].ttl == routing.TTL_PUBLISH
+    assert routes['Bus'].ttl_event_bus_name == 'ttl-bus'
+
+    with pytest.raises(ValueError, match='ttl mode'):
+        routing.load_routes({'Table': {'ttl': 'archive'}})
+
+def test_is_ttl_removal():
+    synthetic = SyntheticRecords()
+    assert routing.is_ttl_removal(ttl_removals(synthetic, 1)[0])
+    assert not routing.is_ttl_removal(synthetic.batch(1, event_name='REMOVE')[0])
+    record = ttl_removals(synthetic, 1)[0]
+    record['eventName'] = 'MODIFY'
+    assert not routing.is_ttl_removal(record)
+
+@pytest.mark.parametrize('mode', ['keys', 'summary', 'drop'])
+def test_split_ttl_removals(monkeypatch, mode):
+    monkeypatch.setattr(routing, 'ROUTES', routing.load_routes({'SyntheticTable': {'ttl': mode}}))
+    synthetic = SyntheticRecords()
+    user_removals = synthetic.batch(2, event_name='REMOVE')
+    removals = ttl_removals(synthetic, 5)
+    records, summaries, count = routing.split_ttl_removals(user_removals + removals)
+
+    assert count == 5
+    assert records[:2] == user_removals
+    if mode == 'keys':
+        assert len(records) == 7
+        assert all('OldImage' not in r['dynamodb'] for r in records[2:])
+        assert all(r['dynamodb']['Keys'] for r in records[2:])
+        # The records themselves are unchanged.
+        assert all('OldImage' in r['dynamodb'] for r in removals)
+    else:
+        assert records == user_removals
+    if mode == 'summary':
+        assert summaries == {'SyntheticTable': {
+            'TableName': 'SyntheticTable',
+            'tableARN': removals[0]['eventSourceARN'].split('/stream/')[0],
+            'Count': 5,
+            'FirstSequenceNumber': removals[0]['dynamodb']['SequenceNumber'],
+            'LastSequenceNumber': removals[-1]['dynamodb']['SequenceNumber'],
+            'FirstApproximateCreationDateTime': \
+                removals[0]['dynamodb']['ApproximateCreationDateTime'],
+            'LastApproximateCreationDateTime': \
+                removals[-1]['dynamodb']['ApproximateCreationDateTime'],
+            'sequenceNumbers': [r['dynamodb']['SequenceNumber'] for r in removals],
+        }}
+    else:
+        assert summaries == {}
+
+def test_split_ttl_removals_publish(routes):
+    records = ttl_removals(SyntheticRecords(), 3)
+    assert routing.split_ttl_removals(records) == (records, {}, 0)
+
+def test_put_records_ttl_summary(monkeypatch):
+    monkeypatch.setattr(routing, 'ROUTES', routing.load_routes({
+        'SyntheticTable': {'ttl': 'summary', 'ttlEventBusName': 'ttl-bus'},
+    }))
+    synthetic = SyntheticRecords()
+    records = synthetic.batch(3, event_name='MODIFY') + ttl_removals(synthetic, 20)
+    events_clnt = EntriesClient()
+    metrics = Metrics('Test')
+    init.put_records(records, 'default-bus', _events_clnt=events_clnt, metrics=metrics)
+
+    entries = events_clnt.entries
+    assert len(entries) == 4
+    assert [e['EventBusName'] for e in entries] == ['default-bus'] * 3 + ['ttl-bus']
+    assert entries[3]['DetailType'] == init.TTL_SUMMARY_DETAILTYPE
+    assert json.loads(entries[3]['Detail'])['Count'] == 20
+    assert metrics.values['TTLRemovals'] == 20
+    assert metrics.values['TTLSummaryEvents'] == 1
+
+def test_put_records_ttl_summary_failed(monkeypatch, tmp_path):
+    monkeypatch.setattr(routing, 'ROUTES', routing.load_routes({
+        'SyntheticTable': {'ttl': 'summary'},
+    }))
+    monkeypatch.setattr(spool, 'FAILED_SPOOL', None)
+
+    class FailingClient(EntriesClient):
+        def put_events(self, Entries):
+            #pylint: disable=invalid-name
+            if Entries[0]['DetailType'] == init.TTL_SUMMARY_DETAILTYPE:
+                return {
+                    'FailedEntryCount': 1,
+                    'Entries': [{'ErrorCode': 'InternalFailure', 'ErrorMessage': 'Failed'}],
+                }
+            return super().put_events(Entries)
+
+    synthetic = SyntheticRecords()
+    removals = ttl_removals(synthetic, 3)
+    records = removals[:1] + synthetic.batch(2, event_name='MODIFY') + removals[1:]
+    events_clnt = FailingClient()
+    failed = init.put_records(records, 'default-bus', _events_clnt=events_clnt)
+
+    # The removals the summary covered fail, in batch order.
+    assert len(events_clnt.entries) == 2
+    assert failed == [r['dynamodb']['SequenceNumber'] for r in removals]
+
+    # Unless the summary is spooled.
+    monkeypatch.setattr(spool, 'FAILED_SPOOL', str(tmp_path))
+    assert init.put_records(records, 'default-bus', _events_clnt=FailingClient()) == []
+
+def test_put_records_ttl_detail_type(monkeypatch):
+    monkeypatch.setattr(routing, 'ROUTES', routing.load_routes({
+        '*': {'ttl': 'keys', 'ttlDetailTypeFmt': 'Expired {tableARN}'},
+    }))
+    synthetic = SyntheticRecords()
+    records = synthetic.batch(2, event_name='REMOVE') + ttl_removals(synthetic, 2)
+    events_clnt = EntriesClient()
+    init.put_records(records, 'default-bus', _events_clnt=events_clnt)
+
+    entries = events_clnt.entries
+    assert [e['DetailType'].split(' ')[0] for e in entries] == \
+        ['DynamoDB', 'DynamoDB', 'Expired', 'Expired']
+    assert 'OldImage' not in json.loads(entries[2]['Detail'])
+    assert 'OldImage' in json.loads(entries[0]['Detail'])
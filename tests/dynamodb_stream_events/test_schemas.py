@@ -0,0 +1,135 @@
+from decimal import Decimal
+
+import pytest
+
+from dynamodb_stream_events import schemas, streams
+from dynamodb_stream_events.types import Binary, TypeDeserializer
+from synthetic import RecordShape, SyntheticRecords
+
+IMAGE = {
+    'pk': {'S': 'item'},
+    'count': {'N': '12.5'},
+    'active': {'BOOL': True},
+    'nothing': {'NULL': True},
+    'data': {'B': 'AQID'},
+    'tags': {'SS': ['a', 'b']},
+    'numbers': {'NS': ['1', '2']},
+    'blobs': {'BS': ['AQID']},
+    'list': {'L': [{'S': 'a'}, {'N': '1'}]},
+    'map': {'M': {'a': {'S': 'b'}}},
+}
+
+@pytest.fixture
+def decoders(monkeypatch):
+    monkeypatch.setattr(schemas, 'SCHEMA_DECODERS', True)
+    schemas._decoders.clear()
+    yield schemas._decoders
+    schemas._decoders.clear()
+
+def test_generate_decoder():
+    deser = TypeDeserializer()
+    decode = schemas.generate_decoder(schemas.image_shape(IMAGE), deser)
+    result = decode(IMAGE)
+
+    assert result == deser.deserialize({'M': IMAGE})
+    assert list(result) == list(IMAGE)
+    assert result['count'] == Decimal('12.5')
+    assert result['data'] == Binary(b'\x01\x02\x03')
+
+    with pytest.raises(KeyError):
+        decode(dict(IMAGE, count={'S': '12.5'}))
+
+def test_generate_decoder_names():
+    image = {"it's": {'S': 'a'}, 'x}{y': {'N': '1'}, '"\n': {'S': 'b'}}
+    decode = schemas.generate_decoder(schemas.image_shape(image), TypeDeserializer())
+    assert decode(image) == {"it's": 'a', 'x}{y': Decimal(1), '"\n': 'b'}
+
+def test_schema_decoder():
+    decoder = schemas.SchemaDecoder(min_records=3)
+    deser = TypeDeserializer()
+    for _ in range(3):
+        assert decoder.decode(IMAGE) == deser.deserialize({'M': IMAGE})
+    assert decoder.decoder is not None
+
+    assert decoder.decode(IMAGE) == deser.deserialize({'M': IMAGE})
+    assert decoder.hits == 1
+
+    # Images that don't have the shape use the generic path.
+    other_type = dict(IMAGE, count={'S': 'many'})
+    assert decoder.decode(other_type)['count'] == 'many'
+    other_names = dict(IMAGE, extra={'S': 'x'})
+    assert decoder.decode(other_names)['extra'] == 'x'
+    reordered = dict(reversed(IMAGE.items()))
+    assert list(decoder.decode(reordered)) == list(reordered)
+
+    # When most images don't fit, the shape is inferred again.
+    assert decoder.decoder is None
+    assert decoder.misses == 0
+    for _ in range(3):
+        decoder.decode(other_names)
+    assert decoder.names == tuple(other_names)
+
+def test_schema_decoder_no_common_shape():
+    decoder = schemas.SchemaDecoder(min_records=4)
+    for _ in range(schemas.MAX_OBSERVATIONS):
+        assert decoder.names is None
+        for idx in range(4):
+            decoder.decode({f"attr{idx}": {'S': 'a'}})
+    # It gives up, and decodes them all with the generic deserializer.
+    assert decoder.names is not None
+    assert decoder.decoder is None
+    for _ in range(4):
+        assert decoder.decode({'attr0': {'S': 'a'}}) == {'attr0': 'a'}
+    assert decoder.decoder is None
+
+def test_schema_decoder_observe_again():
+    decoder = schemas.SchemaDecoder(min_records=4)
+    for idx in range(4):
+        decoder.decode({f"attr{idx}": {'S': 'a'}})
+    assert decoder.decoder is None
+
+    # The next images have a common shape.
+    for _ in range(4):
+        decoder.decode(IMAGE)
+    assert decoder.decoder is not None
+    assert decoder.names == tuple(IMAGE)
+
+def test_schema_decoder_reordered():
+    decoder = schemas.SchemaDecoder(min_records=6)
+    reordered = dict(reversed(IMAGE.items()))
+    # No order is half the images, but the attributes are.
+    images = [IMAGE, reordered, IMAGE, {'a': {'S': 'a'}}, {'b': {'N': '1'}}, {'c': {'S': 'c'}}]
+    for image in images:
+        decoder.decode(image)
+
+    # The decoder is for the most common order.
+    assert decoder.names == tuple(IMAGE)
+    deser = TypeDeserializer()
+    assert decoder.decode(reordered) == deser.deserialize({'M': reordered})
+    assert list(decoder.decode(reordered)) == list(reordered)
+    assert decoder.decode(IMAGE) == deser.deserialize({'M': IMAGE})
+    assert decoder.hits == 1
+
+def test_get_schema_decoder(monkeypatch, decoders):
+    decoder = schemas.get_schema_decoder('Table', 'Image')
+    assert decoder is schemas.get_schema_decoder('Table', 'Image')
+    assert decoder is not schemas.get_schema_decoder('Table', 'Keys')
+    assert schemas.get_schema_decoder(None, 'Image') is None
+
+    monkeypatch.setattr(schemas, 'SCHEMA_DECODERS', False)
+    assert schemas.get_schema_decoder('Table', 'Image') is None
+
+def test_generate_records(monkeypatch, decoders):
+    shape = RecordShape(width=12, depth=1)
+    records = SyntheticRecords(shape).batch(300)
+
+    monkeypatch.setattr(schemas, 'SCHEMA_DECODERS', False)
+    expected = list(streams.generate_records(records))
+    monkeypatch.setattr(schemas, 'SCHEMA_DECODERS', True)
+    result = list(streams.generate_records(records))
+
+    assert result == expected
+    assert [list(r['dynamodb'].get('NewImage', {})) for r in result] == \
+        [list(r['dynamodb'].get('NewImage', {})) for r in expected]
+    assert decoders[('SyntheticTable', 'Image')].hits > 0
+    assert decoders[('SyntheticTable', 'Keys')].hits > 0
@@ -0,0 +1,126 @@
+from datetime import datetime, timezone
+import gzip
+import json
+
+import boto3
+from moto import mock_s3
+import pytest
+
+import dynamodb_stream_events as init
+from dynamodb_stream_events import spool
+from dynamodb_stream_events.metrics import Metrics
+from dynamodb_stream_events.publish import FailedEntry
+from synthetic import SyntheticRecords
+
+def make_failed(count):
+    return [
+        FailedEntry(
+            dict(
+                Time=datetime(2020, 7, 15, idx, tzinfo=timezone.utc),
+                Source='dynamodb-streams.aws.illinois.edu',
+                Resources=['arn'],
+                DetailType='DynamoDB Streams Record INSERT',
+                Detail=json.dumps({'idx': idx}),
+                EventBusName='default',
+            ),
+            'InternalFailure',
+            'Failed',
+        )
+        for idx in range(count)
+    ]
+
+class FailingEventsClient:
+    def put_events(self, Entries):
+        #pylint: disable=invalid-name
+        return {
+            'FailedEntryCount': len(Entries),
+            'Entries': [
+                {'ErrorCode': 'InternalFailure', 'ErrorMessage': 'Failed'}
+                for _ in Entries
+            ],
+        }
+
+def test_encode_failed():
+    failed = make_failed(3)
+    data = spool.encode_failed(failed)
+    lines = gzip.decompress(data).decode('utf-8').splitlines()
+    assert json.loads(lines[0]) == {
+        'Entry': dict(failed[0].entry, Time='2020-07-15T00:00:00+00:00'),
+        'ErrorCode': 'InternalFailure',
+        'ErrorMessage': 'Failed',
+    }
+    assert spool.decode_failed(data) == failed
+
+def test_local_spool(tmp_path):
+    local_spool = spool.open_spool(f"file:{tmp_path}")
+    assert isinstance(local_spool, spool.LocalSpool)
+
+    first = local_spool.write(make_failed(2))
+    second = local_spool.write(make_failed(3))
+    assert local_spool.names() == [first, second]
+    assert first.endswith('.jsonl.gz')
+    assert local_spool.read(second) == make_failed(3)
+
+    local_spool.delete(first)
+    assert local_spool.names() == [second]
+
+def test_s3_spool(monkeypatch):
+    monkeypatch.setenv('AWS_DEFAULT_REGION', 'us-east-2')
+    monkeypatch.setenv('AWS_ACCESS_KEY_ID', 'testing')
+    monkeypatch.setenv('AWS_SECRET_ACCESS_KEY', 'testing')
+    with mock_s3():
+        s3_clnt = boto3.client('s3')
+        s3_clnt.create_bucket(
+            Bucket='spool-bucket',
+            CreateBucketConfiguration={'LocationConstraint': 'us-east-2'},
+        )
+        s3_clnt.put_object(Bucket='spool-bucket', Key='failed/other.txt', Body=b'')
+
+        s3_spool = spool.open_spool('s3://spool-bucket/failed')
+        assert (s3_spool.bucket, s3_spool.prefix) == ('spool-bucket', 'failed/')
+        s3_spool.s3_clnt = s3_clnt
+
+        name = s3_spool.write(make_failed(4))
+        assert s3_spool.names() == [name]
+        assert s3_spool.read(name) == make_failed(4)
+
+        s3_spool.delete(name)
+        assert not s3_spool.names()
+
+def test_get_spool(monkeypatch, tmp_path):
+    monkeypatch.setattr(spool, 'FAILED_SPOOL', None)
+    assert spool.get_spool() is None
+
+    monkeypatch.setattr(spool, 'FAILED_SPOOL', str(tmp_path))
+    assert spool.get_spool() is spool.get_spool()
+
+def test_put_records_spool(monkeypatch, tmp_path, caplog):
+    monkeypatch.setattr(spool, 'FAILED_SPOOL', str(tmp_path))
+    records = SyntheticRecords().batch(12)
+    metrics = Metrics('Test')
+    init.put_records(records, _events_clnt=FailingEventsClient(), metrics=metrics)
+
+    local_spool = spool.get_spool()
+    names = local_spool.names()
+    assert len(names) == 1
+    failed = local_spool.read(names[0])
+    assert [json.loads(f.entry['Detail'])['SequenceNumber'] for f in failed] == \
+        [r['dynamodb']['SequenceNumber'] for r in records]
+    assert failed[0].error_code == 'InternalFailure'
+    assert metrics.values['EventsSpooled'] == 12
+
+    # The error log has the event that failed.
+    errors = [r.getMessage() for r in caplog.records if r.levelname == 'ERROR']
+    assert len(errors) == 12
+    assert "'DetailType': 'DynamoDB Streams Record" in errors[0]
+
+def test_put_records_spool_error(monkeypatch, tmp_path, caplog):
+    tmp_path.joinpath('file').write_text('')
+    monkeypatch.setattr(spool, 'FAILED_SPOOL', str(tmp_path / 'file'))
+    init.put_records(SyntheticRecords().batch(2), _events_clnt=FailingEventsClient())
+    assert 'Unable to spool 2 failed events' in caplog.text
+
+@pytest.mark.parametrize('url', ['', None])
+def test_put_records_no_spool(monkeypatch, url):
+    monkeypatch.setattr(spool, 'FAILED_SPOOL', url)
+    init.put_records(SyntheticRecords().batch(2), _events_clnt=FailingEventsClient())
@@ -1,9 +1,12 @@
 from datetime import datetime, timezone
 from decimal import Decimal
+import logging
 
+from freezegun import freeze_time
 import pytest
 
 from dynamodb_stream_events import streams
+from dynamodb_stream_events.metrics import Metrics
 
 FIXTURES = [
     # Empty event, with the single required field
@@ -354,3 +357,60 @@ EXPECTED = [
 @pytest.mark.parametrize("record,expected", zip(FIXTURES, EXPECTED))
 def test_fixtures(record, expected):
     assert list(streams.generate_records([record])) == [expected]
+
+@freeze_time('2020-07-15T00:00:00Z')
+def test_stream_lag_metrics():
+    now = datetime(2020, 7, 15, tzinfo=timezone.utc).timestamp()
+    records = [
+        dict(
+            eventName="INSERT",
+            dynamodb=dict(
+                ApproximateCreationDateTime=now - lag,
+                SequenceNumber=str(13021600000000001596893679 + seq_offset),
+            ),
+        )
+        for lag, seq_offset in ((1, 0), (5, 100), (3, 250))
+    ]
+    m = Metrics('Test')
+    assert len(list(streams.generate_records(records, metrics=m))) == 3
+
+    assert m.summary('StreamLag') == dict(
+        StreamLagMin=1000,
+        StreamLagP50=3000,
+        StreamLagP99=5000,
+        StreamLagMax=5000,
+    )
+    assert m.values['SequenceNumberGap'] == 250
+    assert m.values['DeserializeTime'] >= 0
+    assert m.values['DiffTime'] >= 0
+
+def test_debug_logs(caplog):
+    record = dict(
+        eventName="MODIFY",
+        dynamodb=dict(
+            NewImage=dict(Added=dict(S="a"), Same=dict(S="b")),
+            OldImage=dict(Removed=dict(S="c"), Same=dict(S="b")),
+        ),
+    )
+    with caplog.at_level(logging.DEBUG, logger=streams.__name__):
+        list(streams.generate_records([record, record], log_records={1}))
+
+    assert [r.getMessage() for r in caplog.records] == [
+        '[Record #1] Added fields: Added',
+        '[Record #1] Removed fields: Removed',
+    ]
+
+def test_debug_logs_disabled(caplog):
+    record = dict(
+        eventName="INSERT",
+        dynamodb=dict(NewImage=dict(Added=dict(S="a"))),
+    )
+    with caplog.at_level(logging.INFO, logger=streams.__name__):
+        list(streams.generate_records([record]))
+    assert not caplog.records
+
+def test_parse_table_arn():
+    arn = 'arn:aws:dynamodb:us-east-2:123456789012:table/BarkTable'
+    assert streams.parse_table_arn(f"{arn}/stream/2016-11-16T20:42:48.104") == (arn, 'BarkTable')
+    assert streams.parse_table_arn(arn) == (arn, 'BarkTable')
+    assert streams.parse_table_arn('arn:aws:kinesis:us-east-2:123456789012:stream/x') is None
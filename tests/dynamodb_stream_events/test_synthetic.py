@@ -0,0 +1,48 @@
+import pytest
+
+import dynamodb_stream_events as init
+from dynamodb_stream_events import json
+from dynamodb_stream_events.streams import generate_records
+from synthetic import RecordShape, StubEventsClient, SyntheticRecords, TYPES_ALL, VIEW_TYPES
+
+@pytest.mark.parametrize("view_type", VIEW_TYPES)
+@pytest.mark.parametrize("event_name", ['INSERT', 'MODIFY', 'REMOVE'])
+def test_view_types(view_type, event_name):
+    record = SyntheticRecords(RecordShape(view_type=view_type)).record(event_name)
+    assert record['eventName'] == event_name
+    assert ('NewImage' in record['dynamodb']) == (
+        event_name != 'REMOVE' and view_type in ('NEW_IMAGE', 'NEW_AND_OLD_IMAGES')
+    )
+    assert ('OldImage' in record['dynamodb']) == (
+        event_name != 'INSERT' and view_type in ('OLD_IMAGE', 'NEW_AND_OLD_IMAGES')
+    )
+
+@pytest.mark.parametrize("type_tag", TYPES_ALL)
+def test_types_pipeline(type_tag):
+    """ Every type makes it through the deserializer and encoder. """
+    records = SyntheticRecords(RecordShape(width=3, depth=2, types=(type_tag,))).batch(5)
+    for record in generate_records(records):
+        json.dumps(record['dynamodb'])
+
+def test_width_depth():
+    shape = RecordShape(width=7, depth=3, types=('M',))
+    record = SyntheticRecords(shape).record('INSERT')
+    image = record['dynamodb']['NewImage']
+    assert len(image) == 7 + 2
+
+    depth = 0
+    value = image['attr0']
+    while 'M' in value:
+        depth += 1
+        value = value['M']['m0']
+    assert depth == 3
+
+def test_deterministic():
+    assert SyntheticRecords(seed=1).batch(3, timestamp=0) == SyntheticRecords(seed=1).batch(3, timestamp=0)
+    assert SyntheticRecords(seed=1).batch(3, timestamp=0) != SyntheticRecords(seed=2).batch(3, timestamp=0)
+
+def test_stub_events_client():
+    events_clnt = StubEventsClient()
+    init.put_records(SyntheticRecords().batch(25), _events_clnt=events_clnt)
+    assert events_clnt.calls == 3
+    assert events_clnt.entries == 25
@@ -0,0 +1,50 @@
+from decimal import Decimal
+
+from boto3.dynamodb.types import TypeDeserializer as Boto3TypeDeserializer
+import pytest
+
+from dynamodb_stream_events import types
+
+@pytest.mark.parametrize("value", [
+    pytest.param({"NULL": True}, id="NULL"),
+    pytest.param({"BOOL": True}, id="BOOL-True"),
+    pytest.param({"BOOL": False}, id="BOOL-False"),
+    pytest.param({"N": "123"}, id="N-int"),
+    pytest.param({"N": "1.25"}, id="N-float"),
+    pytest.param({"S": "hello, world!"}, id="S"),
+    pytest.param({"NS": ["1", "2", "3"]}, id="NS"),
+    pytest.param({"SS": ["a", "b", "c"]}, id="SS"),
+    pytest.param({"L": [{"S": "a"}, {"N": "1"}, {"NULL": True}]}, id="L"),
+    pytest.param({"M": {"a": {"S": "a"}, "b": {"M": {"c": {"N": "1"}}}}}, id="M"),
+])
+def test_deserialize_matches_boto3(value):
+    """ Test that we produce the same values as boto3 for the common types. """
+    assert types.TypeDeserializer().deserialize(value) == Boto3TypeDeserializer().deserialize(value)
+
+@pytest.mark.parametrize("value,expected", [
+    pytest.param({"B": "AQID"}, types.Binary(b'\x01\x02\x03'), id="B-str"),
+    pytest.param({"B": b'\x01\x02\x03'}, types.Binary(b'\x01\x02\x03'), id="B-bytes"),
+    pytest.param({"BS": ["AQID", "BAUG"]}, {types.Binary(b'\x01\x02\x03'), types.Binary(b'\x04\x05\x06')}, id="BS"),
+    pytest.param({"N": "123"}, Decimal(123), id="N"),
+])
+def test_deserialize(value, expected):
+    assert types.TypeDeserializer().deserialize(value) == expected
+
+@pytest.mark.parametrize("value", [
+    pytest.param({}, id="empty"),
+    pytest.param({"X": "1"}, id="unknown"),
+])
+def test_deserialize_error(value):
+    with pytest.raises(TypeError):
+        types.TypeDeserializer().deserialize(value)
+
+def test_binary():
+    value = types.Binary(b'\x01\x02\x03')
+    assert value == b'\x01\x02\x03'
+    assert value == types.Binary(b'\x01\x02\x03')
+    assert value != types.Binary(b'\x04')
+    assert bytes(value) == b'\x01\x02\x03'
+    assert hash(value) == hash(b'\x01\x02\x03')
+
+    with pytest.raises(TypeError):
+        types.Binary('AQID')
@@ -0,0 +1,74 @@
+import pytest
+
+import dynamodb_stream_events as init
+from dynamodb_stream_events import workers
+from dynamodb_stream_events.metrics import Metrics
+from synthetic import RecordShape, StubEventsClient, SyntheticRecords
+
+@pytest.fixture(scope='module')
+def pool():
+    pool = workers.get_worker_pool(2, init.make_events)
+    yield pool
+    workers.close_worker_pools()
+
+def test_make_events(pool):
+    records = SyntheticRecords(RecordShape(width=10)).batch(50, timestamp=1594771200)
+    expected = list(init.make_events(records, 'test-bus'))
+
+    metrics = Metrics('Test')
+    events = pool.make_events(records, 'test-bus', metrics)
+    assert events == expected
+    assert len(metrics.observations['StreamLag']) == 50
+    assert metrics.values['EncodeTime'] > 0
+    assert metrics.values['WorkersTime'] > 0
+    assert metrics.values['SequenceNumberGap'] == \
+        int(records[-1]['dynamodb']['SequenceNumber']) - int(records[0]['dynamodb']['SequenceNumber'])
+
+    # The workers stay up for the next batch.
+    assert workers.get_worker_pool(2, init.make_events) is pool
+    assert pool.make_events(records[:3], 'test-bus') == expected[:3]
+
+def test_make_events_worker_error(pool):
+    records = SyntheticRecords().batch(4)
+    records[3] = dict(records[3], dynamodb=dict(records[3]['dynamodb'], Keys=dict(pk=dict(X='?'))))
+
+    # The failing slice is retried here, where the error is raised.
+    with pytest.raises(TypeError):
+        pool.make_events(records, 'test-bus')
+    assert not pool.broken
+
+def test_worker_exited():
+    pool = workers.WorkerPool(2, init.make_events)
+    try:
+        pool.workers[0][0].kill()
+        pool.workers[0][0].join()
+
+        records = SyntheticRecords().batch(10, timestamp=1594771200)
+        assert pool.make_events(records, 'test-bus') == list(init.make_events(records, 'test-bus'))
+        assert pool.broken
+    finally:
+        pool.close()
+
+def test_put_records_workers(monkeypatch, pool):
+    #pylint: disable=unused-argument,redefined-outer-name
+    monkeypatch.setattr(init, 'ENCODE_WORKERS', 2)
+    monkeypatch.setattr(init, 'ENCODE_WORKERS_MIN_RECORDS', 10)
+    events_clnt = StubEventsClient()
+    metrics = Metrics('Test')
+
+    init.put_records(SyntheticRecords().batch(25), _events_clnt=events_clnt, metrics=metrics)
+    assert events_clnt.entries == 25
+    assert metrics.values['EventsOut'] == 25
+    assert 'WorkersTime' in metrics.values
+
+    # Under the threshold the events are made here.
+    metrics = Metrics('Test')
+    init.put_records(SyntheticRecords().batch(5), _events_clnt=events_clnt, metrics=metrics)
+    assert 'WorkersTime' not in metrics.values
+
+    # With lanes too.
+    metrics = Metrics('Test')
+    init.put_records(SyntheticRecords().batch(25), _events_clnt=events_clnt, metrics=metrics,
+                     lanes=3)
+    assert metrics.values['EventsOut'] == 25
+    assert 'WorkersTime' in metrics.values